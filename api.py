@@ -0,0 +1,376 @@
+"""
+Versioned JSON API for vault clients (CLI, browser extension), under /api/v1.
+
+Clients sign in with POST /api/v1/session and keep the session cookie, like
+the web UI. Authorization follows the web routes: a service can be read and
+revealed by its owner, by the users it is shared with and by the members of
+the teams it is shared with.
+
+List endpoints return {"items": [...], "next_cursor": ...} pages, or every
+page as NDJSON with ?stream=1 (or Accept: application/x-ndjson). Their ETag
+(which also covers the representation; responses carry Vary: Accept) and
+Last-Modified come from the caller's change counter (see versions.py)
+and are checked before the list is queried, so polling an unchanged vault
+answers 304 Not Modified for the cost of one primary-key lookup.
+
+GET /sync?since=<cursor> returns only the services and shares that changed
+after the cursor, with tombstones for deletions (see changes.py).
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from cryptography.fernet import InvalidToken
+from flask import Blueprint, Response, current_app, jsonify, request, session, stream_with_context
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import aliased
+
+import changes
+import search
+import teams
+import versions
+from auth import authenticate, current_user, start_user_session
+from crypto_utils import decrypt_password
+from models import db, User, Service, Share, PendingInvite
+from passwords import HashingBusy
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def _error(message, status):
+    return jsonify(error=message), status
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+@api.before_request
+def require_login():
+    if request.endpoint != 'api.create_session' and 'user_id' not in session:
+        return _error('Authentication required', 401)
+
+
+# ---------------- CONDITIONAL LISTS ----------------
+
+def _validators(user_id, mimetype):
+    """
+    Strong ETag and Last-Modified for this list request, from the user's change counter.
+    The ETag covers the negotiated representation: a JSON page and the NDJSON stream
+    of the same list are different bodies.
+    """
+    version, updated_at = versions.current(user_id)
+    key = _dumps([user_id, version, request.path, sorted(request.args.items(multi=True)), mimetype])
+    return hashlib.sha256(key.encode()).hexdigest()[:32], updated_at
+
+
+def _last_modified_header(updated_at):
+    # A timestamp only identifies a version once its second is over: a second change
+    # within the same second would otherwise get the same Last-Modified
+    if updated_at and datetime.utcnow() - updated_at >= timedelta(seconds=1):
+        return updated_at.replace(microsecond=0)
+    return None
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def _page_size():
+    limit = request.args.get('limit', type=int) or current_app.config['API_PAGE_SIZE']
+    return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+
+def _list_response(fetch_page, serialize):
+    """
+    Answer a list request: 304 if the client's copy is current, otherwise one page
+    as JSON or every page as NDJSON. fetch_page(cursor, limit) returns (rows, next cursor).
+    """
+    stream = (request.args.get('stream') in ('1', 'true')
+              or request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+              == 'application/x-ndjson')
+    etag, updated_at = _validators(session['user_id'], 'application/x-ndjson' if stream else 'application/json')
+    last_modified = _last_modified_header(updated_at)
+    if _not_modified(etag, last_modified):
+        response = Response(status=304)
+    elif stream:
+        chunk_size = current_app.config['API_MAX_PAGE_SIZE']
+        try:
+            first_chunk = fetch_page(request.args.get('cursor'), chunk_size)
+        except ValueError:
+            return _error('Invalid cursor', 400)
+
+        def generate():
+            rows, cursor = first_chunk
+            while True:
+                if rows:
+                    yield ''.join(_dumps(serialize(row)) + '\n' for row in rows)
+                if not cursor:
+                    break
+                # Release the chunk's ORM objects before fetching the next one
+                db.session.expunge_all()
+                rows, cursor = fetch_page(cursor, chunk_size)
+
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    else:
+        try:
+            rows, next_cursor = fetch_page(request.args.get('cursor'), _page_size())
+        except ValueError:
+            return _error('Invalid cursor', 400)
+        response = Response(_dumps({'items': [serialize(row) for row in rows], 'next_cursor': next_cursor}),
+                            mimetype='application/json')
+
+    response.set_etag(etag)
+    # Both representations live at the same URL, so caches must key on Accept as well
+    response.vary.add('Accept')
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _id_page(query, id_column):
+    """fetch_page for lists ordered by a primary key; the cursor is the last id seen"""
+    def fetch_page(cursor, limit):
+        page_query = query if not cursor else query.filter(id_column > int(cursor))
+        rows = page_query.order_by(id_column).limit(limit + 1).all()
+        next_cursor = str(rows[limit - 1].id) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+    return fetch_page
+
+
+# ---------------- SESSION ----------------
+
+@api.route('/session', methods=['POST'])
+def create_session():
+    """Sign in with {"email", "password"}; the session cookie authenticates later calls"""
+    data = request.get_json(silent=True) or {}
+    email = str(data.get('email', '')).strip().lower()
+    password = str(data.get('password', ''))
+    try:
+        user = authenticate(email, password) if email and password else None
+    except HashingBusy:
+        return _error('The vault is busy, try again shortly', 503)
+    if not user:
+        return _error('Invalid credentials', 401)
+    start_user_session(user.id)
+    return jsonify(user={'id': user.id, 'email': user.email})
+
+
+@api.route('/session', methods=['DELETE'])
+def delete_session():
+    session.clear()
+    return Response(status=204)
+
+
+@api.route('/me')
+def me():
+    return jsonify(user={'id': current_user.id, 'email': current_user.email})
+
+
+# ---------------- SERVICES ----------------
+
+@api.route('/services')
+def list_services():
+    """
+    Your services (scope=owned, the default), services shared with you (scope=shared)
+    or with your teams (scope=team), by name
+    """
+    user_id = session['user_id']
+    q = request.args.get('q', '').strip()
+    scope = request.args.get('scope', 'owned')
+
+    if scope == 'owned':
+        query = (db.session.query(Service, search.sort_key().label('sort_name'))
+                 .filter(Service.owner_id == user_id))
+
+        def serialize(row):
+            return {'id': row.Service.id, 'name': row.Service.name, 'username': row.Service.username}
+    elif scope == 'shared':
+        query = (db.session.query(Service, Share.id.label('share_id'), User.email.label('shared_by'),
+                                  search.sort_key().label('sort_name'))
+                 .join(Share, Share.service_id == Service.id)
+                 .join(User, Share.shared_by == User.id)
+                 .filter(Share.shared_to == user_id))
+
+        def serialize(row):
+            return {'id': row.Service.id, 'name': row.Service.name, 'username': row.Service.username,
+                    'share_id': row.share_id, 'shared_by': row.shared_by}
+    elif scope == 'team':
+        query = (db.session.query(Service, teams.team_name_for(user_id).label('team'), User.email.label('owner'),
+                                  search.sort_key().label('sort_name'))
+                 .join(User, Service.owner_id == User.id)
+                 .filter(Service.id.in_(teams.service_ids_for(user_id)), Service.owner_id != user_id))
+
+        def serialize(row):
+            return {'id': row.Service.id, 'name': row.Service.name, 'username': row.Service.username,
+                    'team': row.team, 'owner': row.owner}
+    else:
+        return _error('scope must be owned, shared or team', 400)
+
+    return _list_response(lambda cursor, limit: search.page(query, q, cursor, limit), serialize)
+
+
+def _accessible_service(service_id):
+    """(service, None) if the current user may access it, else (None, error response)"""
+    service = db.session.get(Service, service_id)
+    if not service:
+        return None, _error('Service not found', 404)
+    if not current_app.extensions['access_control'].can_access(session['user_id'], service):
+        return None, _error("You don't have permission to access this service", 403)
+    return service, None
+
+
+@api.route('/services/<int:service_id>')
+def get_service(service_id):
+    """Service details without the password, on the same rules as access_service()"""
+    service, error = _accessible_service(service_id)
+    if error:
+        return error
+    return jsonify(id=service.id, name=service.name, username=service.username,
+                   owner_id=service.owner_id, owned=service.owner_id == session['user_id'])
+
+
+@api.route('/services/<int:service_id>/reveal', methods=['POST'])
+def reveal_service(service_id):
+    """Decrypt a credential, on the same rules as reveal(); every call is recorded in the access log"""
+    service, error = _accessible_service(service_id)
+    if error:
+        return error
+
+    current_app.extensions['access_log_writer'].record(service.id, session['user_id'], request.remote_addr)
+    try:
+        password = decrypt_password(service.password_encrypted,
+                                    current_app.extensions['data_keys'].get(service.owner_id))
+    except InvalidToken:
+        return _error('Decryption failed (invalid encryption key or corrupted data)', 500)
+
+    response = jsonify(id=service.id, name=service.name, username=service.username, password=password)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+# ---------------- SHARES & INVITES ----------------
+
+@api.route('/shares')
+def list_shares():
+    """Shares you created (scope=by_me, the default) or received (scope=to_me), oldest first"""
+    user_id = session['user_id']
+    scope = request.args.get('scope', 'by_me')
+    if scope not in ('by_me', 'to_me'):
+        return _error('scope must be by_me or to_me', 400)
+
+    # The other party: the recipient of shares you made, the sharer of shares you received
+    other, mine = (Share.shared_to, Share.shared_by) if scope == 'by_me' else (Share.shared_by, Share.shared_to)
+    query = (db.session.query(Share.id, Share.service_id, Service.name.label('service_name'),
+                              User.email, Share.timestamp)
+             .join(Service, Share.service_id == Service.id)
+             .join(User, other == User.id)
+             .filter(mine == user_id))
+    email_field = 'shared_with' if scope == 'by_me' else 'shared_by'
+
+    def serialize(row):
+        return {'id': row.id, 'service_id': row.service_id, 'service_name': row.service_name,
+                email_field: row.email, 'shared_at': _isoformat(row.timestamp)}
+
+    return _list_response(_id_page(query, Share.id), serialize)
+
+
+@api.route('/invites')
+def list_invites():
+    """Pending invites you sent, oldest first"""
+    query = (db.session.query(PendingInvite.id, PendingInvite.email, PendingInvite.service_id,
+                              Service.name.label('service_name'), PendingInvite.created_at)
+             .outerjoin(Service, PendingInvite.service_id == Service.id)
+             .filter(PendingInvite.invited_by == session['user_id']))
+
+    def serialize(row):
+        return {'id': row.id, 'email': row.email, 'service_id': row.service_id,
+                'service_name': row.service_name, 'created_at': _isoformat(row.created_at)}
+
+    return _list_response(_id_page(query, PendingInvite.id), serialize)
+
+
+# ---------------- SYNC ----------------
+
+def _changed_services(user_id, service_ids):
+    """Current state of the services in service_ids that user_id can still see"""
+    if not service_ids:
+        return []
+    rows = (db.session.query(Service.id, Service.name, Service.username, Service.owner_id)
+            .outerjoin(Share, and_(Share.service_id == Service.id, Share.shared_to == user_id))
+            .filter(Service.id.in_(service_ids), or_(Service.owner_id == user_id, Share.id.isnot(None),
+                                                     Service.id.in_(teams.service_ids_for(user_id))))
+            .all())
+    return [{'id': row.id, 'name': row.name, 'username': row.username,
+             'owner_id': row.owner_id, 'owned': row.owner_id == user_id} for row in rows]
+
+
+def _changed_shares(user_id, share_ids):
+    """Current state of the shares in share_ids that user_id made or received"""
+    if not share_ids:
+        return []
+    sharer, recipient = aliased(User), aliased(User)
+    rows = (db.session.query(Share.id, Share.service_id, Service.name.label('service_name'),
+                             sharer.email.label('shared_by'), recipient.email.label('shared_with'),
+                             Share.timestamp)
+            .join(Service, Share.service_id == Service.id)
+            .join(sharer, Share.shared_by == sharer.id)
+            .join(recipient, Share.shared_to == recipient.id)
+            .filter(Share.id.in_(share_ids), or_(Share.shared_by == user_id, Share.shared_to == user_id))
+            .all())
+    return [{'id': row.id, 'service_id': row.service_id, 'service_name': row.service_name,
+             'shared_by': row.shared_by, 'shared_with': row.shared_with,
+             'shared_at': _isoformat(row.timestamp)} for row in rows]
+
+
+@api.route('/sync')
+def sync():
+    """
+    Services and shares changed since the cursor. Without ?since, returns just a
+    cursor: take it, load the lists, then poll with since=<cursor>. Keep calling
+    with the returned cursor while has_more is true.
+    """
+    user_id = session['user_id']
+    since = request.args.get('since')
+    if since is None:
+        response = jsonify(cursor=str(changes.latest_cursor(user_id)), has_more=False,
+                           services=[], shares=[], deleted={'services': [], 'shares': []})
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    try:
+        latest, cursor, has_more = changes.since(user_id, int(since), current_app.config['SYNC_MAX_CHANGES'])
+    except ValueError:
+        return _error('Invalid cursor', 400)
+    except changes.CursorExpired:
+        return jsonify(error='Cursor expired; reload the lists and sync from the new cursor',
+                       cursor=str(changes.latest_cursor(user_id))), 410
+
+    # Every changed object is looked up, deletes included: revoking one grant doesn't hide
+    # a service the user can still reach another way (directly and through a team)
+    changed = {kind: [object_id for (k, object_id) in latest if k == kind] for kind in changes.KINDS}
+    services = _changed_services(user_id, changed['service'])
+    shares = _changed_shares(user_id, changed['share'])
+
+    # Anything no longer visible (deleted or revoked) is a tombstone
+    present = {'service': {item['id'] for item in services}, 'share': {item['id'] for item in shares}}
+    deleted = {kind: sorted(object_id for (k, object_id) in latest
+                            if k == kind and object_id not in present[kind])
+               for kind in changes.KINDS}
+
+    response = Response(_dumps({'cursor': str(cursor), 'has_more': has_more,
+                                'services': services, 'shares': shares,
+                                'deleted': {'services': deleted['service'], 'shares': deleted['share']}}),
+                        mimetype='application/json')
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
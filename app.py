@@ -1,211 +1,148 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from flask_mail import Mail, Message
-from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, User, Service, Share, AccessLog, PendingInvite
+from flask import Blueprint, Flask, Response, current_app, render_template, request, redirect, url_for, flash, session, stream_with_context, has_request_context
+from flask_mail import Mail
+from models import db, User, Service, Share, AccessLog, PendingInvite, Team, TeamMember, TeamShare, apply_sqlite_pragmas
 from config import Config
+from sqlalchemy import delete, func, insert, literal, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 from crypto_utils import encrypt_password, decrypt_password
 from cryptography.fernet import InvalidToken
-from threading import Thread
-
-app = Flask(__name__)
-app.config.from_object(Config)
-db.init_app(app)
-mail = Mail(app)
-
-# Initialize database tables
-with app.app_context():
-    db.create_all()
+import csv
+import io
+import json
+import os
+import re
+from rotation import migrate_to_data_keys, rotate_service_keys
+from retention import archive_access_logs
+from transfer import ArchiveError, export_services, import_services, read_records
+from migrations import upgrade_schema
+import changes
+import search
+import teams
+import versions
+from mailer import EmailOutbox, build_emails
+from authz import AccessControl
+from datakeys import DataKeys
+from audit import AccessLogWriter
+from passwords import PasswordHasher, HashingBusy
+from metrics import RequestMetrics
+from fragments import FragmentCache
+from auth import authenticate, current_user, forget_user, login_required, start_user_session
+from sessions import DatabaseSessionInterface, purge_expired_sessions, revoke_user_sessions
+from api import api
+import click
+
+bp = Blueprint('vault', __name__, cli_group=None)
+
+mail = Mail()
+outbox = EmailOutbox()
+access = AccessControl()
+access_log = AccessLogWriter()
+passwords = PasswordHasher()
+request_metrics = RequestMetrics()
+fragment_cache = FragmentCache()
+data_keys = DataKeys()
+
+def create_app(config_class=Config):
+    """
+    Build the Flask app. Nothing here touches the database: the engine connects
+    on first use, and tables are created by `flask --app app upgrade-db`.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    db.init_app(app)
+    mail.init_app(app)
+    outbox.init_app(app, mail)
+    access.init_app(app)
+    access_log.init_app(app)
+    passwords.init_app(app)
+    request_metrics.init_app(app)
+    fragment_cache.init_app(app)
+    data_keys.init_app(app)
+    if app.config['SESSION_BACKEND'] == 'database':
+        app.session_interface = DatabaseSessionInterface()
+    with app.app_context():
+        # Only registers a connect listener; no connection is opened yet
+        apply_sqlite_pragmas(db.engine, app.config['SQLITE_PRAGMAS'])
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+    return app
 
 # ---------------- HELPER FUNCTIONS ----------------
 
-def send_async_email(app, msg):
-    """Send email asynchronously in a background thread"""
-    with app.app_context():
-        try:
-            mail.send(msg)
-            print(f"✅ Email sent successfully to {msg.recipients}")
-        except Exception as e:
-            print(f"❌ Error sending email to {msg.recipients}: {e}")
-
-def send_invitation_email(recipient_email, service_name, inviter_email):
+@bp.before_app_request
+def start_email_outbox():
+    """Start this worker's outbox threads so mail left over from a restart gets delivered"""
+    outbox.start()
+
+def email_base_url(base_url=None):
+    """Site root used for links in emails; falls back to BASE_URL outside a request"""
+    if not base_url:
+        base_url = request.url_root if has_request_context() else current_app.config['BASE_URL']
+    return base_url if base_url.endswith('/') else base_url + '/'
+
+def invitation_emails(recipient_emails, service_name, inviter_email, base_url=None):
+    """Build invitation emails for unregistered users"""
+    return build_emails(
+        'invitation',
+        subject=f"You've been invited to access {service_name} on CredVault",
+        recipients=recipient_emails,
+        sender=current_app.config['MAIL_DEFAULT_SENDER'],
+        base_url=email_base_url(base_url),
+        service_name=service_name,
+        inviter_email=inviter_email
+    )
+
+def share_notification_emails(recipient_emails, service_name, inviter_email, base_url=None):
+    """Build notification emails for registered users a service was shared with"""
+    return build_emails(
+        'share_notification',
+        subject=f"{inviter_email} shared {service_name} with you on CredVault",
+        recipients=recipient_emails,
+        sender=current_app.config['MAIL_DEFAULT_SENDER'],
+        base_url=email_base_url(base_url),
+        service_name=service_name,
+        inviter_email=inviter_email
+    )
+
+def send_invitation_email(recipient_email, service_name, inviter_email, base_url=None):
     """Send invitation email to unregistered user (non-blocking)"""
     try:
-        msg = Message(
-            subject=f"You've been invited to access {service_name} on CredVault",
-            recipients=[recipient_email],
-            sender=app.config['MAIL_DEFAULT_SENDER']
-        )
-
-        # Email body
-        msg.body = f"""
-Hello!
-
-{inviter_email} has invited you to access their "{service_name}" credentials on CredVault.
-
-To accept this invitation and view the shared credentials:
-
-1. Visit: {request.url_root}register
-2. Register with this email address: {recipient_email}
-3. Login and access the shared service from your dashboard
-
-CredVault is a secure password vault that allows you to store and share credentials safely.
-
-Best regards,
-CredVault Team
-        """
-
-        msg.html = f"""
-<html>
-<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-    <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 5px;">
-        <h2 style="color: #007bff;">🔐 CredVault Invitation</h2>
-
-        <p>Hello!</p>
-
-        <p><strong>{inviter_email}</strong> has invited you to access their <strong>"{service_name}"</strong> credentials on CredVault.</p>
-
-        <div style="background-color: #f8f9fa; padding: 15px; border-left: 4px solid #007bff; margin: 20px 0;">
-            <h3 style="margin-top: 0;">To accept this invitation:</h3>
-            <ol>
-                <li>Visit: <a href="{request.url_root}register" style="color: #007bff;">{request.url_root}register</a></li>
-                <li>Register with this email address: <strong>{recipient_email}</strong></li>
-                <li>Login and access the shared service from your dashboard</li>
-            </ol>
-        </div>
-
-        <p style="color: #666; font-size: 14px;">CredVault is a secure password vault that allows you to store and share credentials safely with end-to-end encryption.</p>
-
-        <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
-
-        <p style="color: #999; font-size: 12px;">
-            This is an automated message from CredVault. If you didn't expect this invitation, you can safely ignore this email.
-        </p>
-    </div>
-</body>
-</html>
-        """
-
-        # Send email asynchronously to avoid blocking
-        Thread(target=send_async_email, args=(app._get_current_object(), msg)).start()
+        # Queue for the outbox workers to avoid blocking
+        outbox.enqueue_many(invitation_emails([recipient_email], service_name, inviter_email, base_url))
         return True
     except Exception as e:
         print(f"Error preparing email: {e}")
         return False
 
-def send_share_notification_email(recipient_email, service_name, inviter_email):
+def send_share_notification_email(recipient_email, service_name, inviter_email, base_url=None):
     """Send notification email to registered user when service is shared (non-blocking)"""
     try:
-        msg = Message(
-            subject=f"{inviter_email} shared {service_name} with you on CredVault",
-            recipients=[recipient_email],
-            sender=app.config['MAIL_DEFAULT_SENDER']
-        )
-
-        msg.body = f"""
-Hello!
-
-{inviter_email} has shared their "{service_name}" credentials with you on CredVault.
-
-You can now access this service by:
-1. Logging into CredVault: {request.url_root}login
-2. Check the "Shared With You" section on your dashboard
-
-Best regards,
-CredVault Team
-        """
-
-        msg.html = f"""
-<html>
-<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-    <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 5px;">
-        <h2 style="color: #28a745;">✅ New Service Shared With You</h2>
-
-        <p>Hello!</p>
-
-        <p><strong>{inviter_email}</strong> has shared their <strong>"{service_name}"</strong> credentials with you on CredVault.</p>
-
-        <div style="background-color: #d4edda; padding: 15px; border-left: 4px solid #28a745; margin: 20px 0;">
-            <h3 style="margin-top: 0; color: #155724;">Access the shared service:</h3>
-            <ol>
-                <li>Login to CredVault: <a href="{request.url_root}login" style="color: #28a745;">{request.url_root}login</a></li>
-                <li>Check the "Shared With You" section on your dashboard</li>
-                <li>Click "Access" to view the credentials</li>
-            </ol>
-        </div>
-
-        <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
-
-        <p style="color: #999; font-size: 12px;">
-            This is an automated message from CredVault.
-        </p>
-    </div>
-</body>
-</html>
-        """
-
-        # Send email asynchronously to avoid blocking
-        Thread(target=send_async_email, args=(app._get_current_object(), msg)).start()
+        # Queue for the outbox workers to avoid blocking
+        outbox.enqueue_many(share_notification_emails([recipient_email], service_name, inviter_email, base_url))
         return True
     except Exception as e:
         print(f"Error preparing email: {e}")
         return False
 
-def send_welcome_email(recipient_email, shared_services_count):
+def send_welcome_email(recipient_email, shared_services_count, base_url=None):
     """Send welcome email to new user with pending invites (non-blocking)"""
     try:
-        msg = Message(
+        messages = build_emails(
+            'welcome',
             subject="Welcome to CredVault! You have shared services waiting",
             recipients=[recipient_email],
-            sender=app.config['MAIL_DEFAULT_SENDER']
+            sender=current_app.config['MAIL_DEFAULT_SENDER'],
+            base_url=email_base_url(base_url),
+            shared_services_count=shared_services_count
         )
 
-        msg.body = f"""
-Welcome to CredVault!
-
-Your account has been successfully created.
-
-Good news! You have {shared_services_count} service(s) that have been shared with you.
-
-Login now to access them: {request.url_root}login
-
-Best regards,
-CredVault Team
-        """
-
-        msg.html = f"""
-<html>
-<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-    <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 5px;">
-        <h2 style="color: #28a745;">🎉 Welcome to CredVault!</h2>
-
-        <p>Your account has been successfully created.</p>
-
-        <div style="background-color: #d4edda; padding: 15px; border-left: 4px solid #28a745; margin: 20px 0;">
-            <h3 style="margin-top: 0; color: #155724;">🎁 You have {shared_services_count} service(s) shared with you!</h3>
-            <p>Someone has already shared credentials with you. Login now to access them.</p>
-            <p style="text-align: center; margin-top: 15px;">
-                <a href="{request.url_root}login" style="background-color: #28a745; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block;">Login to CredVault</a>
-            </p>
-        </div>
-
-        <p style="color: #666; font-size: 14px;">CredVault is a secure password vault that allows you to store and share credentials safely with end-to-end encryption.</p>
-
-        <hr style="border: none; border-top: 1px solid #ddd; margin: 20px 0;">
-
-        <p style="color: #999; font-size: 12px;">
-            This is an automated message from CredVault.
-        </p>
-    </div>
-</body>
-</html>
-        """
-
-        # Send email asynchronously to avoid blocking
-        Thread(target=send_async_email, args=(app._get_current_object(), msg)).start()
+        # Queue for the outbox workers to avoid blocking
+        outbox.enqueue_many(messages)
         return True
     except Exception as e:
         print(f"Error preparing email: {e}")
@@ -213,7 +150,32 @@ CredVault Team
 
 # ---------------- AUTH ----------------
 
-@app.route('/register', methods=['GET', 'POST'])
+def convert_pending_invites(user):
+    """
+    Turn every PendingInvite for user.email into a Share with one INSERT ... SELECT
+    and one DELETE. Runs in the caller's transaction; returns the number converted.
+    """
+    invites = PendingInvite.__table__.c
+    converted = db.session.execute(
+        insert(Share).from_select(
+            ['service_id', 'shared_to', 'shared_by', 'timestamp'],
+            select(invites.service_id, literal(user.id), invites.invited_by, literal(datetime.utcnow()))
+            .where(invites.email == user.email)
+        )
+    ).rowcount
+    if converted:
+        db.session.execute(delete(PendingInvite).where(PendingInvite.email == user.email))
+        shares = db.session.execute(
+            select(Share.id, Share.service_id, Share.shared_by).where(Share.shared_to == user.id)
+        ).all()
+        changes.record_many(
+            [(user.id, 'service', share.service_id, 'upsert') for share in shares]
+            + [(user_id, 'share', share.id, 'upsert')
+               for share in shares for user_id in (user.id, share.shared_by)]
+        )
+    return converted
+
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         email = request.form['email'].strip().lower()
@@ -222,130 +184,246 @@ def register():
         # Validation
         if not email or not password:
             flash("Email and password are required!", "danger")
-            return redirect(url_for('register'))
+            return redirect(url_for('.register'))
 
         if len(password) < 6:
             flash("Password must be at least 6 characters long!", "danger")
-            return redirect(url_for('register'))
+            return redirect(url_for('.register'))
 
         if User.query.filter_by(email=email).first():
             flash("❌ Email already exists! Please login instead.", "danger")
-            return redirect(url_for('register'))
+            return redirect(url_for('.register'))
 
-        hashed_pw = generate_password_hash(password)
+        try:
+            hashed_pw = passwords.hash(password)
+        except HashingBusy:
+            flash("⏳ The vault is busy right now. Please try again in a moment.", "warning")
+            return render_template('register.html'), 503
         new_user = User(email=email, password_hash=hashed_pw)
         db.session.add(new_user)
-        db.session.commit()
-
-        # Check for pending invites and convert them to shares
-        pending_invites = PendingInvite.query.filter_by(email=email).all()
-        if pending_invites:
-            for invite in pending_invites:
-                share = Share(
-                    service_id=invite.service_id,
-                    shared_to=new_user.id,
-                    shared_by=invite.invited_by
-                )
-                db.session.add(share)
-                db.session.delete(invite)
+        try:
+            # User creation and invite conversion commit together, or not at all
+            db.session.flush()
+            converted = convert_pending_invites(new_user)
             db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash("❌ Email already exists! Please login instead.", "danger")
+            return redirect(url_for('.register'))
+
+        if converted:
+            access.invalidate(new_user.id)
 
             # Send welcome email with shared services info
-            send_welcome_email(email, len(pending_invites))
+            send_welcome_email(email, converted)
 
-            flash(f"🎉 Registered successfully! You have {len(pending_invites)} service(s) shared with you. Check your email!", "success")
+            flash(f"🎉 Registered successfully! You have {converted} service(s) shared with you. Check your email!", "success")
         else:
             flash("✅ Registered successfully! Please login to continue.", "success")
 
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
     return render_template('register.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email'].strip().lower()
         password = request.form['password']
-        user = User.query.filter_by(email=email).first()
+        try:
+            user = authenticate(email, password)
+        except HashingBusy:
+            flash("⏳ The vault is busy right now. Please try again in a moment.", "warning")
+            return render_template('login.html'), 503
 
-        if user and check_password_hash(user.password_hash, password):
-            session['user_id'] = user.id
+        if user:
+            start_user_session(user.id)
             flash("Login successful!", "success")
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('.dashboard'))
         else:
             flash("Invalid credentials.", "danger")
     return render_template('login.html')
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
     flash("Logged out.", "info")
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
 # ---------------- DASHBOARD ----------------
 
-@app.route('/')
+@bp.route('/')
+@login_required
 def home():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    return redirect(url_for('dashboard'))
-
-@app.route('/dashboard')
+    return redirect(url_for('.dashboard'))
+
+def _owned_services_page(user_id, q=None, cursor=None):
+    """One page of the user's services matching q, in name order; returns (services, next cursor)"""
+    query = (db.session.query(Service, search.sort_key().label('sort_name'))
+             .filter(Service.owner_id == user_id))
+    return search.page(query, q, cursor, current_app.config['SERVICES_PER_PAGE'])
+
+def _shared_services_page(user_id, q=None, cursor=None):
+    """One page of services shared with the user; returns (dicts for the template, next cursor)"""
+    query = (db.session.query(Share.id, Service, User.email, Share.timestamp, search.sort_key().label('sort_name'))
+             .join(Service, Share.service_id == Service.id)
+             .join(User, Share.shared_by == User.id)
+             .filter(Share.shared_to == user_id))
+    rows, next_cursor = search.page(query, q, cursor, current_app.config['SERVICES_PER_PAGE'])
+    return [{
+        'share_id': share_id,
+        'service_id': service.id,
+        'service_name': service.name,
+        'service_username': service.username,
+        'shared_by_email': shared_by_email,
+        'shared_at': shared_at,
+    } for share_id, service, shared_by_email, shared_at, _ in rows], next_cursor
+
+def _team_services_page(user_id, q=None, cursor=None):
+    """One page of services shared with the user's teams (not their own); returns (dicts for the template, next cursor)"""
+    query = (db.session.query(Service, teams.team_name_for(user_id).label('team_name'), User.email,
+                              search.sort_key().label('sort_name'))
+             .join(User, Service.owner_id == User.id)
+             .filter(Service.id.in_(teams.service_ids_for(user_id)), Service.owner_id != user_id))
+    rows, next_cursor = search.page(query, q, cursor, current_app.config['SERVICES_PER_PAGE'])
+    return [{
+        'service_id': service.id,
+        'service_name': service.name,
+        'service_username': service.username,
+        'team_name': team_name,
+        'owner_email': owner_email,
+    } for service, team_name, owner_email, _ in rows], next_cursor
+
+@bp.route('/dashboard')
+@login_required
 def dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
+    """First page of each section; later pages load from dashboard_section()"""
 
     user_id = session['user_id']
-    services = Service.query.filter_by(owner_id=user_id).all()
-    shares = Share.query.filter_by(shared_to=user_id).all()
+    q = request.args.get('q', '').strip()
+    if q:
+        # Search results aren't cached, only the plain dashboard
+        content = _dashboard_content(user_id, q)
+    else:
+        content = fragment_cache.render(user_id, 'dashboard', lambda: _dashboard_content(user_id, q))
+    return render_template('dashboard.html', content=content)
 
-    # Enrich shares with service details and sharer info (services shared WITH you)
-    shared_services = []
-    for share in shares:
-        service = Service.query.get(share.service_id)
-        sharer = User.query.get(share.shared_by)
-        if service and sharer:
-            shared_services.append({
-                'share_id': share.id,
-                'service_id': service.id,
-                'service_name': service.name,
-                'service_username': service.username,
-                'shared_by_email': sharer.email,
-                'shared_at': share.timestamp
-            })
+def _dashboard_content(user_id, q):
+    """The dashboard's page content, cached by fragment_cache when there is no search"""
+    services, services_cursor = _owned_services_page(user_id, q)
+    services = [service for service, _ in services]
+
+    # Services shared WITH you - service and sharer are joined into the same query
+    shared_services, shared_cursor = _shared_services_page(user_id, q)
 
-    # Get services you've shared with others (services shared BY you)
-    my_shares = Share.query.filter_by(shared_by=user_id).all()
+    # Services shared with your teams, resolved through membership in the same query
+    team_services, team_cursor = _team_services_page(user_id, q)
+
+    # Services shared BY you - only a preview is shown here, My Shares lists them all
+    shared_by_me = Share.query.filter_by(shared_by=user_id)
+    shared_by_me_count = shared_by_me.count()
     services_i_shared = []
-    for share in my_shares:
-        service = Service.query.get(share.service_id)
-        recipient = User.query.get(share.shared_to)
-        if service and recipient:
+    for share in (shared_by_me
+                  .options(joinedload(Share.service), joinedload(Share.recipient))
+                  .order_by(Share.timestamp.desc())
+                  .limit(3)):
+        if share.service and share.recipient:
             services_i_shared.append({
                 'share_id': share.id,
-                'service_id': service.id,
-                'service_name': service.name,
-                'shared_with_email': recipient.email,
+                'service_id': share.service.id,
+                'service_name': share.service.name,
+                'shared_with_email': share.recipient.email,
                 'shared_at': share.timestamp
             })
 
     # Get count of pending invites sent by user
     pending_invites_count = PendingInvite.query.filter_by(invited_by=user_id).count()
 
-    return render_template('dashboard.html',
+    return render_template('_dashboard.html',
+                         q=q,
                          services=services,
+                         services_next=services_cursor and url_for('.dashboard_section', section='services', q=q or None, cursor=services_cursor),
                          shared_services=shared_services,
+                         shared_next=shared_cursor and url_for('.dashboard_section', section='shared', q=q or None, cursor=shared_cursor),
+                         team_services=team_services,
+                         team_next=team_cursor and url_for('.dashboard_section', section='team', q=q or None, cursor=team_cursor),
+                         teams=teams.teams_of(user_id),
                          services_i_shared=services_i_shared,
+                         shared_by_me_count=shared_by_me_count,
                          pending_invites_count=pending_invites_count)
 
+@bp.route('/dashboard/<section>')
+@login_required
+def dashboard_section(section):
+    """
+    Next page of a dashboard section as table rows, for "Load more".
+    The URL of the page after it is sent in the X-Next-Page header.
+    """
+    user_id = session['user_id']
+    q = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor')
+    try:
+        if section == 'services':
+            services, next_cursor = _owned_services_page(user_id, q, cursor)
+            html = render_template('_service_rows.html', services=[service for service, _ in services],
+                                   teams=teams.teams_of(user_id))
+        elif section == 'shared':
+            shared_services, next_cursor = _shared_services_page(user_id, q, cursor)
+            html = render_template('_shared_rows.html', shared_services=shared_services)
+        elif section == 'team':
+            team_services, next_cursor = _team_services_page(user_id, q, cursor)
+            html = render_template('_team_rows.html', team_services=team_services)
+        else:
+            return Response("Unknown section", status=404)
+    except ValueError:
+        return Response("Invalid page cursor", status=400)
+
+    response = Response(html, mimetype='text/html')
+    if next_cursor:
+        response.headers['X-Next-Page'] = url_for('.dashboard_section', section=section, q=q or None, cursor=next_cursor)
+    return response
+
+@bp.route('/search')
+@login_required
+def search_services():
+    """
+    JSON search over your services (scope=owned, the default), services
+    shared with you (scope=shared) or with your teams (scope=team) by name
+    and username, one page per call.
+    """
+    user_id = session['user_id']
+    q = request.args.get('q', '').strip()
+    scope = request.args.get('scope', 'owned')
+    cursor = request.args.get('cursor')
+    try:
+        if scope == 'owned':
+            services, next_cursor = _owned_services_page(user_id, q, cursor)
+            results = [{'id': service.id, 'name': service.name, 'username': service.username}
+                       for service, _ in services]
+        elif scope == 'shared':
+            shared_services, next_cursor = _shared_services_page(user_id, q, cursor)
+            results = [{'id': shared['service_id'], 'name': shared['service_name'],
+                        'username': shared['service_username'], 'shared_by': shared['shared_by_email']}
+                       for shared in shared_services]
+        elif scope == 'team':
+            team_services, next_cursor = _team_services_page(user_id, q, cursor)
+            results = [{'id': shared['service_id'], 'name': shared['service_name'],
+                        'username': shared['service_username'], 'team': shared['team_name']}
+                       for shared in team_services]
+        else:
+            return {'error': 'scope must be owned, shared or team'}, 400
+    except ValueError:
+        return {'error': 'invalid cursor'}, 400
+
+    return {'results': results, 'next_cursor': next_cursor}
+
 # ---------------- ADD / SHARE / ACCESS ----------------
 
-@app.route('/add', methods=['GET', 'POST'])
+@bp.route('/add', methods=['GET', 'POST'])
+@login_required
 def add_service():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     if request.method == 'POST':
         name = request.form['name'].strip()
         username = request.form['username'].strip()
@@ -358,7 +436,7 @@ def add_service():
 
         # encrypt password before saving
         try:
-            ciphertext = encrypt_password(password)
+            ciphertext = encrypt_password(password, data_keys.get(session['user_id'], create=True))
         except Exception as e:
             flash(f"Encryption error: {str(e)}", "danger")
             return render_template('add_service.html')
@@ -370,21 +448,22 @@ def add_service():
             owner_id=session['user_id']
         )
         db.session.add(service)
+        db.session.flush()
+        changes.record('service', service.id, 'upsert', session['user_id'])
         db.session.commit()
         flash(f"✅ Service '{name}' added and encrypted successfully!", "success")
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
     return render_template('add_service.html')
 
-@app.route('/edit/<int:service_id>', methods=['GET', 'POST'])
+@bp.route('/edit/<int:service_id>', methods=['GET', 'POST'])
+@login_required
 def edit_service(service_id):
     """Edit an existing service"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
 
     service = Service.query.get(service_id)
     if not service or service.owner_id != session['user_id']:
         flash('Service not found or you do not have permission', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
 
     if request.method == 'POST':
         name = request.form['name'].strip()
@@ -402,63 +481,62 @@ def edit_service(service_id):
         # Only update password if provided
         if password:
             try:
-                service.password_encrypted = encrypt_password(password)
+                service.password_encrypted = encrypt_password(password, data_keys.get(service.owner_id, create=True))
             except Exception as e:
                 flash(f"Encryption error: {str(e)}", "danger")
                 return render_template('edit_service.html', service=service)
 
+        # Recipients and team members see the new name/username in their lists too
+        changes.record('service', service.id, 'upsert', service.owner_id, *db.session.scalars(
+            select(Share.shared_to).where(Share.service_id == service.id)), *teams.members_with_access(service.id))
         db.session.commit()
         flash(f"✅ Service '{name}' updated successfully!", "success")
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
 
     return render_template('edit_service.html', service=service)
 
-@app.route('/delete/<int:service_id>', methods=['POST'])
+@bp.route('/delete/<int:service_id>', methods=['POST'])
+@login_required
 def delete_service(service_id):
     """Delete a service and all its shares"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
 
     service = Service.query.get(service_id)
     if not service or service.owner_id != session['user_id']:
         flash('Service not found or you do not have permission', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
 
     service_name = service.name
+    shares = db.session.query(Share.id, Share.shared_to, Share.shared_by).filter_by(service_id=service_id).all()
+    recipient_ids = [share.shared_to for share in shares] + teams.members_with_access(service_id)
 
-    # Delete all shares for this service
-    Share.query.filter_by(service_id=service_id).delete()
-
-    # Delete all pending invites for this service
-    PendingInvite.query.filter_by(service_id=service_id).delete()
-
-    # Delete all access logs for this service
-    AccessLog.query.filter_by(service_id=service_id).delete()
-
-    # Delete the service
+    # One DELETE: its shares, team grants, pending invites and access logs go with it (ON DELETE CASCADE)
     db.session.delete(service)
+    changes.record_many(
+        [(user_id, 'service', service_id, 'delete') for user_id in {session['user_id'], *recipient_ids}]
+        + [(user_id, 'share', share.id, 'delete')
+           for share in shares for user_id in (share.shared_by, share.shared_to)]
+    )
     db.session.commit()
+    access.invalidate(*recipient_ids)
 
     flash(f"🗑️ Service '{service_name}' and all related data deleted successfully!", "success")
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('.dashboard'))
 
-@app.route('/share/<int:service_id>', methods=['POST'])
+@bp.route('/share/<int:service_id>', methods=['POST'])
+@login_required
 def share_service(service_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     target_email = request.form['email'].strip().lower()
 
     # ensure only owner can share
     svc = Service.query.get(service_id)
     if not svc or svc.owner_id != session['user_id']:
         flash('Not allowed to share this service', 'danger')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
 
-    # Get current user's email to prevent self-sharing
-    current_user = User.query.get(session['user_id'])
+    # Prevent self-sharing
     if current_user.email == target_email:
         flash('You cannot share a service with yourself', 'warning')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
 
     target_user = User.query.filter_by(email=target_email).first()
 
@@ -468,11 +546,21 @@ def share_service(service_id):
         existing_share = Share.query.filter_by(service_id=service_id, shared_to=target_user.id).first()
         if existing_share:
             flash(f'Service already shared with {target_email}', 'info')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('.dashboard'))
 
         share = Share(service_id=service_id, shared_to=target_user.id, shared_by=session['user_id'])
         db.session.add(share)
-        db.session.commit()
+        try:
+            db.session.flush()
+            changes.record('share', share.id, 'upsert', session['user_id'], target_user.id)
+            changes.record('service', service_id, 'upsert', target_user.id)
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request created the same share first
+            db.session.rollback()
+            flash(f'Service already shared with {target_email}', 'info')
+            return redirect(url_for('.dashboard'))
+        access.invalidate(target_user.id)
 
         # Send notification email to registered user (async, won't block)
         send_share_notification_email(target_email, svc.name, current_user.email)
@@ -482,7 +570,7 @@ def share_service(service_id):
         existing_invite = PendingInvite.query.filter_by(email=target_email, service_id=service_id).first()
         if existing_invite:
             flash(f'Invitation already sent to {target_email}', 'info')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('.dashboard'))
 
         invite = PendingInvite(
             email=target_email,
@@ -490,82 +578,194 @@ def share_service(service_id):
             invited_by=session['user_id']
         )
         db.session.add(invite)
-        db.session.commit()
+        versions.bump(session['user_id'])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request created the same invite first
+            db.session.rollback()
+            flash(f'Invitation already sent to {target_email}', 'info')
+            return redirect(url_for('.dashboard'))
 
         # Send invitation email to unregistered user (async, won't block)
         send_invitation_email(target_email, svc.name, current_user.email)
         flash(f'📧 Invitation sent to {target_email}! They will get access when they register.', 'success')
 
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('.dashboard'))
+
+def parse_email_list(text):
+    """Split comma/semicolon/whitespace separated emails; lowercased, deduped, in order"""
+    emails = []
+    for token in re.split(r'[\s,;]+', text or ''):
+        token = token.strip().strip('"\'').lower()
+        if '@' in token and token not in emails:
+            emails.append(token)
+    return emails
+
+def parse_email_csv(file_storage):
+    """Collect every cell that looks like an email from an uploaded CSV file"""
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8', errors='replace')
+    cells = []
+    for row in csv.reader(stream):
+        cells.extend(cell for cell in row if '@' in cell)
+    return parse_email_list(' '.join(cells))
+
+def chunked(items, size):
+    """Yield successive slices of items, e.g. to keep IN lists under SQLite's parameter limit"""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+@bp.route('/share/bulk', methods=['GET', 'POST'])
+@login_required
+def bulk_share():
+    """Share one or more services with many email addresses in one transaction"""
+    user_id = session['user_id']
+    owned_services = Service.query.filter_by(owner_id=user_id).order_by(Service.name).all()
+
+    if request.method == 'GET':
+        return render_template('bulk_share.html', services=owned_services)
+
+    service_ids = set(request.form.getlist('service_ids', type=int))
+    services = [svc for svc in owned_services if svc.id in service_ids]
+    if not services or len(services) != len(service_ids):
+        flash('Select at least one service you own', 'danger')
+        return render_template('bulk_share.html', services=owned_services)
+
+    emails = parse_email_list(request.form.get('emails', ''))
+    upload = request.files.get('csv_file')
+    if upload and upload.filename:
+        emails = parse_email_list(' '.join(emails + parse_email_csv(upload)))
+
+    emails = [email for email in emails if email != current_user.email]
+    if not emails:
+        flash('Enter at least one email address other than your own', 'danger')
+        return render_template('bulk_share.html', services=owned_services)
+    if len(emails) > current_app.config['BULK_SHARE_MAX_RECIPIENTS']:
+        flash(f"At most {current_app.config['BULK_SHARE_MAX_RECIPIENTS']} recipients per bulk share", 'danger')
+        return render_template('bulk_share.html', services=owned_services)
+
+    chunk = current_app.config['BULK_SHARE_CHUNK_SIZE']
+    svc_ids = [svc.id for svc in services]
+
+    # Resolve every recipient and every existing grant with set-based queries
+    users_by_email = {}
+    for batch in chunked(emails, chunk):
+        users_by_email.update(db.session.query(User.email, User.id).filter(User.email.in_(batch)).all())
+
+    existing_shares = set()
+    for batch in chunked(users_by_email.values(), chunk):
+        existing_shares.update(db.session.query(Share.service_id, Share.shared_to)
+                               .filter(Share.service_id.in_(svc_ids), Share.shared_to.in_(batch))
+                               .all())
+
+    unregistered = [email for email in emails if email not in users_by_email]
+    existing_invites = set()
+    for batch in chunked(unregistered, chunk):
+        existing_invites.update(db.session.query(PendingInvite.service_id, PendingInvite.email)
+                                .filter(PendingInvite.service_id.in_(svc_ids), PendingInvite.email.in_(batch))
+                                .all())
+
+    new_shares, new_invites = [], []
+    notify, invite = {}, {}
+    for svc in services:
+        for email in emails:
+            target_id = users_by_email.get(email)
+            if target_id is not None:
+                if (svc.id, target_id) not in existing_shares:
+                    new_shares.append({'service_id': svc.id, 'shared_to': target_id, 'shared_by': user_id})
+                    notify.setdefault(svc, []).append(email)
+            elif (svc.id, email) not in existing_invites:
+                new_invites.append({'email': email, 'service_id': svc.id, 'invited_by': user_id})
+                invite.setdefault(svc, []).append(email)
+
+    try:
+        if new_shares:
+            created = db.session.execute(insert(Share).returning(Share.id, Share.service_id, Share.shared_to),
+                                         new_shares).all()
+            changes.record_many(
+                [(share.shared_to, 'service', share.service_id, 'upsert') for share in created]
+                + [(party_id, 'share', share.id, 'upsert')
+                   for share in created for party_id in (user_id, share.shared_to)]
+            )
+        if new_invites:
+            db.session.execute(insert(PendingInvite), new_invites)
+            versions.bump(user_id)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent share of the same service/recipient won the race; nothing was written
+        db.session.rollback()
+        flash('Some of these recipients were shared with at the same time by another request. Please try again.', 'warning')
+        return render_template('bulk_share.html', services=owned_services)
+    if new_shares:
+        access.invalidate(*{row['shared_to'] for row in new_shares})
+
+    # Queue every notification in one outbox batch
+    try:
+        messages = []
+        for svc, recipients in notify.items():
+            messages.extend(share_notification_emails(recipients, svc.name, current_user.email))
+        for svc, recipients in invite.items():
+            messages.extend(invitation_emails(recipients, svc.name, current_user.email))
+        outbox.enqueue_many(messages)
+    except Exception as e:
+        print(f"Error preparing email: {e}")
+
+    skipped = len(services) * len(emails) - len(new_shares) - len(new_invites)
+    flash(f'✅ Shared {len(services)} service(s): {len(new_shares)} new share(s), '
+          f'{len(new_invites)} invitation(s), {skipped} already had access.', 'success')
+    return redirect(url_for('.dashboard'))
 
-@app.route('/access/<int:service_id>')
+@bp.route('/access/<int:service_id>')
+@login_required
 def access_service(service_id):
     """
     Show service details without revealing the password.
     Access allowed to:
     - Owner of the service
     - A user who has been shared the service (Share.shared_to)
+    - A member of a team the service is shared with (TeamShare)
     """
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     user_id = session['user_id']
     svc = Service.query.get(service_id)
     if not svc:
         flash("Service not found", "danger")
-        return redirect(url_for('dashboard'))
-
-    # Access allowed if user is owner or there's a share for this user
-    allowed = False
-    if svc.owner_id == user_id:
-        allowed = True
-    else:
-        share = Share.query.filter_by(service_id=service_id, shared_to=user_id).first()
-        if share:
-            allowed = True
+        return redirect(url_for('.dashboard'))
 
-    if not allowed:
+    # Access allowed if user is owner or the service is shared with them
+    if not access.can_access(user_id, svc):
         flash("You don't have permission to view this service", "danger")
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
 
     # Show service without password (password_plain=None)
     return render_template('access_logs.html', service=svc, password_plain=None)
 
-@app.route('/reveal/<int:service_id>')
+@bp.route('/reveal/<int:service_id>')
+@login_required
 def reveal(service_id):
     """
     Decrypt and show credential only to:
     - Owner of the service
     - A user who has been shared the service (Share.shared_to)
+    - A member of a team the service is shared with (TeamShare)
     """
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     user_id = session['user_id']
     svc = Service.query.get(service_id)
     if not svc:
         flash("Service not found", "danger")
-        return redirect(url_for('dashboard'))
-
-    # Access allowed if user is owner or there's a share for this user
-    allowed = False
-    if svc.owner_id == user_id:
-        allowed = True
-    else:
-        share = Share.query.filter_by(service_id=service_id, shared_to=user_id).first()
-        if share:
-            allowed = True
+        return redirect(url_for('.dashboard'))
 
-    if not allowed:
+    # Access allowed if user is owner or the service is shared with them
+    if not access.can_access(user_id, svc):
         flash("You don't have permission to view this credential", "danger")
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('.dashboard'))
 
-    # log the access
-    log = AccessLog(service_id=service_id, user_id=user_id, ip=request.remote_addr)
-    db.session.add(log)
-    db.session.commit()
+    # log the access (queued for the batch writer unless AUDIT_LOG_SYNC is set)
+    access_log.record(service_id, user_id, request.remote_addr)
 
     # decrypt
     try:
-        password_plain = decrypt_password(svc.password_encrypted)
+        password_plain = decrypt_password(svc.password_encrypted, data_keys.get(svc.owner_id))
     except InvalidToken:
         flash("Decryption failed (invalid encryption key or corrupted data).", "danger")
         password_plain = "[decryption error]"
@@ -573,86 +773,245 @@ def reveal(service_id):
     # render a template that shows the decrypted password
     return render_template('access_logs.html', service=svc, password_plain=password_plain)
 
-@app.route('/logs')
+def _access_log_query(owner_id, service_id=None, user_id=None):
+    """Access logs for services owned by owner_id, newest first, optionally filtered"""
+    query = (AccessLog.query
+             .join(Service, AccessLog.service_id == Service.id)
+             .filter(Service.owner_id == owner_id))
+    if service_id is not None:
+        query = query.filter(AccessLog.service_id == service_id)
+    if user_id is not None:
+        query = query.filter(AccessLog.user_id == user_id)
+    return query.order_by(AccessLog.accessed_at.desc(), AccessLog.id.desc())
+
+def _encode_log_cursor(log):
+    return f"{log.accessed_at.isoformat()}_{log.id}"
+
+def _decode_log_cursor(cursor):
+    """Parse a cursor into (accessed_at, id); raises ValueError if malformed"""
+    accessed_at, log_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(accessed_at), int(log_id)
+
+def _after_log_cursor(query, position):
+    """Keyset condition: rows strictly older than position in (accessed_at, id) order"""
+    return query.filter(tuple_(AccessLog.accessed_at, AccessLog.id) < tuple_(*position))
+
+@bp.route('/logs')
+@login_required
 def logs():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    logs = AccessLog.query.order_by(AccessLog.accessed_at.desc()).all()
-    return render_template('access_logs.html', logs=logs)
+
+    service_id = request.args.get('service_id', type=int)
+    user_id = request.args.get('user_id', type=int)
+    cursor = request.args.get('cursor')
+    per_page = current_app.config['ACCESS_LOGS_PER_PAGE']
+
+    query = _access_log_query(session['user_id'], service_id, user_id)
+    if cursor:
+        try:
+            query = _after_log_cursor(query, _decode_log_cursor(cursor))
+        except ValueError:
+            flash("Invalid page cursor", "danger")
+            return redirect(url_for('.logs', service_id=service_id, user_id=user_id))
+
+    # Fetch one extra row to know whether there is an older page
+    logs = query.limit(per_page + 1).all()
+    next_cursor = _encode_log_cursor(logs[per_page - 1]) if len(logs) > per_page else None
+    logs = logs[:per_page]
+
+    return render_template('access_logs.html',
+                         logs=logs,
+                         next_cursor=next_cursor,
+                         service_id=service_id,
+                         user_id=user_id)
+
+@bp.route('/logs/export')
+@login_required
+def export_logs():
+    """Stream access logs as CSV or NDJSON, one keyset chunk at a time"""
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        flash("Export format must be csv or ndjson", "danger")
+        return redirect(url_for('.logs'))
+
+    query = _access_log_query(session['user_id'],
+                              request.args.get('service_id', type=int),
+                              request.args.get('user_id', type=int))
+    chunk_size = current_app.config['ACCESS_LOGS_EXPORT_CHUNK_SIZE']
+    fields = ('id', 'service_id', 'user_id', 'ip', 'accessed_at')
+
+    def generate():
+        if fmt == 'csv':
+            yield ','.join(fields) + '\r\n'
+        position = None
+        while True:
+            chunk_query = query if position is None else _after_log_cursor(query, position)
+            chunk = chunk_query.limit(chunk_size).all()
+            if not chunk:
+                break
+
+            buf = io.StringIO()
+            writer = csv.writer(buf) if fmt == 'csv' else None
+            for log in chunk:
+                row = (log.id, log.service_id, log.user_id, log.ip,
+                       log.accessed_at.isoformat() if log.accessed_at else None)
+                if writer:
+                    writer.writerow(row)
+                else:
+                    buf.write(json.dumps(dict(zip(fields, row))) + '\n')
+            yield buf.getvalue()
+
+            position = (chunk[-1].accessed_at, chunk[-1].id)
+            # Release the chunk's ORM objects before fetching the next one
+            db.session.expunge_all()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=access_logs.{fmt}'
+    })
+
+# ---------------- EXPORT / IMPORT ----------------
+
+@bp.route('/export', methods=['GET', 'POST'])
+@login_required
+def export_vault():
+    """Download every service you own as a passphrase-encrypted NDJSON archive"""
+    if request.method == 'GET':
+        return render_template('transfer.html')
+
+    passphrase = request.form.get('passphrase', '')
+    if len(passphrase) < current_app.config['VAULT_EXPORT_MIN_PASSPHRASE']:
+        flash(f"Choose a passphrase of at least {current_app.config['VAULT_EXPORT_MIN_PASSPHRASE']} characters", "danger")
+        return render_template('transfer.html')
+    if passphrase != request.form.get('confirm_passphrase', ''):
+        flash("Passphrases do not match", "danger")
+        return render_template('transfer.html')
+
+    archive = export_services(session['user_id'], passphrase, current_app.config['VAULT_TRANSFER_CHUNK_SIZE'])
+    filename = f"credvault-export-{datetime.utcnow():%Y%m%d}.ndjson"
+    return Response(stream_with_context(archive), mimetype='application/x-ndjson', headers={
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
+
+@bp.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_vault():
+    """Add services in bulk from a CredVault archive, NDJSON or another manager's CSV export"""
+    if request.method == 'GET':
+        return render_template('transfer.html')
+
+    upload = request.files.get('import_file')
+    if not upload or not upload.filename:
+        flash("Choose a file to import", "danger")
+        return render_template('transfer.html')
+    fmt = request.form.get('format') or ('csv' if upload.filename.lower().endswith('.csv') else 'ndjson')
+
+    # utf-8-sig drops the BOM some managers put at the start of their CSV exports
+    lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        records = read_records(lines, fmt, request.form.get('passphrase') or None)
+        result = import_services(session['user_id'], records, current_app.config['VAULT_TRANSFER_CHUNK_SIZE'])
+    except ArchiveError as e:
+        flash(f"Import failed: {e}", "danger")
+        return render_template('transfer.html')
+
+    rate = result.imported / result.elapsed if result.elapsed else 0.0
+    flash(f"✅ Imported {result.imported} service(s) ({rate:,.0f} rows/s); "
+          f"{result.duplicates} duplicate(s) and {result.invalid} invalid row(s) skipped.", "success")
+    return redirect(url_for('.dashboard'))
 
 # ---------------- SHARE MANAGEMENT ----------------
 
-@app.route('/my-shares')
+@bp.route('/my-shares')
+@login_required
 def my_shares():
     """View all services you've shared with others"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
 
     user_id = session['user_id']
+    content = fragment_cache.render(user_id, 'my_shares', lambda: _my_shares_content(user_id))
+    return render_template('my_shares.html', content=content)
 
-    # Get all shares created by current user
-    shares = Share.query.filter_by(shared_by=user_id).all()
+def _my_shares_content(user_id):
+    """My Shares page content, cached by fragment_cache"""
+    # Get all shares created by current user, with service and recipient details
+    shares = (Share.query
+              .filter_by(shared_by=user_id)
+              .options(joinedload(Share.service), joinedload(Share.recipient))
+              .all())
 
-    # Enrich with service and recipient details
     shares_details = []
     for share in shares:
-        service = Service.query.get(share.service_id)
-        recipient = User.query.get(share.shared_to)
-        if service and recipient:
+        if share.service and share.recipient:
             shares_details.append({
                 'share_id': share.id,
-                'service_id': service.id,
-                'service_name': service.name,
-                'service_username': service.username,
-                'shared_with_email': recipient.email,
+                'service_id': share.service.id,
+                'service_name': share.service.name,
+                'service_username': share.service.username,
+                'shared_with_email': share.recipient.email,
                 'shared_at': share.timestamp
             })
 
-    return render_template('my_shares.html', shares=shares_details)
+    # Services you've shared with teams, revoked per team in one step
+    team_shares = (db.session.query(TeamShare.team_id, Team.name.label('team_name'), Service.id.label('service_id'),
+                                    Service.name.label('service_name'), TeamShare.timestamp.label('shared_at'))
+                   .join(Team, TeamShare.team_id == Team.id)
+                   .join(Service, TeamShare.service_id == Service.id)
+                   .filter(Service.owner_id == user_id)
+                   .order_by(func.lower(Team.name), func.lower(Service.name))
+                   .all())
+
+    return render_template('_my_shares.html', shares=shares_details, team_shares=team_shares)
 
-@app.route('/unshare/<int:share_id>', methods=['POST'])
+@bp.route('/unshare/<int:share_id>', methods=['POST'])
+@login_required
 def unshare(share_id):
     """Revoke access to a shared service"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
 
     share = Share.query.get(share_id)
     if not share or share.shared_by != session['user_id']:
         flash('Share not found or you do not have permission', 'danger')
-        return redirect(url_for('my_shares'))
+        return redirect(url_for('.my_shares'))
 
     # Get details before deleting
     recipient = User.query.get(share.shared_to)
     service = Service.query.get(share.service_id)
 
+    recipient_id = share.shared_to
     db.session.delete(share)
+    changes.record('share', share_id, 'delete', share.shared_by, recipient_id)
+    changes.record('service', share.service_id, 'delete', recipient_id)
     db.session.commit()
+    access.invalidate(recipient_id)
 
     if recipient and service:
         flash(f'Access revoked: {recipient.email} can no longer access "{service.name}"', 'success')
     else:
         flash('Share removed successfully', 'success')
 
-    return redirect(url_for('my_shares'))
+    return redirect(url_for('.my_shares'))
 
 # ---------------- USERS & INVITES ----------------
 
-@app.route('/users')
+@bp.route('/users')
+@login_required
 def list_users():
     """List all registered users - useful for development/testing"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     users = User.query.all()
     return render_template('users.html', users=users)
 
-@app.route('/invites')
+@bp.route('/invites')
+@login_required
 def list_invites():
     """View pending invites sent by current user"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
 
+    user_id = session['user_id']
+    content = fragment_cache.render(user_id, 'invites', lambda: _invites_content(user_id))
+    return render_template('invites.html', content=content)
+
+def _invites_content(user_id):
+    """Invites page content, cached by fragment_cache"""
     # Get invites sent by current user
-    sent_invites = PendingInvite.query.filter_by(invited_by=session['user_id']).all()
+    sent_invites = PendingInvite.query.filter_by(invited_by=user_id).all()
 
     # Enrich with service names
     invites_with_details = []
@@ -665,27 +1024,343 @@ def list_invites():
             'created_at': invite.created_at
         })
 
-    return render_template('invites.html', invites=invites_with_details)
+    return render_template('_invites.html', invites=invites_with_details)
 
-@app.route('/invites/cancel/<int:invite_id>', methods=['POST'])
+@bp.route('/invites/cancel/<int:invite_id>', methods=['POST'])
+@login_required
 def cancel_invite(invite_id):
     """Cancel a pending invite"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
 
     invite = PendingInvite.query.get(invite_id)
     if not invite or invite.invited_by != session['user_id']:
         flash('Invite not found or you do not have permission', 'danger')
-        return redirect(url_for('list_invites'))
+        return redirect(url_for('.list_invites'))
 
     email = invite.email
     db.session.delete(invite)
+    versions.bump(invite.invited_by)
     db.session.commit()
     flash(f'Invitation to {email} cancelled', 'success')
-    return redirect(url_for('list_invites'))
+    return redirect(url_for('.list_invites'))
+
+# ---------------- TEAMS ----------------
+
+def _team_for_member(team_id):
+    """The team if the current user is a member, else None"""
+    team = db.session.get(Team, team_id)
+    if team is None or not teams.is_member(team.id, session['user_id']):
+        return None
+    return team
+
+@bp.route('/teams', methods=['GET', 'POST'])
+@login_required
+def list_teams():
+    """Teams you belong to; POST creates a team with you as its owner and first member"""
+    user_id = session['user_id']
+
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        if not name:
+            flash("Team name is required!", "danger")
+            return redirect(url_for('.list_teams'))
+
+        team = Team(name=name[:100], owner_id=user_id)
+        db.session.add(team)
+        db.session.flush()
+        db.session.add(TeamMember(team_id=team.id, user_id=user_id))
+        versions.bump(user_id)  # the team shows up in the dashboard's share menus
+        db.session.commit()
+        flash(f"✅ Team '{team.name}' created. Add members to share services with all of them at once.", "success")
+        return redirect(url_for('.team_detail', team_id=team.id))
+
+    member_count = (select(func.count(TeamMember.id)).where(TeamMember.team_id == Team.id)
+                    .correlate(Team).scalar_subquery())
+    service_count = (select(func.count(TeamShare.id)).where(TeamShare.team_id == Team.id)
+                     .correlate(Team).scalar_subquery())
+    rows = (db.session.query(Team, member_count.label('member_count'), service_count.label('service_count'))
+            .join(TeamMember, TeamMember.team_id == Team.id)
+            .filter(TeamMember.user_id == user_id)
+            .order_by(func.lower(Team.name), Team.id)
+            .all())
+    return render_template('teams.html', teams=rows)
+
+@bp.route('/teams/<int:team_id>')
+@login_required
+def team_detail(team_id):
+    """Members of a team and the services shared with it"""
+    team = _team_for_member(team_id)
+    if team is None:
+        flash('Team not found or you are not a member', 'danger')
+        return redirect(url_for('.list_teams'))
+
+    members = (db.session.query(TeamMember.user_id, User.email, TeamMember.added_at)
+               .join(User, TeamMember.user_id == User.id)
+               .filter(TeamMember.team_id == team.id)
+               .order_by(User.email)
+               .all())
+    services = (db.session.query(Service.id, Service.name, Service.username, Service.owner_id,
+                                 User.email.label('owner_email'), TeamShare.timestamp.label('shared_at'))
+                .join(TeamShare, TeamShare.service_id == Service.id)
+                .join(User, Service.owner_id == User.id)
+                .filter(TeamShare.team_id == team.id)
+                .order_by(func.lower(Service.name), Service.id)
+                .all())
+    return render_template('team.html', team=team, members=members, services=services,
+                           is_owner=team.owner_id == session['user_id'])
+
+@bp.route('/teams/<int:team_id>/members', methods=['POST'])
+@login_required
+def add_team_member(team_id):
+    """Add a registered user to a team; they get every service shared with it"""
+    team = db.session.get(Team, team_id)
+    if not team or team.owner_id != session['user_id']:
+        flash('Team not found or you do not have permission', 'danger')
+        return redirect(url_for('.list_teams'))
+
+    email = request.form.get('email', '').strip().lower()
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        flash(f'No registered user with email {email}', 'warning')
+        return redirect(url_for('.team_detail', team_id=team.id))
+
+    db.session.add(TeamMember(team_id=team.id, user_id=user.id))
+    try:
+        db.session.flush()
+        # One membership row; only the new member's change feed grows with the team's services
+        changes.record_many([(user.id, 'service', service_id, 'upsert') for service_id in teams.service_ids(team.id)])
+        versions.bump(user.id)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash(f'{email} is already a member of {team.name}', 'info')
+        return redirect(url_for('.team_detail', team_id=team.id))
+    access.invalidate(user.id)
+
+    flash(f'✅ {email} added to {team.name}', 'success')
+    return redirect(url_for('.team_detail', team_id=team.id))
+
+@bp.route('/teams/<int:team_id>/members/<int:user_id>/remove', methods=['POST'])
+@login_required
+def remove_team_member(team_id, user_id):
+    """Remove a member (team owner), or leave a team (any other member)"""
+    team = db.session.get(Team, team_id)
+    current_id = session['user_id']
+    if not team or current_id not in (team.owner_id, user_id):
+        flash('Team not found or you do not have permission', 'danger')
+        return redirect(url_for('.list_teams'))
+    if user_id == team.owner_id:
+        flash('The team owner cannot leave the team; delete the team instead', 'warning')
+        return redirect(url_for('.team_detail', team_id=team.id))
+
+    member = TeamMember.query.filter_by(team_id=team.id, user_id=user_id).first()
+    if not member:
+        flash('Not a member of this team', 'info')
+        return redirect(url_for('.team_detail', team_id=team.id))
+
+    db.session.delete(member)
+    changes.record_many([(user_id, 'service', service_id, 'delete') for service_id in teams.service_ids(team.id)])
+    versions.bump(user_id)
+    db.session.commit()
+    access.invalidate(user_id)
+
+    if user_id == current_id:
+        flash(f'You left {team.name}', 'success')
+        return redirect(url_for('.list_teams'))
+    flash(f'Member removed from {team.name}', 'success')
+    return redirect(url_for('.team_detail', team_id=team.id))
+
+@bp.route('/teams/<int:team_id>/delete', methods=['POST'])
+@login_required
+def delete_team(team_id):
+    """Delete a team, its memberships and its grants"""
+    team = db.session.get(Team, team_id)
+    if not team or team.owner_id != session['user_id']:
+        flash('Team not found or you do not have permission', 'danger')
+        return redirect(url_for('.list_teams'))
+
+    team_name = team.name
+    member_ids = teams.member_ids(team.id)
+    shared = db.session.execute(select(Service.id, Service.owner_id)
+                                .join(TeamShare, TeamShare.service_id == Service.id)
+                                .where(TeamShare.team_id == team.id)).all()
+
+    # One DELETE: memberships and grants go with it (ON DELETE CASCADE)
+    db.session.delete(team)
+    changes.record_many([(member_id, 'service', service.id, 'delete')
+                         for member_id in member_ids for service in shared])
+    # Members lose the team from their share menus, sharers from My Shares
+    versions.bump(*member_ids, *(service.owner_id for service in shared))
+    db.session.commit()
+    access.invalidate(*member_ids)
+
+    flash(f"🗑️ Team '{team_name}' deleted", 'success')
+    return redirect(url_for('.list_teams'))
+
+@bp.route('/share/<int:service_id>/team', methods=['POST'])
+@login_required
+def share_service_with_team(service_id):
+    """Share a service with every member of one of your teams in one grant"""
+    user_id = session['user_id']
+    svc = Service.query.get(service_id)
+    if not svc or svc.owner_id != user_id:
+        flash('Not allowed to share this service', 'danger')
+        return redirect(url_for('.dashboard'))
+
+    team = _team_for_member(request.form.get('team_id', type=int) or 0)
+    if team is None:
+        flash('Team not found or you are not a member', 'danger')
+        return redirect(url_for('.dashboard'))
+
+    db.session.add(TeamShare(service_id=service_id, team_id=team.id, shared_by=user_id))
+    try:
+        db.session.flush()
+        member_ids = teams.member_ids(team.id)
+        changes.record('service', service_id, 'upsert', *member_ids)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        flash(f'Service already shared with team {team.name}', 'info')
+        return redirect(url_for('.dashboard'))
+    access.invalidate(*member_ids)
+
+    try:
+        recipients = db.session.scalars(select(User.email).where(User.id.in_(member_ids), User.id != user_id)).all()
+        outbox.enqueue_many(share_notification_emails(recipients, svc.name, current_user.email))
+    except Exception as e:
+        print(f"Error preparing email: {e}")
+
+    flash(f'✅ Service shared with team {team.name} ({len(member_ids)} member(s))!', 'success')
+    return redirect(url_for('.dashboard'))
+
+@bp.route('/teams/<int:team_id>/unshare/<int:service_id>', methods=['POST'])
+@login_required
+def unshare_team(team_id, service_id):
+    """Revoke a team's access to a service (service owner or team owner)"""
+    team_share = TeamShare.query.filter_by(team_id=team_id, service_id=service_id).first()
+    if not team_share or session['user_id'] not in (team_share.service.owner_id, team_share.team.owner_id):
+        flash('Share not found or you do not have permission', 'danger')
+        return redirect(url_for('.my_shares'))
+
+    team_name, service_name, owner_id = team_share.team.name, team_share.service.name, team_share.service.owner_id
+    member_ids = teams.member_ids(team_id)
+    db.session.delete(team_share)
+    changes.record('service', service_id, 'delete', *member_ids)
+    versions.bump(owner_id)  # My Shares lists the grant
+    db.session.commit()
+    access.invalidate(*member_ids)
+
+    flash(f'Access revoked: team {team_name} can no longer access "{service_name}"', 'success')
+    if request.form.get('next') == 'team':
+        return redirect(url_for('.team_detail', team_id=team_id))
+    return redirect(url_for('.my_shares'))
+
+# ---------------- CLI ----------------
+
+@bp.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create the database schema, or missing tables and indexes in an existing database"""
+    upgrade_schema()
+
+@bp.cli.command('purge-sessions')
+def purge_sessions_command():
+    """Delete expired server-side sessions"""
+    print(f"🧹 Removed {purge_expired_sessions()} expired session(s)")
+
+@bp.cli.command('revoke-sessions')
+@click.argument('email')
+def revoke_sessions_command(email):
+    """Sign EMAIL out everywhere by deleting their server-side sessions"""
+    if current_app.config['SESSION_BACKEND'] != 'database':
+        raise click.ClickException("Signed-cookie sessions can't be revoked; set SESSION_BACKEND=database")
+    user = User.query.filter_by(email=email.strip().lower()).first()
+    if not user:
+        raise click.ClickException(f"No user with email {email}")
+    revoked = revoke_user_sessions(user.id)
+    forget_user(user.id)
+    print(f"🔒 Revoked {revoked} session(s) of {user.email}")
+
+@bp.cli.command('compact-changes')
+@click.option('--retention-days', type=int, help='Drop feed rows older than this (default: SYNC_RETENTION_DAYS)')
+@click.option('--chunk-size', default=1000, show_default=True, help='Feed rows deleted per transaction')
+def compact_changes_command(retention_days, chunk_size):
+    """Compact the incremental sync change feed"""
+    if retention_days is None:
+        retention_days = current_app.config['SYNC_RETENTION_DAYS']
+    changes.compact(retention_days=retention_days, chunk_size=chunk_size)
+
+@bp.cli.command('archive-access-logs')
+@click.option('--retention-days', type=int, help='Archive rows older than this (default: ACCESS_LOG_RETENTION_DAYS)')
+@click.option('--archive-dir', type=click.Path(file_okay=False),
+              help='Where to write the .ndjson.gz files (default: ACCESS_LOG_ARCHIVE_DIR)')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between delete batches')
+def archive_access_logs_command(retention_days, archive_dir, pause):
+    """Move old access logs into compressed NDJSON archives"""
+    config = current_app.config
+    archive_access_logs(
+        archive_dir or config['ACCESS_LOG_ARCHIVE_DIR'] or os.path.join(current_app.instance_path, 'access_log_archive'),
+        retention_days=config['ACCESS_LOG_RETENTION_DAYS'] if retention_days is None else retention_days,
+        chunk_size=config['ACCESS_LOG_ARCHIVE_CHUNK_SIZE'],
+        batch_size=config['ACCESS_LOG_DELETE_BATCH_SIZE'],
+        pause=pause,
+    )
+
+@bp.cli.command('rotate-keys')
+@click.option('--chunk-size', default=500, show_default=True, help='Services re-encrypted per transaction')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches')
+def rotate_keys_command(chunk_size, pause):
+    """Re-wrap every data key (and re-encrypt credentials not on one) under the current ENCRYPTION_KEY"""
+    rotate_service_keys(chunk_size=chunk_size, pause=pause)
+
+@bp.cli.command('migrate-data-keys')
+@click.option('--chunk-size', default=500, show_default=True, help='Services re-encrypted per transaction')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches')
+def migrate_data_keys_command(chunk_size, pause):
+    """Re-encrypt credentials still encrypted with ENCRYPTION_KEY under their owner's data key"""
+    migrate_to_data_keys(chunk_size=chunk_size, pause=pause)
+
+@bp.cli.command('export-vault')
+@click.argument('email')
+@click.argument('output', type=click.File('w'))
+@click.option('--passphrase', prompt=True, hide_input=True, confirmation_prompt=True,
+              help='Passphrase the archive is encrypted with')
+@click.option('--chunk-size', default=500, show_default=True, help='Services read and encrypted per chunk')
+def export_vault_command(email, output, passphrase, chunk_size):
+    """Write EMAIL's services to OUTPUT as an encrypted NDJSON archive"""
+    user = User.query.filter_by(email=email.strip().lower()).first()
+    if not user:
+        raise click.ClickException(f"No user with email {email}")
+    for chunk in export_services(user.id, passphrase, chunk_size):
+        output.write(chunk)
+
+@bp.cli.command('import-vault')
+@click.argument('email')
+@click.argument('input_file', metavar='FILE', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              help='File format (default: from the file extension)')
+@click.option('--passphrase', help='Passphrase of an encrypted CredVault archive')
+@click.option('--chunk-size', default=500, show_default=True, help='Services encrypted and inserted per chunk')
+def import_vault_command(email, input_file, fmt, passphrase, chunk_size):
+    """Add the services in FILE (CSV or NDJSON) to EMAIL's vault"""
+    user = User.query.filter_by(email=email.strip().lower()).first()
+    if not user:
+        raise click.ClickException(f"No user with email {email}")
+    fmt = fmt or ('csv' if input_file.name.lower().endswith('.csv') else 'ndjson')
+    try:
+        import_services(user.id, read_records(input_file, fmt, passphrase), chunk_size)
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+
+@bp.cli.command('outbox-drain')
+@click.option('--requeue-dead', is_flag=True, help='Retry dead-lettered messages before draining')
+def outbox_drain_command(requeue_dead):
+    """Deliver all due messages in the email outbox, then exit"""
+    if requeue_dead:
+        print(f"🔁 Requeued {outbox.requeue_dead()} dead-lettered email(s)")
+    print(f"📧 Processed {outbox.drain()} email(s)")
 
 # ---------------- INIT ----------------
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
     app.run(debug=True)
@@ -0,0 +1,141 @@
+"""
+Batched AccessLog writer.
+
+reveal() records an access by handing the event to AccessLogWriter.record().
+By default the event goes onto a bounded in-process queue, and a single
+writer thread inserts queued events with one multi-row INSERT once
+AUDIT_LOG_BATCH_SIZE events are waiting or AUDIT_LOG_FLUSH_INTERVAL seconds
+have passed. The queue is drained at interpreter shutdown.
+
+Set AUDIT_LOG_SYNC=True for strict-audit deployments: every event is then
+committed before the request continues, as before. When the queue is full,
+events are also written synchronously rather than dropped.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, AccessLog, Service
+
+_STOP = object()
+
+
+class AccessLogWriter:
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self._queue = queue.Queue(maxsize=app.config['AUDIT_LOG_QUEUE_SIZE'])
+        app.extensions['access_log_writer'] = self
+        atexit.register(self.stop)
+
+    def record(self, service_id, user_id, ip):
+        """Record one credential access"""
+        event = {'service_id': service_id, 'user_id': user_id, 'ip': ip,
+                 'accessed_at': datetime.utcnow()}
+        if not self.app.config['AUDIT_LOG_SYNC']:
+            self.start()
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                pass
+        # Strict mode, or the writer is falling behind: commit inline
+        db.session.add(AccessLog(**event))
+        db.session.commit()
+
+    def depth(self):
+        """Number of events waiting to be written"""
+        return self._queue.qsize()
+
+    # ---------------- WRITER THREAD ----------------
+
+    def _write(self, events):
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(AccessLog), events)
+                db.session.commit()
+                return True
+            except IntegrityError:
+                # A service was deleted after its access was queued; its logs would have been
+                # cascaded away anyway, so drop those events instead of retrying forever
+                db.session.rollback()
+                live = set(db.session.scalars(select(Service.id).where(
+                    Service.id.in_({event['service_id'] for event in events}))))
+                kept = [event for event in events if event['service_id'] in live]
+                db.session.remove()
+                if len(kept) == len(events):
+                    print(f"❌ Error writing {len(events)} access log(s), will retry")
+                    return False
+                print(f"⚠️  Dropping {len(events) - len(kept)} access log(s) of deleted services")
+                return self._write(kept) if kept else True
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Error writing {len(events)} access log(s), will retry: {e}")
+                return False
+            finally:
+                db.session.remove()
+
+    def _run(self):
+        batch_size = self.app.config['AUDIT_LOG_BATCH_SIZE']
+        interval = self.app.config['AUDIT_LOG_FLUSH_INTERVAL']
+        pending = []
+        stopping = False
+        deadline = time.monotonic() + interval
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                event = self._queue.get(timeout=timeout) if not stopping else self._queue.get_nowait()
+            except queue.Empty:
+                event = None
+            if event is _STOP:
+                stopping = True
+            elif event is not None:
+                pending.append(event)
+
+            if pending and (len(pending) >= batch_size or time.monotonic() >= deadline or stopping):
+                if self._write(pending):
+                    pending = []
+                elif stopping:
+                    # One more attempt at shutdown, then give up rather than hang the exit
+                    if not self._write(pending):
+                        print(f"❌ Dropping {len(pending)} access log(s) at shutdown")
+                    pending = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + interval
+            if stopping and event is None and not pending:
+                return
+
+    def start(self):
+        """Start the writer thread once per process"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        """Flush everything still queued and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def flush(self):
+        """Write everything queued so far; the writer restarts on the next record()"""
+        self.stop()
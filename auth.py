@@ -0,0 +1,94 @@
+"""
+Login enforcement and the current-user lookup.
+
+current_user is loaded at most once per request (memoized on flask.g) and
+is backed by a small per-process TTL cache, so most requests don't touch
+the User table at all. It is a lightweight snapshot (id, email), not an
+ORM object; load the User row explicitly when it needs to be modified.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import current_app, g, redirect, session, url_for
+from werkzeug.local import LocalProxy
+
+from models import db, User
+
+CurrentUser = namedtuple('CurrentUser', ['id', 'email'])
+
+_cache = OrderedDict()  # user_id -> (expires_at, CurrentUser)
+_cache_lock = threading.Lock()
+
+
+def _load_user(user_id):
+    ttl = current_app.config['CURRENT_USER_CACHE_TTL']
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry and entry[0] > now:
+            _cache.move_to_end(user_id)
+            return entry[1]
+
+    row = db.session.query(User.id, User.email).filter(User.id == user_id).first()
+    user = CurrentUser(row.id, row.email) if row else None
+    if user and ttl > 0:
+        with _cache_lock:
+            _cache[user_id] = (now + ttl, user)
+            _cache.move_to_end(user_id)
+            while len(_cache) > current_app.config['CURRENT_USER_CACHE_SIZE']:
+                _cache.popitem(last=False)
+    return user
+
+
+def get_current_user():
+    """The signed-in user for this request, or None"""
+    if 'current_user' not in g:
+        user_id = session.get('user_id')
+        g.current_user = _load_user(user_id) if user_id is not None else None
+    return g.current_user
+
+
+current_user = LocalProxy(get_current_user)
+
+
+def forget_user(user_id):
+    """Drop a user from the current-user cache"""
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+
+def login_required(view):
+    """Redirect to the login page unless a user is signed in"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if 'user_id' not in session:
+            return redirect(url_for('vault.login'))
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def authenticate(email, password):
+    """
+    The User with these credentials, or None. Hashes made with outdated
+    PASSWORD_HASH_METHOD parameters are upgraded on the way.
+    Raises passwords.HashingBusy when too many hashes are already pending.
+    """
+    hasher = current_app.extensions['password_hasher']
+    user = User.query.filter_by(email=email).first()
+    if user is None or not hasher.verify(user.password_hash, password):
+        return None
+    if hasher.needs_rehash(user.password_hash):
+        user.password_hash = hasher.hash(password)
+        db.session.commit()
+    return user
+
+
+def start_user_session(user_id):
+    """Sign user_id in, with a fresh session id when the session backend supports it"""
+    regenerate = getattr(session, 'regenerate', None)
+    if regenerate:
+        regenerate()
+    session['user_id'] = user_id
@@ -0,0 +1,124 @@
+"""
+Authorization checks for service access.
+
+A user may view or reveal a service if they own it, it has been shared
+with them, or it has been shared with a team they belong to (teams.py).
+The set of service IDs shared with each user, directly or through teams,
+is cached in a small per-process LRU with a TTL, so repeated page views
+and reveals skip the Share and membership lookups.
+
+Any change to a user's grants must call AccessControl.invalidate() after
+committing. That bumps a shared epoch file; every worker on the host checks
+the file's mtime and size before using its cache and starts over when it has moved,
+so revocations take effect immediately in all workers. Deployments spread
+over several hosts should set AUTHZ_EPOCH_FILE to shared storage or
+disable the cache with AUTHZ_CACHE_SIZE=0.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from models import db, Share
+import teams
+
+# The epoch file grows by one byte per invalidation and is reset at this size
+EPOCH_FILE_MAX_SIZE = 64 * 1024
+
+
+class AccessControl:
+    def __init__(self, app=None):
+        self.app = None
+        self._entries = OrderedDict()  # user_id -> (expires_at, frozenset of shared service ids)
+        self._lock = threading.Lock()
+        self._epoch = None
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_size = app.config['AUTHZ_CACHE_SIZE']
+        self.ttl = app.config['AUTHZ_CACHE_TTL']
+        self.epoch_file = app.config['AUTHZ_EPOCH_FILE'] or os.path.join(app.instance_path, 'authz.epoch')
+        app.extensions['access_control'] = self
+
+    # ---------------- CACHE ----------------
+
+    def _read_epoch(self):
+        try:
+            st = os.stat(self.epoch_file)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _check_epoch(self):
+        """Drop everything if grants were invalidated (by any process) since our last look"""
+        epoch = self._read_epoch()
+        if epoch != self._epoch:
+            self._entries.clear()
+            self._epoch = epoch
+            self._generation += 1
+
+    def shared_service_ids(self, user_id):
+        """IDs of services shared with user_id, directly or through a team (not including ones they own)"""
+        if self.max_size <= 0:
+            return self._load(user_id)
+
+        now = time.monotonic()
+        with self._lock:
+            self._check_epoch()
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        service_ids = self._load(user_id)
+        with self._lock:
+            # Don't cache a result that may predate an invalidation that raced with the load
+            if generation == self._generation:
+                self._entries[user_id] = (now + self.ttl, service_ids)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return service_ids
+
+    def _load(self, user_id):
+        direct = select(Share.service_id).where(Share.shared_to == user_id)
+        rows = db.session.execute(direct.union(teams.service_ids_for(user_id))).all()
+        return frozenset(service_id for (service_id,) in rows)
+
+    def invalidate(self, *user_ids):
+        """
+        Forget cached grants for these users. Call after the change is committed.
+        Touching the epoch file makes every worker, this one included, drop its
+        whole cache on the next lookup.
+        """
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+            self._generation += 1
+            os.makedirs(os.path.dirname(self.epoch_file), exist_ok=True)
+            # Append a byte rather than just touching: the size changes even when two
+            # invalidations land within the filesystem's mtime resolution
+            size = os.path.getsize(self.epoch_file) if os.path.exists(self.epoch_file) else 0
+            with open(self.epoch_file, 'w' if size >= EPOCH_FILE_MAX_SIZE else 'a') as f:
+                f.write('.')
+
+    # ---------------- CHECKS ----------------
+
+    def can_access(self, user_id, service):
+        """Whether user_id may view/reveal service (owner, shared with them or with one of their teams)"""
+        if service is None:
+            return False
+        if service.owner_id == user_id:
+            return True
+        return service.id in self.shared_service_ids(user_id)
@@ -0,0 +1,885 @@
+#!/usr/bin/env python3
+"""
+CredVault Benchmarks
+Micro-benchmarks for the hot paths of the vault.
+
+Usage:
+    python benchmark.py crypto [--count N]
+    python benchmark.py email [--count N]
+    python benchmark.py lookups [--sizes 1000,10000,100000] [--queries N]
+    python benchmark.py reveal [--requests N]
+    python benchmark.py register [--backlogs 10,100,1000]
+    python benchmark.py login-load [--seconds S] [--login-threads N] [--pool-workers N]
+    python benchmark.py transfer [--rows N] [--chunk-size N]
+    python benchmark.py db-concurrency [--workers N] [--seconds S] [--write-ratio R] [--url URL]
+    python benchmark.py startup [--runs N] [--top N] [--max-ms MS]
+    python benchmark.py seed [--rows N] [--seed S] [--database-url URL]
+    python benchmark.py routes [--rows N] [--requests N] [--concurrency N] [--scenarios a,b]
+                               [--url URL] [--output FILE] [--baseline FILE] [--threshold PCT]
+    python benchmark.py compare BASELINE.json CURRENT.json [--threshold PCT]
+
+`routes` measures throughput and latency percentiles per route, in-process
+(Flask test client, on a temporary SQLite vault seeded by fixtures.py) or
+against a running server with --url, e.g.:
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmark.py seed --rows 100000
+    DATABASE_URL=sqlite:////tmp/bench.db flask --app app upgrade-db
+    DATABASE_URL=sqlite:////tmp/bench.db gunicorn -w 4 "app:create_app()" &
+    python benchmark.py routes --rows 100000 --url http://127.0.0.1:8000 --output after.json
+    python benchmark.py compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("ENCRYPTION_KEY", "hK3wK0z3x2m2V7N3y6qkqv7d9gXlDqQ8Zr1oXbJp9l8=")
+
+
+def _report(label, count, elapsed):
+    rate = count / elapsed if elapsed else float("inf")
+    print(f"  {label:<32} {count:>8} ops  {elapsed * 1000:>10.1f} ms  {rate:>12,.0f} ops/s")
+
+
+def bench_crypto(args):
+    """Compare per-call and batched encrypt/decrypt throughput"""
+    import crypto_utils
+    from cryptography.fernet import Fernet
+    from config import Config
+
+    secrets_list = [f"secret-password-{i}" for i in range(args.count)]
+
+    def uncached_encrypt(plaintext):
+        # What every call used to pay: rebuild the cipher from the key
+        return Fernet(Config.ENCRYPTION_KEY.encode()).encrypt(plaintext.encode()).decode()
+
+    print(f"🔐 Crypto benchmark ({args.count} secrets)")
+
+    start = time.perf_counter()
+    for pt in secrets_list:
+        uncached_encrypt(pt)
+    _report("encrypt (uncached Fernet)", args.count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    tokens = [crypto_utils.encrypt_password(pt) for pt in secrets_list]
+    _report("encrypt_password per call", args.count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    crypto_utils.encrypt_many(secrets_list)
+    _report("encrypt_many", args.count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for token in tokens:
+        crypto_utils.decrypt_password(token)
+    _report("decrypt_password per call", args.count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    crypto_utils.decrypt_many(tokens)
+    _report("decrypt_many", args.count, time.perf_counter() - start)
+
+    # Per-owner data keys: a cache miss pays an unwrap on top of the decrypt
+    data_key, wrapped = crypto_utils.new_data_key()
+    tokens = crypto_utils.encrypt_many(secrets_list, data_key)
+    start = time.perf_counter()
+    for token in tokens:
+        crypto_utils.decrypt_password(token, crypto_utils.unwrap_data_key(wrapped))
+    _report("decrypt + unwrap_data_key", args.count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for token in tokens:
+        crypto_utils.decrypt_password(token, data_key)
+    _report("decrypt (cached data key)", args.count, time.perf_counter() - start)
+
+
+def bench_email(args):
+    """Email template render throughput, single sends and fan-out"""
+    from mailer import build_emails, render_email
+
+    context = dict(base_url="https://vault.example.com/", service_name="Production DB",
+                   inviter_email="owner@example.com")
+    recipients = [f"user{i}@example.com" for i in range(args.count)]
+
+    print(f"📧 Email render benchmark ({args.count} recipients)")
+
+    render_email("share_notification", **context)  # compile outside the timed loop
+    start = time.perf_counter()
+    for _ in recipients:
+        render_email("share_notification", **context)
+    _report("render per call", args.count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    build_emails("share_notification", "subject", recipients, "bench@example.com", **context)
+    _report("fan-out, shared render", args.count, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    build_emails("invitation", "subject", recipients, "bench@example.com", **context)
+    _report("fan-out, per-recipient render", args.count, time.perf_counter() - start)
+
+
+def _bench_app(database_uri):
+    """Minimal Flask app bound to the vault models, for benchmarks that need a database"""
+    from flask import Flask
+    from models import db
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    return app
+
+
+def bench_lookups(args):
+    """Share / PendingInvite / Service lookup latency against table size, with and without indexes"""
+    import random
+    import tempfile
+    from sqlalchemy import insert
+    from models import db, User, Service, Share, PendingInvite
+
+    rng = random.Random(42)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(f"🔎 Lookup latency benchmark ({args.queries} queries per scenario)")
+    print(f"  {'rows':>8}  {'indexes':<8} {'share (svc, to)':>16} {'share by':>10} {'invite email':>13} {'svc owner':>10}  (mean µs)")
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = _bench_app(f"sqlite:///{tmp}/bench.db")
+            with app.app_context():
+                db.create_all()
+                users = max(size // 20, 10)
+                db.session.execute(insert(User), [
+                    {"email": f"user{i}@example.com", "password_hash": "x"} for i in range(users)])
+                db.session.execute(insert(Service), [
+                    {"name": f"svc{i}", "username": "u", "password_encrypted": "x", "owner_id": i % users + 1}
+                    for i in range(size)])
+                db.session.execute(insert(Share), [
+                    {"service_id": i + 1, "shared_to": (i * 7) % users + 1, "shared_by": i % users + 1}
+                    for i in range(size)])
+                db.session.execute(insert(PendingInvite), [
+                    {"email": f"invitee{i}@example.com", "service_id": i + 1, "invited_by": i % users + 1}
+                    for i in range(size)])
+                db.session.commit()
+
+                def measure():
+                    timings = []
+                    scenarios = (
+                        lambda i: Share.query.filter_by(service_id=i + 1, shared_to=(i * 7) % users + 1).first(),
+                        lambda i: Share.query.filter_by(shared_by=i % users + 1).all(),
+                        lambda i: PendingInvite.query.filter_by(email=f"invitee{i}@example.com").all(),
+                        lambda i: Service.query.filter_by(owner_id=i % users + 1).all(),
+                    )
+                    for scenario in scenarios:
+                        picks = [rng.randrange(size) for _ in range(args.queries)]
+                        start = time.perf_counter()
+                        for i in picks:
+                            scenario(i)
+                        timings.append((time.perf_counter() - start) / args.queries * 1e6)
+                        db.session.expunge_all()
+                    return timings
+
+                with_indexes = measure()
+                for model in (Service, Share, PendingInvite):
+                    for index in model.__table__.indexes:
+                        index.drop(db.engine)
+                without_indexes = measure()
+
+            for label, timings in (("yes", with_indexes), ("no", without_indexes)):
+                print(f"  {size:>8}  {label:<8} {timings[0]:>16.1f} {timings[1]:>10.1f} {timings[2]:>13.1f} {timings[3]:>10.1f}")
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def bench_reveal(args):
+    """/reveal latency with synchronous vs. batched access logging"""
+    import tempfile
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    import app as vault
+    from models import db, User, Service
+
+    flask_app = vault.create_app()
+    with flask_app.app_context():
+        db.create_all()
+        user = User(email="bench@example.com", password_hash="x")
+        db.session.add(user)
+        db.session.commit()
+        service = Service(name="svc", username="u", owner_id=user.id,
+                          password_encrypted=vault.encrypt_password("secret", vault.data_keys.get(user.id, create=True)))
+        db.session.add(service)
+        db.session.commit()
+        user_id, service_id = user.id, service.id
+
+    client = flask_app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+
+    print(f"👁️  /reveal latency benchmark ({args.requests} requests)")
+    for label, sync in (("AUDIT_LOG_SYNC=True", True), ("batched writer", False)):
+        flask_app.config["AUDIT_LOG_SYNC"] = sync
+        timings = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            client.get(f"/reveal/{service_id}")
+            timings.append((time.perf_counter() - start) * 1000)
+        vault.access_log.flush()
+        print(f"  {label:<22} p50 {_percentile(timings, 50):7.2f} ms   p99 {_percentile(timings, 99):7.2f} ms")
+
+
+def bench_register(args):
+    """Invite-to-share conversion time for users with large invite backlogs"""
+    import tempfile
+    from sqlalchemy import insert
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    import app as vault
+    from models import db, User, Service, Share, PendingInvite
+
+    flask_app = vault.create_app()
+    with flask_app.app_context():
+        db.create_all()
+        owner = User(email="owner@example.com", password_hash="x")
+        db.session.add(owner)
+        db.session.commit()
+        backlogs = [int(n) for n in args.backlogs.split(",")]
+        db.session.execute(insert(Service), [
+            {"name": f"svc{i}", "username": "u", "password_encrypted": "x", "owner_id": owner.id}
+            for i in range(max(backlogs))])
+        db.session.commit()
+
+        def seed_invites(email, count):
+            db.session.execute(insert(PendingInvite), [
+                {"email": email, "service_id": i + 1, "invited_by": owner.id} for i in range(count)])
+            db.session.commit()
+
+        def legacy_convert(user):
+            # The pre-batching register() loop, for comparison
+            for invite in PendingInvite.query.filter_by(email=user.email).all():
+                db.session.add(Share(service_id=invite.service_id, shared_to=user.id, shared_by=invite.invited_by))
+                db.session.delete(invite)
+            db.session.commit()
+
+        def batched_convert(user):
+            vault.convert_pending_invites(user)
+            db.session.commit()
+
+        print("📨 Invite conversion benchmark")
+        for backlog in backlogs:
+            results = []
+            for label, convert in (("legacy", legacy_convert), ("batched", batched_convert)):
+                email = f"{label}{backlog}@example.com"
+                seed_invites(email, backlog)
+                user = User(email=email, password_hash="x")
+                db.session.add(user)
+                db.session.commit()
+                start = time.perf_counter()
+                convert(user)
+                results.append((label, (time.perf_counter() - start) * 1000))
+            print(f"  {backlog:>6} invites   " + "   ".join(f"{label} {ms:8.1f} ms" for label, ms in results))
+
+
+def bench_login_load(args):
+    """Dashboard latency while a login flood runs, with inline vs. pooled password hashing"""
+    import http.cookiejar
+    import logging
+    import tempfile
+    import threading
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+    from werkzeug.serving import make_server
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    import app as vault
+    from models import db, User
+
+    flask_app = vault.create_app()
+    with flask_app.app_context():
+        db.create_all()
+        db.session.add(User(email="bench@example.com", password_hash=vault.passwords.hash("benchpass")))
+        db.session.commit()
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    login_form = urllib.parse.urlencode({"email": "bench@example.com", "password": "benchpass"}).encode()
+
+    def opener():
+        return urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    print(f"🔑 Login flood benchmark ({args.login_threads} login threads, {args.seconds}s per scenario)")
+    for label, workers in (("inline hashing", 0), (f"pool of {args.pool_workers}", args.pool_workers)):
+        flask_app.config["PASSWORD_HASH_WORKERS"] = workers
+        vault.passwords.init_app(flask_app)
+        if workers:
+            vault.passwords.verify(vault.passwords.hash("warmup"), "warmup")  # start the pool
+
+        reader = opener()
+        reader.open(f"{base}/login", login_form).read()
+        stop = threading.Event()
+        outcomes = {"ok": 0, "busy": 0}
+
+        def flood():
+            client = opener()
+            while not stop.is_set():
+                try:
+                    client.open(f"{base}/login", login_form).read()
+                    outcomes["ok"] += 1
+                except urllib.error.HTTPError as e:
+                    outcomes["busy" if e.code == 503 else "ok"] += 1
+
+        flooders = [threading.Thread(target=flood, daemon=True) for _ in range(args.login_threads)]
+        for thread in flooders:
+            thread.start()
+        timings = []
+        deadline = time.monotonic() + args.seconds
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            reader.open(f"{base}/dashboard").read()
+            timings.append((time.perf_counter() - start) * 1000)
+        stop.set()
+        for thread in flooders:
+            thread.join()
+
+        print(f"  {label:<16} dashboard p50 {_percentile(timings, 50):8.2f} ms  p99 {_percentile(timings, 99):8.2f} ms  "
+              f"logins {outcomes['ok'] / args.seconds:6.1f}/s  shed {outcomes['busy']}")
+    vault.passwords.shutdown()
+    server.shutdown()
+
+
+def bench_transfer(args):
+    """Rows/s of CSV import, archive export and archive re-import"""
+    import io
+    import tempfile
+    import transfer
+    from config import Config
+    from datakeys import DataKeys
+    from models import db, User
+
+    tmp = tempfile.mkdtemp()
+    app = _bench_app(f"sqlite:///{tmp}/bench.db")
+    app.config.update(DATA_KEY_CACHE_SIZE=Config.DATA_KEY_CACHE_SIZE, DATA_KEY_CACHE_TTL=Config.DATA_KEY_CACHE_TTL)
+    DataKeys(app)
+    quiet = lambda *_: None
+
+    csv_text = "name,username,password\n" + "".join(
+        f"service-{i},user{i}@example.com,secret-password-{i}\n" for i in range(args.rows))
+
+    print(f"⇅ Vault transfer benchmark ({args.rows} services, chunks of {args.chunk_size})")
+    with app.app_context():
+        db.create_all()
+        source = User(email="source@example.com", password_hash="x")
+        target = User(email="target@example.com", password_hash="x")
+        db.session.add_all([source, target])
+        db.session.commit()
+
+        start = time.perf_counter()
+        records = transfer.read_records(io.StringIO(csv_text), "csv")
+        transfer.import_services(source.id, records, args.chunk_size, log=quiet)
+        _report("import CSV", args.rows, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        archive = io.StringIO()
+        for chunk in transfer.export_services(source.id, "benchmark-passphrase", args.chunk_size, log=quiet):
+            archive.write(chunk)
+        _report("export archive", args.rows, time.perf_counter() - start)
+
+        archive.seek(0)
+        start = time.perf_counter()
+        records = transfer.read_records(archive, "ndjson", "benchmark-passphrase")
+        result = transfer.import_services(target.id, records, args.chunk_size, log=quiet)
+        _report("import archive", result.imported, time.perf_counter() - start)
+
+
+def _db_worker(url, engine_options, pragmas, seconds, write_ratio, seed):
+    """One simulated gunicorn worker: mixed Service reads and AccessLog inserts"""
+    import random
+    from sqlalchemy import create_engine, exc, text
+    from models import apply_sqlite_pragmas
+
+    engine = create_engine(url, **engine_options)
+    apply_sqlite_pragmas(engine, pragmas)
+    rng = random.Random(seed)
+    reads = writes = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            with engine.begin() as conn:
+                if rng.random() < write_ratio:
+                    conn.execute(text("INSERT INTO access_log (service_id, user_id, ip, accessed_at) "
+                                      "VALUES (:s, 1, '127.0.0.1', CURRENT_TIMESTAMP)"), {"s": rng.randint(1, 1000)})
+                    writes += 1
+                else:
+                    conn.execute(text("SELECT * FROM service WHERE owner_id = :o"), {"o": rng.randint(1, 50)}).all()
+                    reads += 1
+        except exc.OperationalError:
+            errors += 1
+    engine.dispose()
+    return reads, writes, errors
+
+
+def bench_db_concurrency(args):
+    """Concurrent read/write throughput from several processes, per database configuration"""
+    import multiprocessing
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    from sqlalchemy import insert
+    from config import Config
+    from models import db, User, Service
+
+    if args.url:
+        scenarios = [("configured pool", args.url, Config.SQLALCHEMY_ENGINE_OPTIONS, {})]
+    else:
+        tmp = tempfile.mkdtemp()
+        scenarios = [
+            ("sqlite defaults", f"sqlite:///{tmp}/default.db", {}, {}),
+            ("sqlite WAL tuned", f"sqlite:///{tmp}/tuned.db", {}, Config.SQLITE_PRAGMAS),
+        ]
+
+    print(f"🗄️  DB concurrency benchmark ({args.workers} processes, {args.seconds}s, {args.write_ratio:.0%} writes)")
+    for label, url, engine_options, pragmas in scenarios:
+        app = _bench_app(url)
+        with app.app_context():
+            db.create_all()
+            if not User.query.first():
+                db.session.add(User(email="bench@example.com", password_hash="x"))
+                db.session.execute(insert(Service), [
+                    {"name": f"svc{i}", "username": "u", "password_encrypted": "x", "owner_id": i % 50 + 1}
+                    for i in range(1000)])
+                db.session.commit()
+            db.engine.dispose()
+
+        with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_db_worker, url, engine_options, pragmas, args.seconds, args.write_ratio, i)
+                       for i in range(args.workers)]
+            results = [f.result() for f in futures]
+        reads, writes, errors = (sum(r[i] for r in results) for i in range(3))
+        print(f"  {label:<18} reads {reads / args.seconds:9,.0f}/s  writes {writes / args.seconds:8,.0f}/s  "
+              f"lock errors {errors}")
+
+
+def bench_startup(args):
+    """Cold import and create_app() time of a fresh interpreter, as a gunicorn worker pays it"""
+    import statistics
+    import subprocess
+    import sys
+    import tempfile
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp}/bench.db")
+    script = ("import time; start = time.perf_counter(); import app; app.create_app(); "
+              "print((time.perf_counter() - start) * 1000)")
+
+    print(f"🚀 Startup benchmark ({args.runs} cold interpreters)")
+    timings = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", script], cwd=here, env=env,
+                             capture_output=True, text=True, check=True)
+        timings.append(float(out.stdout.strip().splitlines()[-1]))
+    print(f"  import app + create_app()   median {statistics.median(timings):8.1f} ms   "
+          f"max {max(timings):8.1f} ms")
+    print(f"  database touched            {'yes' if os.path.exists(f'{tmp}/bench.db') else 'no'}")
+
+    # -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=here, env=env,
+                         capture_output=True, text=True, check=True)
+    # A module's imports are listed before it, indented one level deeper
+    children, total = [], None
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip())
+        if depth == 3:
+            children.append((int(cumulative), name.strip()))
+        elif depth == 1:
+            if name.strip() == "app":
+                total = int(cumulative)
+                break
+            children = []
+    print(f"  import app (python -X importtime) {total / 1000:8.1f} ms, slowest direct imports:")
+    for cumulative, name in sorted(children, reverse=True)[:args.top]:
+        print(f"    {name:<30} {cumulative / 1000:8.1f} ms")
+
+    if args.max_ms and statistics.median(timings) > args.max_ms:
+        print(f"❌ Median startup exceeds {args.max_ms} ms")
+        sys.exit(1)
+
+
+def _seeded_app(database_url, rows, seed, log=print):
+    """The vault app on database_url, with its schema and a synthetic vault (reused if already seeded)"""
+    os.environ["DATABASE_URL"] = database_url
+    import app as vault
+    import fixtures
+    from models import User
+
+    flask_app = vault.create_app()
+    flask_app.config.update(MAIL_OUTBOX_WORKERS=0, MAIL_SUPPRESS_SEND=True)
+    with flask_app.app_context():
+        vault.upgrade_schema(log=lambda *_: None)
+        if User.query.first() is None:
+            fixtures.generate(rows, seed, log=log)
+        else:
+            log(f"🌱 Reusing the vault already in {database_url}")
+    return flask_app
+
+
+def bench_seed(args):
+    """Seed a database with a synthetic vault, e.g. for a gunicorn load test"""
+    from config import Config
+
+    started = time.perf_counter()
+    _seeded_app(args.database_url or Config.SQLALCHEMY_DATABASE_URI, args.rows, args.seed)
+    print(f"✅ Seeded in {time.perf_counter() - started:.1f}s")
+
+
+# ---------------- ROUTE SCENARIOS ----------------
+
+class _AppClient:
+    """In-process requests through the Flask test client"""
+
+    def __init__(self, flask_app):
+        self.client = flask_app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+
+class _HttpClient:
+    """Requests to a running server; redirects are not followed, as with the test client"""
+
+    def __init__(self, base_url):
+        import http.cookiejar
+        import urllib.request
+
+        class NoRedirect(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kwargs):
+                return None
+
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect)
+
+    def request(self, method, path, data=None):
+        import urllib.error
+        import urllib.parse
+        import urllib.request
+
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+def _owned(plan, user_id, k, shared=None):
+    """The k-th service of user_id, optionally only among its (un)shared ones"""
+    services = [sid for sid in plan.services_of(user_id) if shared is None or plan.is_shared(sid) == shared]
+    return services[k % len(services)]
+
+
+def _search_term(k):
+    import fixtures
+    return fixtures.SERVICE_NAMES[k % len(fixtures.SERVICE_NAMES)][:4].lower().replace(" ", "+")
+
+
+def _share_target(plan, user_id, k):
+    # Walk the other users so each request creates a new share
+    other = (user_id + k // max(len(plan.services_of(user_id)) // 2, 1)) % plan.users + 1
+    return plan.user_email(other if other != user_id else other % plan.users + 1)
+
+
+# name -> request(plan, user_id, k) returning (method, path, form data)
+ROUTE_SCENARIOS = {
+    "dashboard": lambda plan, user_id, k: ("GET", "/dashboard", None),
+    "dashboard-page": lambda plan, user_id, k: ("GET", "/dashboard/services", None),
+    "search": lambda plan, user_id, k: ("GET", f"/search?q={_search_term(k)}", None),
+    "access": lambda plan, user_id, k: ("GET", f"/access/{_owned(plan, user_id, k)}", None),
+    "reveal": lambda plan, user_id, k: ("GET", f"/reveal/{_owned(plan, user_id, k)}", None),
+    "share": lambda plan, user_id, k: (
+        "POST", f"/share/{_owned(plan, user_id, k, shared=False)}", {"email": _share_target(plan, user_id, k)}),
+    "my-shares": lambda plan, user_id, k: ("GET", "/my-shares", None),
+    "invites": lambda plan, user_id, k: ("GET", "/invites", None),
+    "logs": lambda plan, user_id, k: ("GET", "/logs", None),
+    "api-services": lambda plan, user_id, k: ("GET", "/api/v1/services", None),
+}
+
+
+def _run_scenario(make_client, plan, users, scenario, requests, warmup):
+    """Drive one scenario from one signed-in client per user; returns its result dict"""
+    import threading
+    import fixtures
+
+    clients = []
+    for user_id in users:
+        client = make_client()
+        status = client.request("POST", "/login", {"email": plan.user_email(user_id), "password": fixtures.BENCH_PASSWORD})
+        if status != 302:
+            raise SystemExit(f"❌ Could not sign in as {plan.user_email(user_id)} (HTTP {status}); "
+                             f"is the server seeded with --rows {plan.rows} --seed {plan.seed}?")
+        clients.append(client)
+
+    build = ROUTE_SCENARIOS[scenario]
+    per_client = max(requests // len(clients), 1)
+    timings = [[] for _ in clients]
+    errors = [0] * len(clients)
+    barrier = threading.Barrier(len(clients) + 1)
+
+    def worker(index):
+        client, user_id = clients[index], users[index]
+        try:
+            for k in range(warmup // len(clients)):
+                client.request(*build(plan, user_id, per_client + k))
+            barrier.wait()
+            for k in range(per_client):
+                method, path, data = build(plan, user_id, k)
+                started = time.perf_counter()
+                try:
+                    status = client.request(method, path, data)
+                except Exception:
+                    status = None
+                timings[index].append((time.perf_counter() - started) * 1000)
+                if status is None or status >= 400:
+                    errors[index] += 1
+            barrier.wait()
+        except BaseException:
+            barrier.abort()
+            raise
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(len(clients))]
+    for thread in threads:
+        thread.start()
+    try:
+        barrier.wait()
+        started = time.perf_counter()
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        raise SystemExit(f"❌ Scenario {scenario} failed")
+    elapsed = time.perf_counter() - started
+    for thread in threads:
+        thread.join()
+
+    samples = [ms for client_timings in timings for ms in client_timings]
+    return {
+        "requests": len(samples),
+        "errors": sum(errors),
+        "seconds": round(elapsed, 4),
+        "rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(samples) / len(samples), 3),
+        "p50_ms": round(_percentile(samples, 50), 3),
+        "p90_ms": round(_percentile(samples, 90), 3),
+        "p99_ms": round(_percentile(samples, 99), 3),
+        "max_ms": round(max(samples), 3),
+    }
+
+
+def _git_commit():
+    import subprocess
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_routes(args):
+    """Throughput and latency percentiles per route against a seeded synthetic vault"""
+    import platform
+    import tempfile
+    from datetime import datetime
+
+    scenarios = args.scenarios.split(",") if args.scenarios else list(ROUTE_SCENARIOS)
+    unknown = [name for name in scenarios if name not in ROUTE_SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}; choose from {', '.join(ROUTE_SCENARIOS)}")
+
+    if args.url:
+        target = args.url
+        make_client = lambda: _HttpClient(args.url)
+    else:
+        # Seeding sets DATABASE_URL, so it must come before anything imports config
+        database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+        flask_app = _seeded_app(database_url, args.rows, args.seed)
+        target = "in-process"
+        make_client = lambda: _AppClient(flask_app)
+
+    import fixtures
+    plan = fixtures.VaultPlan(args.rows, args.seed)
+
+    # Spread the simulated users over the vault
+    users = [1 + i * plan.users // args.concurrency for i in range(args.concurrency)]
+    print(f"🏁 Route benchmark ({target}, {args.rows} services, {args.requests} requests per route, "
+          f"concurrency {args.concurrency})")
+    print(f"  {'scenario':<16} {'req/s':>9} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  errors (ms)")
+    results = {}
+    for scenario in scenarios:
+        result = _run_scenario(make_client, plan, users, scenario, args.requests, args.warmup)
+        results[scenario] = result
+        print(f"  {scenario:<16} {result['rps']:>9,.1f} {result['mean_ms']:>8.2f} {result['p50_ms']:>8.2f} "
+              f"{result['p90_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['max_ms']:>8.2f}  {result['errors']}")
+
+    report = {
+        "meta": {
+            "benchmark": "routes",
+            "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "target": target,
+            "rows": args.rows,
+            "seed": args.seed,
+            "counts": plan.counts(),
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if _compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+# Lower is better for latencies, higher for throughput
+_COMPARED_METRICS = (("rps", 1), ("p50_ms", -1), ("p99_ms", -1))
+
+
+def _compare(baseline, current, threshold):
+    """Print per-scenario changes; returns the regressions beyond threshold percent"""
+    print(f"📊 Compared with {baseline['meta'].get('commit') or 'baseline'} "
+          f"({baseline['meta'].get('created_at')}), regression threshold {threshold:.0f}%")
+    if baseline["meta"].get("rows") != current["meta"].get("rows"):
+        print(f"  ⚠️  Different vault sizes: {baseline['meta'].get('rows')} vs {current['meta'].get('rows')} rows")
+    regressions = []
+    for scenario, result in current["scenarios"].items():
+        before = baseline["scenarios"].get(scenario)
+        if not before:
+            print(f"  {scenario:<16} (new)")
+            continue
+        changes = []
+        for metric, direction in _COMPARED_METRICS:
+            if not before.get(metric):
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100
+            worse = -change * direction > threshold
+            if worse:
+                regressions.append((scenario, metric, change))
+            changes.append(f"{metric} {change:+7.1f}%{' ❌' if worse else '  '}")
+        print(f"  {scenario:<16} " + "  ".join(changes))
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) beyond {threshold:.0f}%")
+    else:
+        print("✅ No regressions")
+    return regressions
+
+
+def bench_compare(args):
+    """Compare two `routes --output` result files and flag regressions"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if _compare(baseline, current, args.threshold):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CredVault benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    crypto = sub.add_parser("crypto", help="encrypt/decrypt throughput")
+    crypto.add_argument("--count", type=int, default=10000)
+    crypto.set_defaults(func=bench_crypto)
+
+    email = sub.add_parser("email", help="email template rendering")
+    email.add_argument("--count", type=int, default=1000)
+    email.set_defaults(func=bench_email)
+
+    lookups = sub.add_parser("lookups", help="indexed lookup latency vs. table size")
+    lookups.add_argument("--sizes", default="1000,10000,100000")
+    lookups.add_argument("--queries", type=int, default=200)
+    lookups.set_defaults(func=bench_lookups)
+
+    reveal = sub.add_parser("reveal", help="/reveal latency, sync vs. batched access logging")
+    reveal.add_argument("--requests", type=int, default=1000)
+    reveal.set_defaults(func=bench_reveal)
+
+    register = sub.add_parser("register", help="invite-to-share conversion at registration")
+    register.add_argument("--backlogs", default="10,100,1000")
+    register.set_defaults(func=bench_register)
+
+    login_load = sub.add_parser("login-load", help="dashboard latency under a login flood")
+    login_load.add_argument("--seconds", type=float, default=5)
+    login_load.add_argument("--login-threads", type=int, default=16)
+    login_load.add_argument("--pool-workers", type=int, default=2)
+    login_load.set_defaults(func=bench_login_load)
+
+    transfer = sub.add_parser("transfer", help="vault export/import rows per second")
+    transfer.add_argument("--rows", type=int, default=5000)
+    transfer.add_argument("--chunk-size", type=int, default=500)
+    transfer.set_defaults(func=bench_transfer)
+
+    db_concurrency = sub.add_parser("db-concurrency", help="multi-process read/write throughput")
+    db_concurrency.add_argument("--workers", type=int, default=4)
+    db_concurrency.add_argument("--seconds", type=float, default=5)
+    db_concurrency.add_argument("--write-ratio", type=float, default=0.2)
+    db_concurrency.add_argument("--url", help="benchmark this database URL instead of temporary SQLite files")
+    db_concurrency.set_defaults(func=bench_db_concurrency)
+
+    startup = sub.add_parser("startup", help="cold import + create_app() time, with -X importtime breakdown")
+    startup.add_argument("--runs", type=int, default=10)
+    startup.add_argument("--top", type=int, default=10)
+    startup.add_argument("--max-ms", type=float, help="exit non-zero if the median startup is slower than this")
+    startup.set_defaults(func=bench_startup)
+
+    seed = sub.add_parser("seed", help="fill a database with a seeded synthetic vault")
+    seed.add_argument("--rows", type=int, default=10000, help="services (and access logs); other tables scale with it")
+    seed.add_argument("--seed", type=int, default=42)
+    seed.add_argument("--database-url", help="database to seed (default: DATABASE_URL)")
+    seed.set_defaults(func=bench_seed)
+
+    routes = sub.add_parser("routes", help="per-route throughput and latency percentiles")
+    routes.add_argument("--rows", type=int, default=10000, help="vault size, 1000 to 1000000 services")
+    routes.add_argument("--seed", type=int, default=42)
+    routes.add_argument("--requests", type=int, default=200, help="measured requests per route")
+    routes.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route first")
+    routes.add_argument("--concurrency", type=int, default=1, help="simultaneous signed-in clients")
+    routes.add_argument("--scenarios", help=f"comma-separated subset of: {', '.join(ROUTE_SCENARIOS)}")
+    routes.add_argument("--url", help="benchmark this running server (seeded with the same --rows/--seed)")
+    routes.add_argument("--database-url", help="in-process: use this database, seeding it if empty")
+    routes.add_argument("--output", help="write the results to this JSON file")
+    routes.add_argument("--baseline", help="compare with this results file; exit non-zero on regressions")
+    routes.add_argument("--threshold", type=float, default=10, help="regression threshold in percent")
+    routes.set_defaults(func=bench_routes)
+
+    compare = sub.add_parser("compare", help="compare two routes result files")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=10, help="regression threshold in percent")
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Per-user change feed for incremental sync.
+
+Every change to a service or share appends one ChangeLog row per user who
+can see it: (user, kind, object id, op), with op "upsert" or "delete" (a
+tombstone). A client that has synced up to cursor N asks for the rows of
+its user with id > N and fetches only those objects, instead of listing
+the whole vault again.
+
+Routes call record() in the same transaction as the change. It bumps the
+users' change counters first (see versions.py): that upsert locks each
+user's counter row until commit, so a user's feed rows always commit in id
+order and a cursor never skips a row that commits later.
+
+`flask compact-changes` keeps the feed bounded: it drops rows older than
+SYNC_RETENTION_DAYS and rows superseded by a newer row for the same object.
+Cursors older than the retention horizon are answered with 410 Gone, and
+the client reloads the lists before syncing again.
+
+Feed ids are never reused, even once compaction has deleted the newest
+rows (AUTOINCREMENT on SQLite), so a cursor always stays below every
+change recorded after it.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, func, insert, select
+from sqlalchemy.orm import aliased
+
+from models import db, ChangeLog, ChangeLogCompaction
+import versions
+
+KINDS = ('service', 'share')
+OPS = ('upsert', 'delete')
+
+
+class CursorExpired(Exception):
+    """The cursor predates the last compaction; the client must reload everything"""
+
+
+# ---------------- WRITING ----------------
+
+def record_many(entries):
+    """Append (user_id, kind, object_id, op) entries to the feed as part of the current transaction"""
+    rows = [{'user_id': user_id, 'kind': kind, 'object_id': object_id, 'op': op}
+            for user_id, kind, object_id, op in entries if user_id is not None]
+    if not rows:
+        return
+    versions.bump(*{row['user_id'] for row in rows})
+    db.session.execute(insert(ChangeLog), rows)
+
+
+def record(kind, object_id, op, *user_ids):
+    """Record that object_id of kind was upserted or deleted, for each of user_ids"""
+    record_many((user_id, kind, object_id, op) for user_id in set(user_ids))
+
+
+# ---------------- READING ----------------
+
+def horizon():
+    """Highest change id removed by compaction; older cursors can't be served"""
+    return db.session.scalar(select(func.max(ChangeLogCompaction.compacted_through))) or 0
+
+
+def latest_cursor(user_id):
+    """Cursor for a client that has just loaded the user's full lists"""
+    latest = db.session.scalar(select(func.max(ChangeLog.id)).where(ChangeLog.user_id == user_id))
+    return max(latest or 0, horizon())
+
+
+def since(user_id, cursor, limit):
+    """
+    Changes for user_id after cursor, at most limit feed rows.
+    Returns ({(kind, object_id): op}, next cursor, has_more); only the latest
+    op per object is kept. Raises CursorExpired for a compacted-away cursor.
+    """
+    if cursor < horizon():
+        raise CursorExpired(cursor)
+
+    rows = db.session.execute(
+        select(ChangeLog.id, ChangeLog.kind, ChangeLog.object_id, ChangeLog.op)
+        .where(ChangeLog.user_id == user_id, ChangeLog.id > cursor)
+        .order_by(ChangeLog.id)
+        .limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest = {}
+    for row in rows:
+        latest[(row.kind, row.object_id)] = row.op
+    return latest, (rows[-1].id if rows else cursor), has_more
+
+
+# ---------------- COMPACTION ----------------
+
+def _delete_in_chunks(id_query, chunk_size):
+    """Delete the ChangeLog rows whose ids id_query(after_id) selects, one chunk per transaction"""
+    deleted = last_id = 0
+    while True:
+        ids = db.session.scalars(id_query(last_id).order_by(ChangeLog.id).limit(chunk_size)).all()
+        if not ids:
+            return deleted
+        deleted += db.session.execute(delete(ChangeLog).where(ChangeLog.id.in_(ids))).rowcount
+        db.session.commit()
+        last_id = ids[-1]
+
+
+def compact(retention_days=30, chunk_size=1000, log=print):
+    """
+    Drop feed rows older than retention_days and rows superseded by a newer
+    row for the same user and object. Must run inside an app context.
+    """
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    expired_through = db.session.scalar(select(func.max(ChangeLog.id)).where(ChangeLog.created_at < cutoff)) or 0
+
+    # Publish the new horizon before deleting, so no client syncs across the gap
+    run = ChangeLogCompaction(compacted_through=max(expired_through, horizon()))
+    db.session.add(run)
+    db.session.commit()
+
+    expired = _delete_in_chunks(
+        lambda after_id: select(ChangeLog.id).where(ChangeLog.id > after_id, ChangeLog.id <= expired_through),
+        chunk_size)
+
+    newer = aliased(ChangeLog)
+    superseded = _delete_in_chunks(
+        lambda after_id: select(ChangeLog.id).where(ChangeLog.id > after_id, exists().where(
+            newer.user_id == ChangeLog.user_id,
+            newer.kind == ChangeLog.kind,
+            newer.object_id == ChangeLog.object_id,
+            newer.id > ChangeLog.id,
+        )),
+        chunk_size)
+
+    run.rows_deleted = expired + superseded
+    db.session.commit()
+    log(f"🧹 Compacted the change feed in {time.perf_counter() - started:.1f}s: "
+        f"{expired} expired and {superseded} superseded row(s) removed, "
+        f"cursors before {run.compacted_through} must resync")
+    return run
@@ -9,14 +9,114 @@ class Config:
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Connection pool for server databases (Postgres). SQLite ignores these and
+    # is tuned through SQLITE_PRAGMAS instead.
+    if SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+            "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+            "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),  # seconds
+            "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT", 30)),  # seconds
+            "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "True").lower() in ['true', '1', 'yes'],
+        }
+
+    # Applied to every new SQLite connection. WAL lets readers run alongside the
+    # single writer, and busy_timeout makes writers wait instead of failing with
+    # "database is locked". foreign_keys turns on the ON DELETE CASCADE rules in
+    # models.py, which SQLite ignores by default.
+    SQLITE_PRAGMAS = {
+        "foreign_keys": "ON",
+        "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),  # milliseconds
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),  # bytes
+    }
+
+    # "cookie" keeps Flask's signed-cookie sessions; "database" stores sessions
+    # server-side (see sessions.py) so they can be revoked and shared by all workers
+    SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "cookie")
+    CURRENT_USER_CACHE_TTL = int(os.environ.get("CURRENT_USER_CACHE_TTL", 60))  # seconds; 0 disables
+    CURRENT_USER_CACHE_SIZE = int(os.environ.get("CURRENT_USER_CACHE_SIZE", 1024))
+
+    # User password hashing (see passwords.py). Any Werkzeug method string with
+    # explicit cost parameters; stored hashes with other parameters are upgraded on login.
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 0))  # 0 hashes inline
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 16))
+    PASSWORD_HASH_TIMEOUT = int(os.environ.get("PASSWORD_HASH_TIMEOUT", 30))  # seconds
+
     # Encryption key: 44-character base64 key used by Fernet
+    # WARNING: For production, set this via environment (or better, a KMS).
+    # If unset, crypto_utils generates an ephemeral key on first use; don't use that for production.
     ENCRYPTION_KEY = os.environ.get("ENCRYPTION_KEY")
-    if not ENCRYPTION_KEY:
-        # WARNING: For production, set this via environment (or better, a KMS).
-        # The app will still run with a generated key but don't use it for production.
-        from cryptography.fernet import Fernet
-        print("WARNING: ENCRYPTION_KEY not set — generating ephemeral key (do NOT use in production).")
-        ENCRYPTION_KEY = Fernet.generate_key().decode()
+
+    # Retired Fernet keys, comma-separated. They are still accepted for decryption
+    # so the vault keeps working while `flask rotate-keys` re-encrypts every
+    # credential under ENCRYPTION_KEY. Remove them once the rotation has finished.
+    OLD_ENCRYPTION_KEYS = [
+        k.strip() for k in os.environ.get("OLD_ENCRYPTION_KEYS", "").split(",") if k.strip()
+    ]
+
+    # Per-worker cache of unwrapped per-user data keys (see datakeys.py)
+    DATA_KEY_CACHE_SIZE = int(os.environ.get("DATA_KEY_CACHE_SIZE", 1024))  # 0 disables
+    DATA_KEY_CACHE_TTL = int(os.environ.get("DATA_KEY_CACHE_TTL", 300))  # seconds
+
+    # Access log writer (see audit.py). AUDIT_LOG_SYNC=True commits every access
+    # before the credential is revealed, for strict-audit deployments.
+    AUDIT_LOG_SYNC = os.environ.get("AUDIT_LOG_SYNC", "False").lower() in ['true', '1', 'yes']
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get("AUDIT_LOG_QUEUE_SIZE", 10000))
+    AUDIT_LOG_BATCH_SIZE = int(os.environ.get("AUDIT_LOG_BATCH_SIZE", 200))
+    AUDIT_LOG_FLUSH_INTERVAL = float(os.environ.get("AUDIT_LOG_FLUSH_INTERVAL", 1.0))  # seconds
+
+    # Access log history
+    ACCESS_LOGS_PER_PAGE = int(os.environ.get("ACCESS_LOGS_PER_PAGE", 50))
+    ACCESS_LOGS_EXPORT_CHUNK_SIZE = int(os.environ.get("ACCESS_LOGS_EXPORT_CHUNK_SIZE", 1000))
+
+    # Access log retention (see retention.py): `flask archive-access-logs` moves older
+    # rows into gzip NDJSON files, one file per chunk, deleting them in small batches
+    ACCESS_LOG_RETENTION_DAYS = int(os.environ.get("ACCESS_LOG_RETENTION_DAYS", 365))
+    ACCESS_LOG_ARCHIVE_DIR = os.environ.get("ACCESS_LOG_ARCHIVE_DIR")  # defaults to <instance>/access_log_archive
+    ACCESS_LOG_ARCHIVE_CHUNK_SIZE = int(os.environ.get("ACCESS_LOG_ARCHIVE_CHUNK_SIZE", 10000))  # rows per file
+    ACCESS_LOG_DELETE_BATCH_SIZE = int(os.environ.get("ACCESS_LOG_DELETE_BATCH_SIZE", 500))  # rows per transaction
+
+    # Per-process cache of the services shared with each user (see authz.py)
+    AUTHZ_CACHE_SIZE = int(os.environ.get("AUTHZ_CACHE_SIZE", 1024))  # users; 0 disables the cache
+    AUTHZ_CACHE_TTL = int(os.environ.get("AUTHZ_CACHE_TTL", 60))  # seconds
+    AUTHZ_EPOCH_FILE = os.environ.get("AUTHZ_EPOCH_FILE")  # defaults to <instance>/authz.epoch
+
+    # Dashboard sections and service search (see search.py)
+    SERVICES_PER_PAGE = int(os.environ.get("SERVICES_PER_PAGE", 50))
+    SERVICE_SEARCH_BACKEND = os.environ.get("SERVICE_SEARCH_BACKEND", "auto")  # auto, fts, trigram or prefix
+
+    # JSON API page sizes (see api.py); streamed lists are fetched API_MAX_PAGE_SIZE rows at a time
+    API_PAGE_SIZE = int(os.environ.get("API_PAGE_SIZE", 100))
+    API_MAX_PAGE_SIZE = int(os.environ.get("API_MAX_PAGE_SIZE", 1000))
+
+    # Incremental sync (see changes.py): feed rows per /api/v1/sync response, and how
+    # long `flask compact-changes` keeps them; clients offline longer reload everything
+    SYNC_MAX_CHANGES = int(os.environ.get("SYNC_MAX_CHANGES", 1000))
+    SYNC_RETENTION_DAYS = int(os.environ.get("SYNC_RETENTION_DAYS", 30))
+
+    # Bulk sharing
+    BULK_SHARE_MAX_RECIPIENTS = int(os.environ.get("BULK_SHARE_MAX_RECIPIENTS", 1000))
+    BULK_SHARE_CHUNK_SIZE = 500  # keeps IN (...) lists under SQLite's bound-parameter limit
+
+    # Vault export/import (see transfer.py): services encrypted and inserted per chunk
+    VAULT_TRANSFER_CHUNK_SIZE = int(os.environ.get("VAULT_TRANSFER_CHUNK_SIZE", 500))
+    VAULT_EXPORT_MIN_PASSPHRASE = 8
+
+    # Per-process cache of rendered dashboard, My Shares and Invites content (see fragments.py)
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get("FRAGMENT_CACHE_MAX_BYTES", 32 * 1024 * 1024))  # 0 disables
+
+    # Prometheus metrics on /metrics (see metrics.py). With METRICS_TOKEN set, scrapes
+    # must send "Authorization: Bearer <token>"
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() in ['true', '1', 'yes']
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+    # Public site root used for links in emails sent outside a request (workers, CLI jobs)
+    BASE_URL = os.environ.get("BASE_URL", "http://localhost:5000/")
 
     # Mail Configuration
     MAIL_SERVER = os.environ.get("MAIL_SERVER", "smtp.gmail.com")
@@ -26,3 +126,11 @@ class Config:
     MAIL_USERNAME = os.environ.get("MAIL_USERNAME")
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER", os.environ.get("MAIL_USERNAME"))
+
+    # Email outbox: a small pool of worker threads drains OutboxEmail over one SMTP connection per batch
+    MAIL_OUTBOX_WORKERS = int(os.environ.get("MAIL_OUTBOX_WORKERS", 2))
+    MAIL_OUTBOX_BATCH_SIZE = int(os.environ.get("MAIL_OUTBOX_BATCH_SIZE", 50))
+    MAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("MAIL_OUTBOX_MAX_ATTEMPTS", 6))
+    MAIL_OUTBOX_RETRY_BASE = int(os.environ.get("MAIL_OUTBOX_RETRY_BASE", 30))  # seconds, doubled per attempt
+    MAIL_OUTBOX_POLL_INTERVAL = int(os.environ.get("MAIL_OUTBOX_POLL_INTERVAL", 5))  # seconds
+    MAIL_OUTBOX_LEASE = int(os.environ.get("MAIL_OUTBOX_LEASE", 300))  # seconds before a stuck claim is retried
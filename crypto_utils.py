@@ -1,30 +1,139 @@
-from cryptography.fernet import Fernet, InvalidToken
+import base64
+import hashlib
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 from config import Config
+from metrics import crypto_timer
 
-def _get_fernet():
-    key = Config.ENCRYPTION_KEY
+# Tokens encrypted with an owner's data key (envelope encryption, see datakeys.py)
+# start with this; tokens without it are encrypted directly with ENCRYPTION_KEY
+DATA_KEY_PREFIX = 'dk1:'
+
+# Process-wide cipher, rebuilt only when the configured keys change
+_fernet_cache = (None, None)
+
+def _to_bytes(key):
     if isinstance(key, str):
-        key_bytes = key.encode()
-    else:
-        key_bytes = key
-    return Fernet(key_bytes)
+        return key.encode()
+    return key
+
+def _get_fernet():
+    """
+    Return a MultiFernet that encrypts with Config.ENCRYPTION_KEY and
+    decrypts with it or any of Config.OLD_ENCRYPTION_KEYS.
+    """
+    global _fernet_cache
+    if not Config.ENCRYPTION_KEY:
+        print("WARNING: ENCRYPTION_KEY not set — generating ephemeral key (do NOT use in production).")
+        Config.ENCRYPTION_KEY = Fernet.generate_key().decode()
+    keys = (Config.ENCRYPTION_KEY, *getattr(Config, 'OLD_ENCRYPTION_KEYS', ()))
+    cached_keys, cached_fernet = _fernet_cache
+    if cached_fernet is not None and cached_keys == keys:
+        return cached_fernet
 
-def encrypt_password(plaintext: str) -> str:
+    fernet = MultiFernet([Fernet(_to_bytes(key)) for key in keys])
+    _fernet_cache = (keys, fernet)
+    return fernet
+
+def _encrypt(plaintext, data_key):
+    if data_key is None:
+        return _get_fernet().encrypt(plaintext.encode()).decode()
+    return DATA_KEY_PREFIX + data_key.encrypt(plaintext.encode()).decode()
+
+def _decrypt(token, data_key):
+    if not is_data_key_token(token):
+        return _get_fernet().decrypt(token.encode()).decode()
+    if data_key is None:
+        raise InvalidToken()
+    return data_key.decrypt(token[len(DATA_KEY_PREFIX):].encode()).decode()
+
+def is_data_key_token(token: str) -> bool:
+    """Whether token was encrypted with a data key rather than ENCRYPTION_KEY"""
+    return token.startswith(DATA_KEY_PREFIX)
+
+@crypto_timer('encrypt')
+def encrypt_password(plaintext: str, data_key: Fernet = None) -> str:
     """
     Encrypt plaintext password and return base64 token string.
+    With data_key, the owner's data key is used instead of ENCRYPTION_KEY.
     """
-    f = _get_fernet()
-    token = f.encrypt(plaintext.encode())
-    return token.decode()
+    return _encrypt(plaintext, data_key)
 
-def decrypt_password(token: str) -> str:
+@crypto_timer('decrypt')
+def decrypt_password(token: str, data_key: Fernet = None) -> str:
     """
     Decrypt the token and return plaintext password.
+    Data key tokens need the owner's data_key; others are decrypted with ENCRYPTION_KEY.
     Raises InvalidToken if decryption fails.
     """
+    return _decrypt(token, data_key)
+
+@crypto_timer('encrypt_many')
+def encrypt_many(plaintexts: list[str], data_key: Fernet = None) -> list[str]:
+    """
+    Encrypt a list of plaintext passwords with a single cipher lookup.
+    Returns tokens in the same order as the input.
+    """
+    if data_key is None:
+        data_key_prefix, f = '', _get_fernet()
+    else:
+        data_key_prefix, f = DATA_KEY_PREFIX, data_key
+    return [data_key_prefix + f.encrypt(pt.encode()).decode() for pt in plaintexts]
+
+@crypto_timer('decrypt_many')
+def decrypt_many(tokens: list[str], data_key: Fernet = None) -> list[str]:
+    """
+    Decrypt a list of tokens of one owner with a single cipher lookup.
+    Raises InvalidToken on the first token that fails to decrypt.
+    """
+    # An owner's list can mix data key tokens with ones not yet migrated off ENCRYPTION_KEY
+    legacy = None
+    plaintexts = []
+    for token in tokens:
+        if is_data_key_token(token):
+            if data_key is None:
+                raise InvalidToken()
+            plaintexts.append(data_key.decrypt(token[len(DATA_KEY_PREFIX):].encode()).decode())
+        else:
+            if legacy is None:
+                legacy = _get_fernet()
+            plaintexts.append(legacy.decrypt(token.encode()).decode())
+    return plaintexts
+
+@crypto_timer('rotate_many')
+def rotate_many(tokens: list[str]) -> list[str]:
+    """
+    Re-encrypt tokens (ENCRYPTION_KEY tokens or wrapped data keys) under the current ENCRYPTION_KEY.
+    Tokens may be encrypted with the current key or any retired key.
+    Raises InvalidToken on the first token no configured key can decrypt.
+    """
     f = _get_fernet()
-    try:
-        pt = f.decrypt(token.encode())
-        return pt.decode()
-    except InvalidToken as e:
-        raise
+    return [f.rotate(token.encode()).decode() for token in tokens]
+
+def new_data_key() -> tuple[Fernet, str]:
+    """A fresh data key, as (cipher, key wrapped with ENCRYPTION_KEY for storage)"""
+    key = Fernet.generate_key()
+    return Fernet(key), _get_fernet().encrypt(key).decode()
+
+@crypto_timer('unwrap_data_key')
+def unwrap_data_key(wrapped: str) -> Fernet:
+    """
+    Cipher for a data key stored wrapped with ENCRYPTION_KEY (or a retired key).
+    Raises InvalidToken if no configured key can unwrap it.
+    """
+    return Fernet(_get_fernet().decrypt(wrapped.encode()))
+
+def key_fingerprint(key=None) -> str:
+    """Short, non-reversible identifier for an encryption key"""
+    if key is None:
+        _get_fernet()  # make sure a key exists
+        key = Config.ENCRYPTION_KEY
+    return hashlib.sha256(_to_bytes(key)).hexdigest()[:16]
+
+@crypto_timer('passphrase_kdf')
+def passphrase_fernet(passphrase: str, salt: bytes, n: int = 2 ** 15, r: int = 8, p: int = 1) -> Fernet:
+    """
+    Fernet cipher keyed by a user passphrase (scrypt), independent of ENCRYPTION_KEY.
+    Used for archives that leave the vault.
+    """
+    key = hashlib.scrypt(passphrase.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * 2, dklen=32)
+    return Fernet(base64.urlsafe_b64encode(key))
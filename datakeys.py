@@ -0,0 +1,112 @@
+"""
+Per-owner data keys (envelope encryption).
+
+Each user's credentials are encrypted with their own data key, a Fernet
+key created on first use and stored in User.data_key_wrapped encrypted
+("wrapped") with ENCRYPTION_KEY. Rotating ENCRYPTION_KEY then only has to
+re-wrap one short value per user instead of re-encrypting every stored
+credential (see rotation.py). Ciphertexts made with a data key carry the
+crypto_utils.DATA_KEY_PREFIX; older ones, encrypted directly with
+ENCRYPTION_KEY, keep working until `flask migrate-data-keys` converts them.
+
+Unwrapped keys are cached in a small per-process LRU with a short TTL, so
+a reveal or save costs one Fernet operation rather than two plus a User
+lookup. A data key never changes once created, and a rotation re-wraps it
+with the same plaintext key, so the cache needs no invalidation; the TTL
+only bounds how long key material stays in memory.
+
+A key created in a request is written in that request's transaction,
+together with the ciphertexts made with it, and is only cached once it
+has been read back from the database: a rolled-back request leaves
+neither behind.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, update
+
+from crypto_utils import new_data_key, unwrap_data_key
+from metrics import DATA_KEY_CACHE_REQUESTS
+from models import db, User
+
+
+class DataKeys:
+    def __init__(self, app=None):
+        self._entries = OrderedDict()  # user_id -> (expires_at, Fernet)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config['DATA_KEY_CACHE_SIZE']
+        self.ttl = app.config['DATA_KEY_CACHE_TTL']
+        app.extensions['data_keys'] = self
+
+    def get(self, user_id, create=False):
+        """
+        Cipher for user_id's data key. Users without one get None, or a new
+        key written in the current transaction if create is set.
+        """
+        return self.get_many([user_id], create=create)[user_id]
+
+    def get_many(self, user_ids, create=False):
+        """{user_id: cipher} for user_ids, with one User query for the ones not cached (see get())"""
+        keys, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._entries.get(user_id) if self.max_size > 0 else None
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    keys[user_id] = entry[1]
+                else:
+                    self.misses += 1
+                    missing.append(user_id)
+        DATA_KEY_CACHE_REQUESTS.labels('hit').inc(len(keys))
+        DATA_KEY_CACHE_REQUESTS.labels('miss').inc(len(missing))
+        if not missing:
+            return keys
+
+        loaded = {}
+        wrapped = dict(db.session.execute(
+            select(User.id, User.data_key_wrapped).where(User.id.in_(missing))
+        ).all())
+        for user_id in missing:
+            if wrapped.get(user_id):
+                loaded[user_id] = unwrap_data_key(wrapped[user_id])
+                keys[user_id] = loaded[user_id]
+            elif create:
+                keys[user_id] = self._create(user_id)
+            else:
+                keys[user_id] = None
+
+        if self.max_size > 0 and loaded:
+            with self._lock:
+                for user_id, cipher in loaded.items():
+                    self._entries[user_id] = (now + self.ttl, cipher)
+                    self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return keys
+
+    def _create(self, user_id):
+        """New data key for user_id in the current transaction; a concurrently created one wins"""
+        cipher, wrapped = new_data_key()
+        db.session.execute(update(User)
+                           .where(User.id == user_id, User.data_key_wrapped.is_(None))
+                           .values(data_key_wrapped=wrapped))
+        stored = db.session.scalar(select(User.data_key_wrapped).where(User.id == user_id))
+        if stored is None:
+            return None  # no such user
+        return cipher if stored == wrapped else unwrap_data_key(stored)
+
+    def stats(self):
+        """Hit/miss counts and current size of this process's cache"""
+        with self._lock:
+            return {'entries': len(self._entries), 'max_size': self.max_size,
+                    'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,163 @@
+"""
+Seeded synthetic vaults for benchmarks and load tests.
+
+generate() fills User, Service, Share, PendingInvite and AccessLog with
+reproducible data: the same rows and seed always produce the same vault,
+so benchmark runs against it can be compared. rows is the number of
+services; the other tables scale with it (see VaultPlan).
+
+VaultPlan describes the vault without touching the database (which user
+owns which service, every user's email), so a load generator can drive a
+separately seeded server, e.g. gunicorn started on the same DATABASE_URL.
+
+Every user signs in with BENCH_PASSWORD, hashed once, and gets their own
+data key (see datakeys.py). Each user's credentials cycle through a pool of
+CIPHERTEXT_POOL passwords encrypted with that key, so seeding a million
+services doesn't spend minutes in Fernet.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert
+
+from crypto_utils import encrypt_many, new_data_key
+from models import db, User, Service, Share, PendingInvite, AccessLog
+
+BENCH_PASSWORD = 'benchmark-password'
+EMAIL_DOMAIN = 'bench.example.com'
+CIPHERTEXT_POOL = 10  # per user
+ACCESS_LOG_DAYS = 400  # spans the default access log retention
+
+SERVICE_NAMES = (
+    'GitHub', 'GitLab', 'Gmail', 'Outlook', 'AWS', 'Azure', 'Google Cloud', 'Slack', 'Jira', 'Confluence',
+    'Postgres', 'MySQL', 'Redis', 'Stripe', 'PayPal', 'Netflix', 'Spotify', 'Dropbox', 'Notion', 'Figma',
+)
+
+
+class VaultPlan:
+    """Sizes and the deterministic layout of a generated vault; ids assume an empty database"""
+
+    def __init__(self, rows, seed=42):
+        self.rows = rows
+        self.seed = seed
+        self.users = max(rows // 100, 10)
+        self.services = rows
+        self.shares = sum(1 for service_id in range(1, rows + 1) if self.is_shared(service_id))
+        self.invites = rows // 10
+        self.access_logs = rows
+
+    def counts(self):
+        return {'users': self.users, 'services': self.services, 'shares': self.shares,
+                'pending_invites': self.invites, 'access_logs': self.access_logs}
+
+    def user_email(self, user_id):
+        return f"user{user_id}@{EMAIL_DOMAIN}"
+
+    def owner_of(self, service_id):
+        return (service_id - 1) % self.users + 1
+
+    def services_of(self, user_id):
+        """Ids of the services user_id owns"""
+        return range(user_id, self.services + 1, self.users)
+
+    def is_shared(self, service_id):
+        """Every other service of each user is shared with one other user"""
+        return (service_id - 1) // self.users % 2 == 0
+
+
+def _insert_chunks(model, rows, chunk_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            db.session.execute(insert(model), batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.execute(insert(model), batch)
+        db.session.commit()
+
+
+def generate(rows, seed=42, chunk_size=10000, log=print):
+    """
+    Seed an empty vault database with a synthetic vault of rows services.
+    Must run inside an app context. Returns the VaultPlan.
+    """
+    if db.session.query(User.id).first() is not None:
+        raise ValueError('The database already has users; seed an empty database')
+
+    plan = VaultPlan(rows, seed)
+    rng = random.Random(seed)
+    data_keys = {}  # user_id -> cipher, filled in by _users()
+    tables = (
+        (User, plan.users, lambda: _users(plan, data_keys)),
+        (Service, plan.services, lambda: _services(plan, rng, data_keys)),
+        (Share, plan.shares, lambda: _shares(plan, rng)),
+        (PendingInvite, plan.invites, lambda: _invites(plan, rng)),
+        (AccessLog, plan.access_logs, lambda: _access_logs(plan, rng)),
+    )
+    log(f"🌱 Seeding a synthetic vault: {rows} services, seed {seed}")
+    for model, count, make_rows in tables:
+        started = time.perf_counter()
+        _insert_chunks(model, make_rows(), chunk_size)
+        elapsed = time.perf_counter() - started
+        log(f"  {model.__tablename__:<15} {count:>9} rows in {elapsed:6.1f}s ({count / elapsed if elapsed else 0:,.0f} rows/s)")
+    return plan
+
+
+def _users(plan, data_keys):
+    password_hash = current_app.extensions['password_hasher'].hash(BENCH_PASSWORD)
+    for user_id in range(1, plan.users + 1):
+        data_keys[user_id], wrapped = new_data_key()
+        yield {'email': plan.user_email(user_id), 'password_hash': password_hash, 'data_key_wrapped': wrapped}
+
+
+def _services(plan, rng, data_keys):
+    passwords = [f"synthetic-password-{i}" for i in range(CIPHERTEXT_POOL)]
+    tokens = {user_id: encrypt_many(passwords, cipher) for user_id, cipher in data_keys.items()}
+    for service_id in range(1, plan.services + 1):
+        owner_id = plan.owner_of(service_id)
+        yield {
+            'name': f"{rng.choice(SERVICE_NAMES)} {service_id}",
+            'username': f"login{service_id}@{EMAIL_DOMAIN}",
+            'password_encrypted': tokens[owner_id][service_id // plan.users % CIPHERTEXT_POOL],
+            'owner_id': owner_id,
+        }
+
+
+def _shares(plan, rng):
+    start = datetime.utcnow() - timedelta(days=ACCESS_LOG_DAYS)
+    shared = (service_id for service_id in range(1, plan.services + 1) if plan.is_shared(service_id))
+    for n, service_id in enumerate(shared):
+        owner = plan.owner_of(service_id)
+        recipient = rng.randint(1, plan.users - 1)
+        yield {
+            'service_id': service_id,
+            'shared_to': recipient + 1 if recipient >= owner else recipient,
+            'shared_by': owner,
+            'timestamp': start + timedelta(days=ACCESS_LOG_DAYS * n / plan.shares),
+        }
+
+
+def _invites(plan, rng):
+    for n in range(plan.invites):
+        service_id = rng.randint(1, plan.services)
+        yield {'email': f"invitee{n}@{EMAIL_DOMAIN}", 'service_id': service_id,
+               'invited_by': plan.owner_of(service_id)}
+
+
+def _access_logs(plan, rng):
+    # Oldest first, so ids grow with accessed_at as they do in production
+    start = datetime.utcnow() - timedelta(days=ACCESS_LOG_DAYS)
+    step = timedelta(days=ACCESS_LOG_DAYS) / plan.access_logs
+    for n in range(plan.access_logs):
+        service_id = rng.randint(1, plan.services)
+        yield {
+            'service_id': service_id,
+            'user_id': plan.owner_of(service_id),
+            'ip': f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+            'accessed_at': start + step * n,
+        }
@@ -0,0 +1,94 @@
+"""
+Per-user cache of rendered page fragments.
+
+The dashboard, My Shares and Invites pages only change when something
+bumps the user's change counter (see versions.py): adding, editing or
+deleting a service, sharing, unsharing, inviting, cancelling an invite and
+invite conversion all do. Each page's content is rendered once per counter
+value and served from memory until the counter moves, so an unchanged page
+costs one primary-key lookup instead of its list queries and rendering.
+Flash messages and the navigation around the content are still rendered
+on every request.
+
+Entries live in a per-process LRU bounded by FRAGMENT_CACHE_MAX_BYTES of
+rendered HTML. Each (user, page) holds at most one fragment, replaced when
+the counter moves. Workers need no invalidation: the counter is in the
+database, so every worker sees a change on its next lookup.
+
+The counter is read before the page's queries run. A render that races
+with a change may show newer data than its counter value, never older, and
+the next request re-renders under the bumped counter anyway.
+"""
+
+import threading
+from collections import OrderedDict
+
+from metrics import FRAGMENT_CACHE_BYTES, FRAGMENT_CACHE_REQUESTS
+import versions
+
+
+class FragmentCache:
+    def __init__(self, app=None):
+        self._entries = OrderedDict()  # (user_id, page) -> (version, html, size in bytes)
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_bytes = app.config['FRAGMENT_CACHE_MAX_BYTES']
+        app.extensions['fragment_cache'] = self
+
+    def render(self, user_id, page, render):
+        """HTML of page for user_id; render() is only called if the user's vault changed since it was cached"""
+        if self.max_bytes <= 0:
+            return render()
+
+        key = (user_id, page)
+        version, _ = versions.current(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                FRAGMENT_CACHE_REQUESTS.labels(page, 'hit').inc()
+                return entry[1]
+            self.misses += 1
+        FRAGMENT_CACHE_REQUESTS.labels(page, 'miss').inc()
+
+        html = render()
+        size = len(html.encode())
+        if size <= self.max_bytes:
+            self._store(key, version, html, size)
+        return html
+
+    def _store(self, key, version, html, size):
+        with self._lock:
+            old = self._entries.get(key)
+            if old and old[0] > version:
+                return  # a concurrent request already cached a newer render
+            if old:
+                self.size -= old[2]
+            self._entries[key] = (version, html, size)
+            self._entries.move_to_end(key)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+            FRAGMENT_CACHE_BYTES.set(self.size)
+
+    def stats(self):
+        """Hit/miss counts and current size of this process's cache"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
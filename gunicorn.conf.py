@@ -0,0 +1,29 @@
+"""
+gunicorn settings, loaded automatically from the working directory.
+
+Workers share their Prometheus metrics through files in
+PROMETHEUS_MULTIPROC_DIR (see metrics.py). The directory must be set
+before any worker imports prometheus_client and must start out empty, so
+it is prepared here in the master process.
+"""
+
+import glob
+import os
+import tempfile
+
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='credvault-metrics-')
+
+
+def on_starting(server):
+    # Counters left by a previous run would be added to this one's
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, '*.db')):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (access log queue depth)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,241 @@
+"""
+Persistent email outbox.
+
+Messages are written to the OutboxEmail table instead of being sent from a
+thread per message. A small pool of worker threads claims due rows in
+batches and sends each batch over a single SMTP connection. Failed sends
+are retried with exponential backoff; after MAIL_OUTBOX_MAX_ATTEMPTS a
+message is marked 'dead' and left in the table for inspection.
+"""
+
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from flask_mail import Message
+from jinja2 import Environment, FileSystemLoader, meta, select_autoescape
+from sqlalchemy import and_, or_, update
+
+from models import db, OutboxEmail
+
+# Upper bound on the retry delay, however many attempts have failed
+MAX_RETRY_DELAY = 6 * 60 * 60
+
+# Email bodies live in templates/email as <name>.txt / <name>.html pairs.
+# Templates are compiled on first use and cached for the life of the process;
+# rendering needs no Flask request or app context.
+_email_env = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False,
+)
+
+
+def render_email(template_name, **context):
+    """Render the (text, html) bodies of an email template"""
+    body = _email_env.get_template(f"{template_name}.txt").render(context)
+    html = _email_env.get_template(f"{template_name}.html").render(context)
+    return body, html
+
+
+@lru_cache(maxsize=None)
+def _is_per_recipient(template_name):
+    """Whether a template's output depends on recipient_email"""
+    for ext in ('txt', 'html'):
+        source = _email_env.loader.get_source(_email_env, f"{template_name}.{ext}")[0]
+        if 'recipient_email' in meta.find_undeclared_variables(_email_env.parse(source)):
+            return True
+    return False
+
+
+def build_emails(template_name, subject, recipients, sender, **context):
+    """
+    Build one Message per recipient.
+    Templates that don't mention recipient_email are rendered once and the
+    bodies are shared by every recipient of the fan-out.
+    """
+    shared = None if _is_per_recipient(template_name) else render_email(template_name, **context)
+    messages = []
+    for recipient in recipients:
+        body, html = shared or render_email(template_name, recipient_email=recipient, **context)
+        messages.append(Message(subject=subject, recipients=[recipient], sender=sender, body=body, html=html))
+    return messages
+
+
+class EmailOutbox:
+    def __init__(self, app=None, mail=None):
+        self.app = None
+        self.mail = None
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail):
+        self.app = app
+        self.mail = mail
+        app.extensions['email_outbox'] = self
+
+    # ---------------- QUEUEING ----------------
+
+    def enqueue(self, msg: Message):
+        """Persist a message for delivery and wake the workers"""
+        self.enqueue_many([msg])
+
+    def enqueue_many(self, messages):
+        """Persist several messages in one commit, one outbox row per recipient"""
+        rows = []
+        for msg in messages:
+            for recipient in msg.recipients:
+                rows.append(OutboxEmail(
+                    recipient=recipient,
+                    sender=msg.sender if isinstance(msg.sender, str) else None,
+                    subject=msg.subject,
+                    body=msg.body,
+                    html=msg.html,
+                ))
+        if not rows:
+            return
+        db.session.add_all(rows)
+        db.session.commit()
+        self.start()
+        self._wakeup.set()
+
+    def depth(self):
+        """Number of messages still waiting to be delivered"""
+        return OutboxEmail.query.filter(OutboxEmail.status.in_(('pending', 'sending'))).count()
+
+    # ---------------- DELIVERY ----------------
+
+    def _claim(self, batch_size):
+        """Atomically claim up to batch_size due messages; returns the claimed rows"""
+        now = datetime.utcnow()
+        due = or_(
+            and_(OutboxEmail.status == 'pending', OutboxEmail.next_attempt_at <= now),
+            and_(OutboxEmail.status == 'sending', OutboxEmail.locked_until < now),
+        )
+        ids = [row.id for row in (db.session.query(OutboxEmail.id)
+                                  .filter(due)
+                                  .order_by(OutboxEmail.id)
+                                  .limit(batch_size))]
+        if not ids:
+            db.session.rollback()
+            return []
+
+        token = uuid.uuid4().hex
+        lease = timedelta(seconds=self.app.config['MAIL_OUTBOX_LEASE'])
+        # Re-checking the due condition makes the claim safe against other workers
+        db.session.execute(
+            update(OutboxEmail)
+            .where(OutboxEmail.id.in_(ids), due)
+            .values(status='sending', claim_token=token, locked_until=now + lease)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return OutboxEmail.query.filter_by(claim_token=token).order_by(OutboxEmail.id).all()
+
+    def _record_failure(self, row, error):
+        row.attempts += 1
+        row.last_error = str(error)[:1000]
+        row.claim_token = None
+        row.locked_until = None
+        if row.attempts >= self.app.config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+            row.status = 'dead'
+            print(f"☠️  Giving up on email {row.id} to {row.recipient} after {row.attempts} attempts: {error}")
+        else:
+            delay = min(self.app.config['MAIL_OUTBOX_RETRY_BASE'] * 2 ** (row.attempts - 1), MAX_RETRY_DELAY)
+            row.status = 'pending'
+            row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+            print(f"❌ Error sending email to {row.recipient} (attempt {row.attempts}, retry in {delay}s): {error}")
+
+    def _send_batch(self, rows):
+        """Send claimed rows over one SMTP connection and record each outcome"""
+        default_sender = self.app.config.get('MAIL_DEFAULT_SENDER')
+        try:
+            with self.mail.connect() as conn:
+                for row in rows:
+                    msg = Message(subject=row.subject,
+                                  recipients=[row.recipient],
+                                  sender=row.sender or default_sender,
+                                  body=row.body,
+                                  html=row.html)
+                    try:
+                        conn.send(msg)
+                    except Exception as e:
+                        self._record_failure(row, e)
+                        continue
+                    row.status = 'sent'
+                    row.sent_at = datetime.utcnow()
+                    row.attempts += 1
+                    row.claim_token = None
+                    row.locked_until = None
+                    print(f"✅ Email sent successfully to {row.recipient}")
+        except Exception as e:
+            # Connection-level failure: every message that wasn't sent is retried
+            for row in rows:
+                if row.status == 'sending':
+                    self._record_failure(row, e)
+        db.session.commit()
+
+    def drain(self, max_batches=None):
+        """Deliver due messages until none are left; returns the number processed"""
+        processed = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            rows = self._claim(self.app.config['MAIL_OUTBOX_BATCH_SIZE'])
+            if not rows:
+                break
+            self._send_batch(rows)
+            processed += len(rows)
+            batches += 1
+        db.session.remove()
+        return processed
+
+    def requeue_dead(self):
+        """Give dead-lettered messages a fresh set of attempts"""
+        count = (OutboxEmail.query
+                 .filter_by(status='dead')
+                 .update({'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.utcnow()},
+                         synchronize_session=False))
+        db.session.commit()
+        return count
+
+    # ---------------- WORKER POOL ----------------
+
+    def _run(self):
+        poll_interval = self.app.config['MAIL_OUTBOX_POLL_INTERVAL']
+        while not self._stopping.is_set():
+            self._wakeup.wait(poll_interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.drain()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Email outbox worker error: {e}")
+
+    def start(self):
+        """Start the worker pool once per process"""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.app.config['MAIL_OUTBOX_WORKERS']):
+                thread = threading.Thread(target=self._run, name=f"email-outbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._wakeup.set()
+
+    def stop(self, timeout=None):
+        """Signal the worker pool to finish its current batch and exit"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
@@ -0,0 +1,224 @@
+"""
+Prometheus metrics, served as text on /metrics.
+
+RequestMetrics hooks every request and records, per endpoint:
+- latency (histogram) and a request count by status
+- the number of SQL statements it ran and the time spent in them
+  (histograms), counted by SQLAlchemy engine events
+crypto_utils and passwords.py time their calls with crypto_timer() and the
+PASSWORD_HASH_SECONDS histogram; fragments.py and datakeys.py count their
+cache hits and misses. The email outbox depth is read from the database at scrape time;
+the access log writer's queue is sampled after each request.
+
+gunicorn workers are separate processes, so their metrics live in files:
+gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at an empty directory
+before the workers start, every worker writes its samples there, and
+whichever worker answers a scrape adds up all of them. Without that
+variable (flask run, tests) metrics stay in process memory.
+
+Latency of streamed responses (exports) covers producing the response
+object, not sending the stream.
+
+prometheus_client is only imported when a metric is first used or
+RequestMetrics is set up, so `import app` (CLI commands, tests) doesn't pay
+for it.
+"""
+
+import functools
+import hmac
+import os
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event, func
+
+from models import db, OutboxEmail
+
+_metrics_lock = threading.Lock()
+_ALL_METRICS = []
+
+
+class _LazyMetric:
+    """A prometheus_client metric that is created (and registered) on first use"""
+
+    def __init__(self, kind, *args, **kwargs):
+        self._definition = (kind, args, kwargs)
+        self._metric = None
+        _ALL_METRICS.append(self)
+
+    def get(self):
+        if self._metric is None:
+            with _metrics_lock:
+                if self._metric is None:
+                    import prometheus_client
+                    kind, args, kwargs = self._definition
+                    self._metric = getattr(prometheus_client, kind)(*args, **kwargs)
+        return self._metric
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+Counter = functools.partial(_LazyMetric, 'Counter')
+Gauge = functools.partial(_LazyMetric, 'Gauge')
+Histogram = functools.partial(_LazyMetric, 'Histogram')
+
+
+REQUEST_SECONDS = Histogram('credvault_request_duration_seconds', 'Request latency',
+                            ['endpoint', 'method'])
+REQUESTS = Counter('credvault_requests_total', 'Requests handled', ['endpoint', 'method', 'status'])
+REQUEST_SQL_STATEMENTS = Histogram('credvault_request_sql_statements', 'SQL statements run by one request',
+                                   ['endpoint'], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233))
+REQUEST_SQL_SECONDS = Histogram('credvault_request_sql_duration_seconds', 'Time one request spent in SQL',
+                                ['endpoint'])
+SQL_STATEMENTS = Counter('credvault_sql_statements_total', 'SQL statements run, in requests and background jobs')
+
+CRYPTO_SECONDS = Histogram('credvault_crypto_duration_seconds', 'Time per crypto_utils call', ['operation'],
+                           buckets=(.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1))
+CRYPTO_VALUES = Counter('credvault_crypto_values_total', 'Values processed by crypto_utils calls', ['operation'])
+PASSWORD_HASH_SECONDS = Histogram('credvault_password_hash_duration_seconds',
+                                  'Password hash/verify time, including the wait for a pool worker',
+                                  ['operation'], buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+PASSWORD_HASH_BUSY = Counter('credvault_password_hash_busy_total',
+                             'Hashes turned away because too many were queued, or the pool timed out or crashed')
+
+ACCESS_LOG_QUEUE = Gauge('credvault_access_log_queue_depth', 'Access log events waiting for the batch writer',
+                         multiprocess_mode='livesum')
+
+FRAGMENT_CACHE_REQUESTS = Counter('credvault_fragment_cache_requests_total', 'Page fragment cache lookups',
+                                  ['page', 'result'])
+FRAGMENT_CACHE_BYTES = Gauge('credvault_fragment_cache_bytes', 'Rendered HTML held by the page fragment cache',
+                             multiprocess_mode='livesum')
+DATA_KEY_CACHE_REQUESTS = Counter('credvault_data_key_cache_requests_total', 'Data key cache lookups, per key',
+                                  ['result'])
+
+
+def crypto_timer(operation):
+    """Decorator for crypto_utils functions: time each call and count the values it processed"""
+    @functools.cache
+    def labelled():
+        return CRYPTO_SECONDS.labels(operation), CRYPTO_VALUES.labels(operation)
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(value, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(value, *args, **kwargs)
+            finally:
+                seconds, values = labelled()
+                seconds.observe(time.perf_counter() - started)
+                values.inc(len(value) if isinstance(value, list) else 1)
+        return wrapper
+    return decorate
+
+
+# ---------------- SQL ----------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+    SQL_STATEMENTS.inc()
+    if has_request_context():
+        g.metrics_sql_statements = g.get('metrics_sql_statements', 0) + 1
+        g.metrics_sql_seconds = g.get('metrics_sql_seconds', 0.0) + elapsed
+
+
+# ---------------- EMAIL OUTBOX ----------------
+
+class _OutboxCollector:
+    """Outbox depth by status, read from the database so every worker reports the same value"""
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily
+
+        counts = dict(db.session.query(OutboxEmail.status, func.count())
+                      .filter(OutboxEmail.status != 'sent')
+                      .group_by(OutboxEmail.status)
+                      .all())
+        gauge = GaugeMetricFamily('credvault_email_outbox_messages', 'Outbox emails not yet sent, by status',
+                                  labels=['status'])
+        for status in ('pending', 'sending', 'dead'):
+            gauge.add_metric([status], counts.get(status, 0))
+        yield gauge
+
+
+# ---------------- REQUEST HOOKS ----------------
+
+class RequestMetrics:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.token = app.config['METRICS_TOKEN']
+        app.extensions['metrics'] = self
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        with app.app_context():
+            # Only registers listeners; no connection is opened yet
+            engine = db.engine
+        if not event.contains(engine, 'after_cursor_execute', _after_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+        from prometheus_client import CollectorRegistry
+
+        # Register every metric up front so scrapes list them before their first sample
+        for metric in _ALL_METRICS:
+            metric.get()
+        self._live = CollectorRegistry()
+        self._live.register(_OutboxCollector())
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql_statements = 0
+        g.metrics_sql_seconds = 0.0
+
+    def _record(self, status):
+        if g.get('metrics_started') is None:
+            return
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - g.metrics_started)
+        REQUESTS.labels(endpoint, request.method, str(status)).inc()
+        REQUEST_SQL_STATEMENTS.labels(endpoint).observe(g.metrics_sql_statements)
+        REQUEST_SQL_SECONDS.labels(endpoint).observe(g.metrics_sql_seconds)
+        g.metrics_started = None
+
+        access_log = current_app.extensions.get('access_log_writer')
+        if access_log is not None:
+            ACCESS_LOG_QUEUE.set(access_log.depth())
+
+    def _finish(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown(self, exc):
+        # after_request doesn't run when a view raises
+        if exc is not None:
+            self._record(500)
+
+    def render(self):
+        """Every worker's metrics in the Prometheus text format"""
+        if self.token:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not hmac.compare_digest(supplied.encode(), self.token.encode()):
+                return Response('Unauthorized\n', status=401, mimetype='text/plain')
+
+        from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry) + generate_latest(self._live), content_type=CONTENT_TYPE_LATEST)
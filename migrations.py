@@ -0,0 +1,210 @@
+"""
+Schema upgrades for existing databases.
+
+db.create_all() only creates missing tables; it never touches tables that
+already exist. `flask upgrade-db` brings an existing vault.db or Postgres
+database up to date with models.py:
+- creates any new tables
+- adds new columns to existing tables (they must be nullable or have a
+  server_default)
+- adds the ON DELETE rules declared in models.py to existing foreign keys
+  (SQLite can't alter a constraint, so the table is rebuilt and its rows
+  copied; rows whose parent no longer exists are removed first)
+- removes duplicate Share / PendingInvite rows that would violate the
+  unique indexes (the oldest row is kept)
+- rebuilds SQLite tables declared with sqlite_autoincrement that were
+  created without it, so their ids are never reused
+- creates every index declared in models.py that is missing
+- installs the service search index (see search.py)
+
+It is idempotent and safe to run on every deploy.
+"""
+
+from contextlib import contextmanager
+
+from sqlalchemy import MetaData, func, inspect, select, text
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+
+from models import db, ChangeLog, ChangeLogCompaction, Share, PendingInvite
+import search
+
+# (model, columns that must be unique together)
+_UNIQUE_KEYS = (
+    (Share, ('service_id', 'shared_to')),
+    (PendingInvite, ('email', 'service_id')),
+)
+
+# (model, highest id clients may have seen that is no longer in the table): ids handed out
+# as cursors must keep growing past it even if every row has been deleted
+_ID_FLOORS = (
+    (ChangeLog, select(func.max(ChangeLogCompaction.compacted_through))),
+)
+
+
+def _remove_duplicates(model, columns, log):
+    table = model.__tablename__
+    cols = ', '.join(columns)
+    result = db.session.execute(text(
+        f'DELETE FROM "{table}" WHERE id NOT IN '
+        f'(SELECT MIN(id) FROM "{table}" GROUP BY {cols})'
+    ))
+    if result.rowcount:
+        log(f"  🧹 Removed {result.rowcount} duplicate {table} row(s) on ({cols})")
+
+
+def _add_missing_columns(log):
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    log(f"  ⚠️  Add {table.name}.{column.name} by hand; it is NOT NULL without a server_default")
+                    continue
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN '
+                                  f'{CreateColumn(column).compile(dialect=conn.dialect)}'))
+                log(f"  ➕ Added column {table.name}.{column.name}")
+
+
+def _stale_foreign_keys(table, inspector):
+    """(declared fk, reflected constraint name) pairs whose ON DELETE rule differs in the database"""
+    reflected = {(tuple(fk['constrained_columns']), fk['referred_table']): fk
+                 for fk in inspector.get_foreign_keys(table.name)}
+    stale = []
+    for fk in table.foreign_keys:
+        if not fk.ondelete:
+            continue
+        current = reflected.get(((fk.parent.name,), fk.column.table.name))
+        if current and (current['options'].get('ondelete') or '').upper() != fk.ondelete.upper():
+            stale.append((fk, current['name']))
+    return stale
+
+
+def _remove_orphans(conn, table, stale, log):
+    for fk, _ in stale:
+        column, parent = fk.parent.name, fk.column.table
+        result = conn.execute(text(
+            f'DELETE FROM "{table.name}" WHERE {column} IS NOT NULL AND {column} NOT IN '
+            f'(SELECT {fk.column.name} FROM "{parent.name}")'
+        ))
+        if result.rowcount:
+            log(f"  🧹 Removed {result.rowcount} {table.name} row(s) whose {parent.name} no longer exists")
+
+
+def _rebuild_sqlite_table(conn, table, columns):
+    """Recreate table from models.py with its rows; indexes are recreated afterwards"""
+    new_name = f"_{table.name}_new"
+    cols = ', '.join(f'"{column}"' for column in columns)
+    metadata = MetaData()
+    for parent in {fk.column.table for fk in table.foreign_keys}:
+        parent.to_metadata(metadata)
+    conn.execute(CreateTable(table.to_metadata(metadata, name=new_name)))
+    conn.execute(text(f'INSERT INTO "{new_name}" ({cols}) SELECT {cols} FROM "{table.name}"'))
+    conn.execute(text(f'DROP TABLE "{table.name}"'))
+    conn.execute(text(f'ALTER TABLE "{new_name}" RENAME TO "{table.name}"'))
+
+
+@contextmanager
+def _sqlite_rebuild_transaction():
+    """Connection in a transaction with foreign key enforcement off, for rebuilding tables"""
+    with db.engine.connect() as conn:
+        # Enforcement can't change mid-transaction, so it is turned off before BEGIN
+        conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        try:
+            conn.exec_driver_sql('BEGIN')
+            yield conn
+            conn.commit()
+        except Exception:
+            # The pragma is ignored inside a transaction, so end it before restoring enforcement
+            conn.rollback()
+            raise
+        finally:
+            conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+
+
+def _upgrade_foreign_keys(log):
+    inspector = inspect(db.engine)
+    dialect = db.engine.dialect.name
+    for table in db.metadata.sorted_tables:
+        stale = _stale_foreign_keys(table, inspector)
+        if not stale:
+            continue
+        rules = ', '.join(f"{fk.parent.name} ON DELETE {fk.ondelete}" for fk, _ in stale)
+
+        if dialect == 'sqlite':
+            columns = [column['name'] for column in inspector.get_columns(table.name)
+                       if column['name'] in table.c]
+            # Constraints can't be altered in SQLite; rebuild the table instead
+            with _sqlite_rebuild_transaction() as conn:
+                _remove_orphans(conn, table, stale, log)
+                _rebuild_sqlite_table(conn, table, columns)
+        elif dialect == 'postgresql':
+            with db.engine.begin() as conn:
+                _remove_orphans(conn, table, stale, log)
+                for fk, name in stale:
+                    conn.execute(text(
+                        f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{name}", '
+                        f'ADD CONSTRAINT "{name}" FOREIGN KEY ({fk.parent.name}) '
+                        f'REFERENCES "{fk.column.table.name}" ({fk.column.name}) '
+                        f'ON DELETE {fk.ondelete} NOT VALID'
+                    ))
+            # Checking existing rows in a separate transaction doesn't block writes to the table
+            with db.engine.begin() as conn:
+                for _, name in stale:
+                    conn.execute(text(f'ALTER TABLE "{table.name}" VALIDATE CONSTRAINT "{name}"'))
+        else:
+            log(f"  ⚠️  Add {rules} to {table.name} by hand; {dialect} is not supported")
+            continue
+        log(f"  🔗 Updated {table.name} foreign keys: {rules}")
+
+
+def _upgrade_sqlite_autoincrement(log):
+    """Rebuild SQLite tables that should be AUTOINCREMENT but were created without it"""
+    if db.engine.dialect.name != 'sqlite':
+        return  # Postgres sequences never reuse ids
+    inspector = inspect(db.engine)
+    floors = {model.__table__: floor for model, floor in _ID_FLOORS}
+    for table in db.metadata.sorted_tables:
+        if not table.dialect_options['sqlite']['autoincrement']:
+            continue
+        with db.engine.connect() as conn:
+            sql = conn.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                              {'name': table.name})
+        if 'AUTOINCREMENT' in sql.upper():
+            continue
+
+        columns = [column['name'] for column in inspector.get_columns(table.name) if column['name'] in table.c]
+        with _sqlite_rebuild_transaction() as conn:
+            _rebuild_sqlite_table(conn, table, columns)
+            floor = conn.scalar(floors[table]) if table in floors else None
+            if floor:
+                # The copied rows set the sequence to their max id; ids already deleted may be higher
+                conn.execute(text('DELETE FROM sqlite_sequence WHERE name = :name'), {'name': table.name})
+                conn.execute(text(f'INSERT INTO sqlite_sequence (name, seq) '
+                                  f'SELECT :name, MAX(:floor, COALESCE(MAX(id), 0)) FROM "{table.name}"'),
+                             {'name': table.name, 'floor': floor})
+        log(f"  🔢 Rebuilt {table.name} with AUTOINCREMENT ids")
+
+
+def upgrade_schema(log=print):
+    """Bring the database schema up to date. Must run inside an app context."""
+    log("🛠️  Upgrading database schema")
+    db.create_all()
+    _add_missing_columns(log)
+
+    for model, columns in _UNIQUE_KEYS:
+        _remove_duplicates(model, columns, log)
+    db.session.commit()
+
+    _upgrade_foreign_keys(log)
+    _upgrade_sqlite_autoincrement(log)
+
+    # IF NOT EXISTS rather than checkfirst: reflection can't see expression indexes like lower(name)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                conn.execute(CreateIndex(index, if_not_exists=True))
+    search.install(log)
+    log("✅ Schema is up to date")
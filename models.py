@@ -1,38 +1,213 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func
 from datetime import datetime
 
 db = SQLAlchemy()
 
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run the given PRAGMAs on every new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
+    # This user's data key, encrypted with ENCRYPTION_KEY (see datakeys.py); created on first use
+    data_key_wrapped = db.Column(db.String(255))
 
 class Service(db.Model):
+    __table_args__ = (
+        db.Index('ix_service_owner_id', 'owner_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
     username = db.Column(db.String(100))
     password_encrypted = db.Column(db.String(1000))  # store ciphertext
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
+    # Deleting a service deletes its shares, invites and access logs. passive_deletes
+    # leaves that to the database's ON DELETE CASCADE instead of loading every child row.
+    shares = db.relationship('Share', back_populates='service',
+                             cascade='all, delete-orphan', passive_deletes=True)
+    pending_invites = db.relationship('PendingInvite', cascade='all, delete-orphan', passive_deletes=True)
+    access_logs = db.relationship('AccessLog', lazy='write_only',
+                                  cascade='all, delete-orphan', passive_deletes=True)
+    team_shares = db.relationship('TeamShare', back_populates='service',
+                                  cascade='all, delete-orphan', passive_deletes=True)
+
+# Case-insensitive listing and prefix search of a user's services (see search.py)
+db.Index('ix_service_owner_id_lower_name', Service.owner_id, func.lower(Service.name))
+db.Index('ix_service_owner_id_lower_username', Service.owner_id, func.lower(Service.username))
+
 class Share(db.Model):
+    # Unique indexes rather than table constraints so `flask upgrade-db` can add them to existing databases
+    __table_args__ = (
+        db.Index('uq_share_service_id_shared_to', 'service_id', 'shared_to', unique=True),
+        db.Index('ix_share_shared_to', 'shared_to'),
+        db.Index('ix_share_shared_by', 'shared_by'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    service_id = db.Column(db.Integer, db.ForeignKey('service.id'))
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id', ondelete='CASCADE'))
     shared_to = db.Column(db.Integer, db.ForeignKey('user.id'))
     shared_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    service = db.relationship('Service', foreign_keys=[service_id], back_populates='shares')
+    recipient = db.relationship('User', foreign_keys=[shared_to])
+    sharer = db.relationship('User', foreign_keys=[shared_by])
+
+class Team(db.Model):
+    """A group of users that services can be shared with in one grant (see teams.py)"""
+    __table_args__ = (
+        db.Index('ix_team_owner_id', 'owner_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # manages the members
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    owner = db.relationship('User', foreign_keys=[owner_id])
+    members = db.relationship('TeamMember', back_populates='team',
+                              cascade='all, delete-orphan', passive_deletes=True)
+    shares = db.relationship('TeamShare', back_populates='team',
+                             cascade='all, delete-orphan', passive_deletes=True)
+
+class TeamMember(db.Model):
+    # (user_id, team_id) finds a user's teams; (team_id, user_id) a team's members
+    __table_args__ = (
+        db.Index('uq_team_member_team_id_user_id', 'team_id', 'user_id', unique=True),
+        db.Index('ix_team_member_user_id_team_id', 'user_id', 'team_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = db.Column(db.Integer, db.ForeignKey('team.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    team = db.relationship('Team', back_populates='members')
+    user = db.relationship('User')
+
+class TeamShare(db.Model):
+    # (team_id, service_id) resolves a user's teams to services; (service_id, team_id) a service's teams
+    __table_args__ = (
+        db.Index('uq_team_share_service_id_team_id', 'service_id', 'team_id', unique=True),
+        db.Index('ix_team_share_team_id_service_id', 'team_id', 'service_id'),
+        db.Index('ix_team_share_shared_by', 'shared_by'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id', ondelete='CASCADE'), nullable=False)
+    team_id = db.Column(db.Integer, db.ForeignKey('team.id', ondelete='CASCADE'), nullable=False)
+    shared_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    service = db.relationship('Service', back_populates='team_shares')
+    team = db.relationship('Team', back_populates='shares')
+
 class PendingInvite(db.Model):
     """Store invitations for users who haven't registered yet"""
+    __table_args__ = (
+        db.Index('uq_pending_invite_email_service_id', 'email', 'service_id', unique=True),
+        db.Index('ix_pending_invite_service_id', 'service_id'),
+        db.Index('ix_pending_invite_invited_by', 'invited_by'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), nullable=False)
-    service_id = db.Column(db.Integer, db.ForeignKey('service.id'))
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id', ondelete='CASCADE'))
     invited_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class AccessLog(db.Model):
+    # Keyset pagination walks (accessed_at, id) newest-first, optionally per service or user
+    __table_args__ = (
+        db.Index('ix_access_log_accessed_at_id', 'accessed_at', 'id'),
+        db.Index('ix_access_log_service_accessed_at_id', 'service_id', 'accessed_at', 'id'),
+        db.Index('ix_access_log_user_accessed_at_id', 'user_id', 'accessed_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    service_id = db.Column(db.Integer, db.ForeignKey('service.id'))
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id', ondelete='CASCADE'))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     accessed_at = db.Column(db.DateTime, default=datetime.utcnow)
     ip = db.Column(db.String(50))
+
+class KeyRotationCheckpoint(db.Model):
+    """Progress of a re-encryption run, so `flask rotate-keys` can resume after a crash"""
+    id = db.Column(db.Integer, primary_key=True)
+    key_fingerprint = db.Column(db.String(16), unique=True, nullable=False)
+    last_user_id = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_service_id = db.Column(db.Integer, nullable=False, default=0)
+    rows_rotated = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class OutboxEmail(db.Model):
+    """Outgoing email, persisted so it survives worker restarts and can be retried"""
+    __table_args__ = (
+        db.Index('ix_outbox_email_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    sender = db.Column(db.String(120))
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32), index=True)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+class SessionRecord(db.Model):
+    """Server-side session data, used when SESSION_BACKEND is "database" """
+    id = db.Column(db.String(64), primary_key=True)  # SHA-256 of the session id in the cookie
+    user_id = db.Column(db.Integer, index=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class UserVersion(db.Model):
+    """Per-user change counter, bumped whenever anything the user can list changes (see versions.py)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ChangeLog(db.Model):
+    """Per-user feed of changed services and shares; the id is the sync cursor (see changes.py)"""
+    __table_args__ = (
+        db.Index('ix_change_log_user_id_id', 'user_id', 'id'),
+        db.Index('ix_change_log_user_id_kind_object_id', 'user_id', 'kind', 'object_id', 'id'),
+        db.Index('ix_change_log_created_at', 'created_at'),
+        # Ids are sync cursors: never hand out an id again after compaction deletes the newest rows
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # service, share
+    object_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # upsert, delete
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ChangeLogCompaction(db.Model):
+    """A `flask compact-changes` run; sync cursors at or below compacted_through must resync"""
+    id = db.Column(db.Integer, primary_key=True)
+    compacted_through = db.Column(db.Integer, nullable=False)
+    rows_deleted = db.Column(db.Integer, nullable=False, default=0)
+    compacted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
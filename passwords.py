@@ -0,0 +1,138 @@
+"""
+Password hashing for user accounts.
+
+The hash method and its cost parameters come from PASSWORD_HASH_METHOD
+(any Werkzeug method string, e.g. "scrypt:32768:8:1" or
+"pbkdf2:sha256:600000"). Hashes stored with different parameters are
+upgraded transparently the next time the user logs in.
+
+With PASSWORD_HASH_WORKERS > 0 the slow hash runs in a bounded process
+pool, so hashing never holds the web worker's GIL. Either way at most
+PASSWORD_HASH_MAX_PENDING hashes may be running or waiting per process;
+beyond that HashingBusy is raised and the request is turned away instead
+of queueing behind a login flood. A pooled hash keeps its slot until the
+job has finished, even if the request stopped waiting for it; a hash that
+outlasts PASSWORD_HASH_TIMEOUT, or a crashed pool, also raises HashingBusy.
+Run gunicorn with --threads so other
+requests keep being served while logins wait on the pool.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from metrics import PASSWORD_HASH_BUSY, PASSWORD_HASH_SECONDS
+
+
+class HashingBusy(Exception):
+    """Too many password hashes are already queued in this process, or the pool can't finish one in time"""
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self._pool = None
+        self._method = None
+        self._pool_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.configured_method = app.config['PASSWORD_HASH_METHOD']
+        self._method = None
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+        self.shutdown()
+        app.extensions['password_hasher'] = self
+
+    @property
+    def method(self):
+        """
+        PASSWORD_HASH_METHOD as Werkzeug writes it into hashes, with default
+        parameters filled in ("scrypt" -> "scrypt:32768:8:1"). Expanding it
+        costs one throwaway hash, so it happens on first use, not in create_app().
+        """
+        if self._method is None:
+            self._method = generate_password_hash('', self.configured_method).split('$', 1)[0]
+        return self._method
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # spawn, not fork: the web process already runs background threads
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def _discard_pool(self, pool):
+        """Drop a broken pool so the next hash starts a new one"""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _busy(self):
+        PASSWORD_HASH_BUSY.inc()
+        return HashingBusy()
+
+    def _run(self, fn, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise self._busy()
+        if not self.workers:
+            try:
+                return fn(*args)
+            finally:
+                slots.release()
+
+        pool = self._get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            slots.release()
+            self._discard_pool(pool)
+            raise self._busy() from None
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is held until the job is done, not just until we stop waiting for it
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise self._busy() from None
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise self._busy() from None
+
+    def hash(self, password):
+        """Hash a password with the configured method"""
+        with PASSWORD_HASH_SECONDS.labels('hash').time():
+            return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Check a password against a stored hash"""
+        with PASSWORD_HASH_SECONDS.labels('verify').time():
+            return self._run(_verify, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Whether a stored hash was made with other parameters than PASSWORD_HASH_METHOD"""
+        return pwhash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,91 @@
+"""
+Access log retention.
+
+`flask archive-access-logs` moves AccessLog rows older than
+ACCESS_LOG_RETENTION_DAYS out of the database. Rows are read oldest first
+in (accessed_at, id) order, ACCESS_LOG_ARCHIVE_CHUNK_SIZE at a time; each
+chunk is written to its own gzip-compressed NDJSON file in
+ACCESS_LOG_ARCHIVE_DIR, and only once that file is safely on disk are the
+chunk's rows deleted, ACCESS_LOG_DELETE_BATCH_SIZE per transaction so the
+writer lock is never held for long.
+
+A run that is interrupted between writing a file and finishing its deletes
+archives the remaining rows again next time, so a row may appear in two
+files but is never deleted without being archived.
+"""
+
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, tuple_
+
+from models import db, AccessLog, Service, User
+
+
+def _archive_rows(cutoff, position, limit):
+    """The next chunk of rows older than cutoff, after position in (accessed_at, id) order"""
+    query = (select(AccessLog.id, AccessLog.service_id, Service.name.label('service_name'),
+                    AccessLog.user_id, User.email.label('user_email'), AccessLog.ip, AccessLog.accessed_at)
+             .outerjoin(Service, AccessLog.service_id == Service.id)
+             .outerjoin(User, AccessLog.user_id == User.id)
+             .where(AccessLog.accessed_at < cutoff))
+    if position is not None:
+        query = query.where(tuple_(AccessLog.accessed_at, AccessLog.id) > tuple_(*position))
+    return db.session.execute(query.order_by(AccessLog.accessed_at, AccessLog.id).limit(limit)).all()
+
+
+def _write_archive(archive_dir, rows):
+    """Write rows to a new .ndjson.gz file atomically; returns its path"""
+    first, last = rows[0], rows[-1]
+    name = f"access_log_{first.accessed_at:%Y%m%dT%H%M%S}_{first.id}-{last.id}.ndjson.gz"
+    path = os.path.join(archive_dir, name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(filename=name[:-3], mode='wb', fileobj=raw) as out:
+            for row in rows:
+                record = row._asdict()
+                record['accessed_at'] = row.accessed_at.isoformat()
+                out.write((json.dumps(record) + '\n').encode())
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def archive_access_logs(archive_dir, retention_days=365, chunk_size=10000, batch_size=500, pause=0.0, log=print):
+    """
+    Archive and delete access logs older than retention_days.
+    Must run inside an app context. Returns the number of rows archived.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    log(f"🗄️  Archiving access logs older than {cutoff:%Y-%m-%d %H:%M} to {archive_dir}")
+
+    started = time.perf_counter()
+    archived = files = 0
+    position = None
+    while True:
+        rows = _archive_rows(cutoff, position, chunk_size)
+        db.session.rollback()  # don't hold a read transaction open while writing the file
+        if not rows:
+            break
+
+        path = _write_archive(archive_dir, rows)
+        ids = [row.id for row in rows]
+        for start in range(0, len(ids), batch_size):
+            db.session.execute(delete(AccessLog).where(AccessLog.id.in_(ids[start:start + batch_size])))
+            db.session.commit()
+            if pause:
+                time.sleep(pause)
+
+        archived += len(rows)
+        files += 1
+        position = (rows[-1].accessed_at, rows[-1].id)
+        log(f"  📦 {os.path.basename(path)}: {len(rows)} row(s)")
+
+    elapsed = time.perf_counter() - started
+    log(f"✅ Archived {archived} access log(s) into {files} file(s) in {elapsed:.1f}s")
+    return archived
@@ -0,0 +1,243 @@
+"""
+Online re-encryption of stored credentials after an ENCRYPTION_KEY change.
+
+Credentials are encrypted with their owner's data key, which is stored
+wrapped with ENCRYPTION_KEY (see datakeys.py), so a rotation re-wraps one
+data key per user; only credentials from before data keys were introduced
+are re-encrypted themselves. `flask migrate-data-keys` moves those onto
+data keys, after which a rotation no longer touches the service table's
+ciphertexts at all.
+
+Rotation procedure:
+1. Set ENCRYPTION_KEY to the new key and move the previous key into
+   OLD_ENCRYPTION_KEYS, then restart the app. Reads keep working because
+   crypto_utils decrypts with any configured key.
+2. Run `flask rotate-keys`. Users, then services still encrypted with
+   ENCRYPTION_KEY, are walked in primary-key order in small batches; each
+   batch is committed together with a checkpoint, so an interrupted run
+   resumes where it stopped.
+3. Once the run reports completion, remove OLD_ENCRYPTION_KEYS.
+"""
+
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from cryptography.fernet import InvalidToken
+from flask import current_app
+from sqlalchemy import bindparam, update
+
+from crypto_utils import DATA_KEY_PREFIX, decrypt_many, encrypt_many, key_fingerprint, rotate_many
+from models import db, Service, KeyRotationCheckpoint, User
+
+# Only overwrite a row if it still holds the ciphertext we read, so a
+# concurrent edit_service() is never clobbered by a stale rotated value.
+_service_table = Service.__table__
+_rotate_stmt = (
+    update(_service_table)
+    .where(_service_table.c.id == bindparam('b_id'))
+    .where(_service_table.c.password_encrypted == bindparam('b_old'))
+    .values(password_encrypted=bindparam('b_new'))
+)
+_user_table = User.__table__
+_rewrap_stmt = (
+    update(_user_table)
+    .where(_user_table.c.id == bindparam('b_id'))
+    .where(_user_table.c.data_key_wrapped == bindparam('b_old'))
+    .values(data_key_wrapped=bindparam('b_new'))
+)
+
+
+def _rotate_batch(rows):
+    """Return (update params, ids that could not be decrypted) for a batch of (id, token) rows"""
+    rows = [(service_id, token) for service_id, token in rows if token]
+    try:
+        rotated = rotate_many([token for _, token in rows])
+        return [
+            {'b_id': service_id, 'b_old': token, 'b_new': new_token}
+            for (service_id, token), new_token in zip(rows, rotated)
+        ], []
+    except InvalidToken:
+        pass
+
+    # Fall back to one row at a time so a single corrupt row doesn't stall the run
+    params, failed = [], []
+    for service_id, token in rows:
+        try:
+            new_token = rotate_many([token])[0]
+        except InvalidToken:
+            failed.append(service_id)
+            continue
+        params.append({'b_id': service_id, 'b_old': token, 'b_new': new_token})
+    return params, failed
+
+
+def _rewrap_data_keys(checkpoint, chunk_size, pause, log):
+    """Re-wrap every User.data_key_wrapped under the current key; returns (rows re-wrapped, failed ids)"""
+    started = time.perf_counter()
+    rewrapped, failed_ids = 0, []
+    while True:
+        rows = (db.session.query(User.id, User.data_key_wrapped)
+                .filter(User.id > checkpoint.last_user_id, User.data_key_wrapped.isnot(None))
+                .order_by(User.id)
+                .limit(chunk_size)
+                .all())
+        if not rows:
+            break
+
+        params, failed = _rotate_batch(rows)
+        failed_ids.extend(failed)
+        if params:
+            db.session.execute(_rewrap_stmt, params)
+
+        checkpoint.last_user_id = rows[-1][0]
+        checkpoint.rows_rotated += len(params)
+        checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        rewrapped += len(params)
+        elapsed = time.perf_counter() - started
+        rate = rewrapped / elapsed if elapsed else 0.0
+        log(f"  … {rewrapped} data keys re-wrapped (up to user id {checkpoint.last_user_id}, {rate:,.0f} keys/s)")
+
+        if pause:
+            time.sleep(pause)
+    return rewrapped, failed_ids
+
+
+def rotate_service_keys(chunk_size=500, pause=0.0, log=print):
+    """
+    Re-wrap every user's data key, and re-encrypt every Service.password_encrypted
+    not yet on a data key, under the current key.
+    Must run inside an app context. Returns the checkpoint row.
+    """
+    fingerprint = key_fingerprint()
+    checkpoint = KeyRotationCheckpoint.query.filter_by(key_fingerprint=fingerprint).first()
+    if checkpoint is None:
+        checkpoint = KeyRotationCheckpoint(key_fingerprint=fingerprint)
+        db.session.add(checkpoint)
+        db.session.commit()
+        log(f"🔑 Starting key rotation to key {fingerprint}")
+    elif checkpoint.finished_at:
+        log(f"✅ Key {fingerprint} rotation already finished at {checkpoint.finished_at}")
+        return checkpoint
+    else:
+        log(f"🔁 Resuming key rotation to key {fingerprint} after user id {checkpoint.last_user_id}, "
+            f"service id {checkpoint.last_service_id}")
+
+    started = time.perf_counter()
+    rotated_this_run, failed_ids = _rewrap_data_keys(checkpoint, chunk_size, pause, log)
+
+    # Data key ciphertexts are covered by re-wrapping their owner's key
+    while True:
+        rows = (db.session.query(Service.id, Service.password_encrypted)
+                .filter(Service.id > checkpoint.last_service_id,
+                        ~Service.password_encrypted.startswith(DATA_KEY_PREFIX))
+                .order_by(Service.id)
+                .limit(chunk_size)
+                .all())
+        if not rows:
+            break
+
+        params, failed = _rotate_batch(rows)
+        failed_ids.extend(failed)
+        if params:
+            db.session.execute(_rotate_stmt, params)
+
+        checkpoint.last_service_id = rows[-1][0]
+        checkpoint.rows_rotated += len(params)
+        checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+
+        rotated_this_run += len(params)
+        elapsed = time.perf_counter() - started
+        rate = rotated_this_run / elapsed if elapsed else 0.0
+        log(f"  … {checkpoint.rows_rotated} rows rotated (up to id {checkpoint.last_service_id}, {rate:,.0f} rows/s)")
+
+        if pause:
+            time.sleep(pause)
+
+    checkpoint.finished_at = datetime.utcnow()
+    db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    rate = rotated_this_run / elapsed if elapsed else 0.0
+    log(f"✅ Key rotation finished: {rotated_this_run} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+    if failed_ids:
+        log(f"⚠️  {len(failed_ids)} row(s) could not be decrypted with any configured key: {failed_ids[:20]}")
+    return checkpoint
+
+
+def _decrypt_each(rows):
+    """Return ((id, token, plaintext) rows, ids that could not be decrypted) for (id, token) rows"""
+    try:
+        return [(service_id, token, plaintext) for (service_id, token), plaintext
+                in zip(rows, decrypt_many([token for _, token in rows]))], []
+    except InvalidToken:
+        pass
+    decrypted, failed = [], []
+    for service_id, token in rows:
+        try:
+            decrypted.append((service_id, token, decrypt_many([token])[0]))
+        except InvalidToken:
+            failed.append(service_id)
+    return decrypted, failed
+
+
+def migrate_to_data_keys(chunk_size=500, pause=0.0, log=print):
+    """
+    Re-encrypt every Service.password_encrypted still encrypted with ENCRYPTION_KEY
+    under its owner's data key, creating data keys as needed. Each batch is
+    committed on its own and converted rows drop out of the walk, so an
+    interrupted run simply starts again. Must run inside an app context.
+    Returns the number of rows converted.
+    """
+    data_keys = current_app.extensions['data_keys']
+    log("🔑 Moving credentials onto per-user data keys")
+    started = time.perf_counter()
+    last_id, converted, failed_ids = 0, 0, []
+
+    while True:
+        rows = (db.session.query(Service.id, Service.owner_id, Service.password_encrypted)
+                .filter(Service.id > last_id,
+                        Service.owner_id.isnot(None),
+                        ~Service.password_encrypted.startswith(DATA_KEY_PREFIX))
+                .order_by(Service.id)
+                .limit(chunk_size)
+                .all())
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        by_owner = defaultdict(list)
+        for service_id, owner_id, token in rows:
+            if token:
+                by_owner[owner_id].append((service_id, token))
+        keys = data_keys.get_many(by_owner, create=True)
+
+        params = []
+        for owner_id, owner_rows in by_owner.items():
+            decrypted, failed = _decrypt_each(owner_rows)
+            failed_ids.extend(failed)
+            new_tokens = encrypt_many([plaintext for _, _, plaintext in decrypted], keys[owner_id])
+            params.extend({'b_id': service_id, 'b_old': token, 'b_new': new_token}
+                          for (service_id, token, _), new_token in zip(decrypted, new_tokens))
+        if params:
+            # Same guard as rotation: a row edited since we read it is already on a data key
+            db.session.execute(_rotate_stmt, params)
+        db.session.commit()
+
+        converted += len(params)
+        elapsed = time.perf_counter() - started
+        rate = converted / elapsed if elapsed else 0.0
+        log(f"  … {converted} rows moved (up to id {last_id}, {rate:,.0f} rows/s)")
+
+        if pause:
+            time.sleep(pause)
+
+    elapsed = time.perf_counter() - started
+    rate = converted / elapsed if elapsed else 0.0
+    log(f"✅ Data key migration finished: {converted} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+    if failed_ids:
+        log(f"⚠️  {len(failed_ids)} service(s) could not be decrypted with any configured key: {failed_ids[:20]}")
+    return converted
@@ -0,0 +1,162 @@
+"""
+Service search by name and username.
+
+The backend is chosen per database:
+- "fts"     SQLite: an FTS5 table with the trigram tokenizer (substring
+            matches), kept in sync with the service table by triggers
+- "trigram" Postgres: pg_trgm GIN indexes on lower(name) / lower(username)
+- "prefix"  anywhere: prefix matches served by the (owner_id, lower(name))
+            and (owner_id, lower(username)) indexes declared in models.py
+
+`flask upgrade-db` installs the FTS table or trigram indexes when the
+database supports them; until then, and for terms shorter than a trigram,
+searches use the prefix indexes. SERVICE_SEARCH_BACKEND pins a backend.
+
+Results are ordered by (lower(name), id) and paged with a keyset cursor,
+so a page costs the same however deep into a large vault it is.
+"""
+
+from flask import current_app
+from sqlalchemy import and_, func, inspect, or_, select, text, tuple_
+from sqlalchemy.exc import DBAPIError
+
+from models import db, Service
+
+FTS_TABLE = 'service_fts'
+TRIGRAM_INDEXES = ('ix_service_name_trgm', 'ix_service_username_trgm')
+
+# Highest code point; a prefix range ends just below term + this
+_MAX_CHAR = '\U0010ffff'
+
+# engine url -> detected backend
+_backends = {}
+
+_SQLITE_FTS = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    "name, username, content='service', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON service BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, username) VALUES (new.id, new.name, new.username); END",
+    f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON service BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, username) VALUES ('delete', old.id, old.name, old.username); END",
+    f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name, username ON service BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, username) VALUES ('delete', old.id, old.name, old.username); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, username) VALUES (new.id, new.name, new.username); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+)
+
+_POSTGRES_TRIGRAM = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEXES[0]} ON service USING gin (lower(name) gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEXES[1]} ON service USING gin (lower(username) gin_trgm_ops)",
+)
+
+
+# ---------------- INSTALL ----------------
+
+def install(log=print):
+    """Create the FTS table / trigram indexes if the database supports them"""
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'sqlite' and not inspect(db.engine).has_table(FTS_TABLE):
+            with db.engine.begin() as conn:
+                for statement in _SQLITE_FTS:
+                    conn.execute(text(statement))
+            log(f"  🔎 Created {FTS_TABLE} full-text index")
+        elif dialect == 'postgresql':
+            with db.engine.begin() as conn:
+                for statement in _POSTGRES_TRIGRAM:
+                    conn.execute(text(statement))
+    except DBAPIError as e:
+        # e.g. SQLite without the trigram tokenizer (< 3.34), or no rights to CREATE EXTENSION
+        log(f"  ⚠️  Service search will use prefix matching only: {e.orig}")
+    _backends.clear()
+
+
+def backend():
+    """The search backend in use for the current app's database"""
+    configured = current_app.config['SERVICE_SEARCH_BACKEND']
+    if configured != 'auto':
+        return configured
+
+    key = str(db.engine.url)
+    if key not in _backends:
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite' and inspect(db.engine).has_table(FTS_TABLE):
+            _backends[key] = 'fts'
+        elif dialect == 'postgresql' and db.session.execute(
+                text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+                {'name': TRIGRAM_INDEXES[0]}).first():
+            _backends[key] = 'trigram'
+        else:
+            _backends[key] = 'prefix'
+    return _backends[key]
+
+
+# ---------------- QUERIES ----------------
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _prefix_match(column, term):
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite's LIKE can't use an index on lower(...); a range scan can
+        return and_(column >= term, column < term + _MAX_CHAR)
+    return column.like(_escape_like(term) + '%', escape='\\')
+
+
+def search_condition(q):
+    """Filter on Service matching q in name or username, or None for an empty search"""
+    term = (q or '').strip().lower()
+    if not term:
+        return None
+
+    name, username = func.lower(Service.name), func.lower(Service.username)
+    method = backend()
+    # Trigram indexes can't serve terms shorter than three characters
+    if method == 'fts' and len(term) >= 3:
+        match = '"' + term.replace('"', '""') + '"'
+        return Service.id.in_(
+            select(text('rowid')).select_from(text(FTS_TABLE))
+            .where(text(f"{FTS_TABLE} MATCH :match")).params(match=match)
+        )
+    if method == 'trigram' and len(term) >= 3:
+        pattern = f"%{_escape_like(term)}%"
+        return or_(name.like(pattern, escape='\\'), username.like(pattern, escape='\\'))
+    return or_(_prefix_match(name, term), _prefix_match(username, term))
+
+
+def sort_key():
+    """The case-insensitive name results are ordered by (then Service.id)"""
+    return func.lower(Service.name)
+
+
+def encode_cursor(sort_name, service_id):
+    return f"{sort_name}_{service_id}"
+
+
+def after_cursor(query, cursor):
+    """Keyset condition: results after cursor in (lower(name), id) order; raises ValueError if malformed"""
+    sort_name, service_id = cursor.rsplit('_', 1)
+    return query.filter(tuple_(sort_key(), Service.id) > tuple_(sort_name, int(service_id)))
+
+
+def page(query, q=None, cursor=None, per_page=50):
+    """
+    One page of a query that selects Service and a sort_name column (sort_key()),
+    filtered by search q and starting after cursor. Returns (rows, next cursor).
+    Raises ValueError for a malformed cursor.
+    """
+    condition = search_condition(q)
+    if condition is not None:
+        query = query.filter(condition)
+    if cursor:
+        query = after_cursor(query, cursor)
+
+    # Fetch one extra row to know whether there is a next page
+    rows = query.order_by(sort_key(), Service.id).limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        next_cursor = encode_cursor(last.sort_name, last.Service.id)
+    return rows[:per_page], next_cursor
@@ -0,0 +1,124 @@
+"""
+Server-side session store.
+
+With SESSION_BACKEND = "database" the session cookie carries only a random
+session id; the session data lives in the SessionRecord table, keyed by a
+SHA-256 of that id. Sessions are therefore shared by every gunicorn worker,
+stay small on the wire, and can be revoked by deleting their rows
+(see revoke_user_sessions). The default "cookie" backend keeps Flask's
+signed-cookie sessions.
+
+The store talks to the database over its own short transactions, never
+through db.session, so saving a session can't commit a route's unfinished work.
+"""
+
+import hashlib
+import json
+import secrets
+from datetime import datetime
+
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import delete, insert, select, update
+from werkzeug.datastructures import CallbackDict
+
+from models import db, SessionRecord
+
+_records = SessionRecord.__table__
+
+
+def _hash_sid(sid):
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.rotate = False
+
+    def regenerate(self):
+        """Issue a fresh session id on save, e.g. at login, to prevent session fixation"""
+        self.rotate = True
+        self.modified = True
+
+
+class DatabaseSessionInterface(SessionInterface):
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with db.engine.connect() as conn:
+                row = conn.execute(
+                    select(_records.c.data, _records.c.expires_at)
+                    .where(_records.c.id == _hash_sid(sid))
+                ).first()
+            if row and row.expires_at > datetime.utcnow():
+                return ServerSideSession(json.loads(row.data), sid=sid, expires_at=row.expires_at)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Emptied session (logout): remove it from the store and the browser
+        if not session:
+            if not session.new:
+                with db.engine.begin() as conn:
+                    conn.execute(delete(SessionRecord).where(_records.c.id == _hash_sid(session.sid)))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime
+        now = datetime.utcnow()
+        # Extend the expiry only once half the lifetime has passed, so reads don't write every request
+        refresh = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.modified or refresh):
+            return
+
+        expires_at = now + lifetime
+        values = {'data': json.dumps(dict(session)), 'user_id': session.get('user_id'),
+                  'expires_at': expires_at}
+        with db.engine.begin() as conn:
+            if session.rotate or session.new:
+                if not session.new:
+                    conn.execute(delete(SessionRecord).where(_records.c.id == _hash_sid(session.sid)))
+                    session.sid = secrets.token_urlsafe(32)
+                conn.execute(insert(SessionRecord).values(id=_hash_sid(session.sid), **values))
+            else:
+                updated = conn.execute(
+                    update(SessionRecord).where(_records.c.id == _hash_sid(session.sid)).values(**values)
+                ).rowcount
+                if not updated:
+                    # Revoked or expired while this request ran: carry on as a fresh, signed-out session
+                    session.pop('user_id', None)
+                    session.sid = secrets.token_urlsafe(32)
+                    values.update(data=json.dumps(dict(session)), user_id=None)
+                    conn.execute(insert(SessionRecord).values(id=_hash_sid(session.sid), **values))
+
+        response.set_cookie(
+            name, session.sid,
+            expires=expires_at if session.permanent else None,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def revoke_user_sessions(user_id):
+    """Sign a user out everywhere by deleting all of their stored sessions"""
+    with db.engine.begin() as conn:
+        return conn.execute(delete(SessionRecord).where(_records.c.user_id == user_id)).rowcount
+
+
+def purge_expired_sessions():
+    """Delete expired sessions; returns the number removed"""
+    with db.engine.begin() as conn:
+        return conn.execute(delete(SessionRecord).where(_records.c.expires_at <= datetime.utcnow())).rowcount
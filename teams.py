@@ -0,0 +1,73 @@
+"""
+Team sharing.
+
+A Team is a group of users (TeamMember rows) that services are shared with
+through one TeamShare row per service, however many members the team has.
+A user can access a service they own, one shared with them directly (Share)
+or one shared with a team they belong to. Onboarding or offboarding a person
+is a single TeamMember insert or delete.
+
+Team access is resolved with two indexed steps: the user's teams through
+(user_id, team_id) on team_member, then those teams' services through
+(team_id, service_id) on team_share. The helpers below return queries to
+embed in the caller's statement, so a permission check or dashboard page
+stays one round trip.
+
+The team owner manages members; any member may share services they own
+with the team. Routes that change who can see a service must record the
+change for every affected member (changes.record / versions.bump) and
+call AccessControl.invalidate() after committing, as for direct shares.
+"""
+
+from sqlalchemy import func, select
+
+from models import db, Service, Team, TeamMember, TeamShare
+
+
+def service_ids_for(user_id):
+    """Select of the ids of services shared with any team user_id belongs to (may repeat ids)"""
+    return (select(TeamShare.service_id)
+            .join(TeamMember, TeamMember.team_id == TeamShare.team_id)
+            .where(TeamMember.user_id == user_id))
+
+
+def team_name_for(user_id):
+    """Correlated subquery: the first (by name) of user_id's teams that the outer Service is shared with"""
+    return (select(func.min(Team.name))
+            .join(TeamShare, TeamShare.team_id == Team.id)
+            .join(TeamMember, TeamMember.team_id == Team.id)
+            .where(TeamShare.service_id == Service.id, TeamMember.user_id == user_id)
+            .scalar_subquery())
+
+
+def is_member(team_id, user_id):
+    return db.session.scalar(select(TeamMember.id).where(TeamMember.team_id == team_id,
+                                                         TeamMember.user_id == user_id)) is not None
+
+
+def member_ids(team_id):
+    """Ids of every member of team_id"""
+    return db.session.scalars(select(TeamMember.user_id).where(TeamMember.team_id == team_id)).all()
+
+
+def service_ids(team_id):
+    """Ids of every service shared with team_id"""
+    return db.session.scalars(select(TeamShare.service_id).where(TeamShare.team_id == team_id)).all()
+
+
+def members_with_access(service_id):
+    """Ids of users who can see service_id through one of their teams"""
+    return db.session.scalars(
+        select(TeamMember.user_id).distinct()
+        .join(TeamShare, TeamShare.team_id == TeamMember.team_id)
+        .where(TeamShare.service_id == service_id)
+    ).all()
+
+
+def teams_of(user_id):
+    """Teams user_id belongs to, by name"""
+    return (Team.query
+            .join(TeamMember, TeamMember.team_id == Team.id)
+            .filter(TeamMember.user_id == user_id)
+            .order_by(func.lower(Team.name), Team.id)
+            .all())
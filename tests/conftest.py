@@ -0,0 +1,52 @@
+"""
+Test fixtures: every test gets the vault app on its own SQLite database.
+
+The per-process caches (current user, grants, data keys, rendered
+fragments) are module-level and would carry rows from one test's database
+into the next, so they are disabled here.
+"""
+
+import os
+
+import pytest
+from cryptography.fernet import Fernet
+
+# Config reads the environment when it is imported
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+
+import app as vault  # noqa: E402
+from config import Config  # noqa: E402
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'vault.db'}"
+        AUTHZ_EPOCH_FILE = str(tmp_path / 'authz.epoch')
+        AUTHZ_CACHE_SIZE = 0
+        CURRENT_USER_CACHE_TTL = 0
+        DATA_KEY_CACHE_SIZE = 0
+        FRAGMENT_CACHE_MAX_BYTES = 0
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+        MAIL_OUTBOX_WORKERS = 0
+        MAIL_SUPPRESS_SEND = True
+
+    flask_app = vault.create_app(TestConfig)
+    with flask_app.app_context():
+        vault.upgrade_schema(log=lambda *_: None)
+    yield flask_app
+    vault.outbox.stop()
+    with flask_app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id):
+    """Sign client in as user_id without going through the login form"""
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
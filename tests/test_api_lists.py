@@ -0,0 +1,40 @@
+"""Conditional API lists: the ETag identifies the representation as well as the data"""
+
+from conftest import login
+from models import db, User, Service
+
+NDJSON = 'application/x-ndjson'
+
+
+def _owner_with_services(app, count):
+    with app.app_context():
+        owner = User(email='owner@example.com', password_hash='x')
+        db.session.add(owner)
+        db.session.flush()
+        db.session.add_all([Service(name=f"Service {i}", username='me', password_encrypted='x', owner_id=owner.id)
+                            for i in range(count)])
+        db.session.commit()
+        return owner.id
+
+
+def test_json_and_ndjson_have_different_etags(app, client):
+    login(client, _owner_with_services(app, 3))
+
+    as_json = client.get('/api/v1/services')
+    as_ndjson = client.get('/api/v1/services', headers={'Accept': NDJSON})
+    assert as_json.mimetype == 'application/json'
+    assert as_ndjson.mimetype == NDJSON
+    assert as_json.headers['ETag'] != as_ndjson.headers['ETag']
+    assert client.get('/api/v1/services?stream=1').headers['ETag'] != as_json.headers['ETag']
+    for response in (as_json, as_ndjson):
+        assert 'Accept' in response.vary
+
+    # A cached JSON page does not validate an NDJSON request, and vice versa
+    stale = client.get('/api/v1/services', headers={'Accept': NDJSON, 'If-None-Match': as_json.headers['ETag']})
+    assert stale.status_code == 200
+    assert len(stale.get_data(as_text=True).splitlines()) == 3
+
+    for headers, etag in (({}, as_json.headers['ETag']), ({'Accept': NDJSON}, as_ndjson.headers['ETag'])):
+        cached = client.get('/api/v1/services', headers={**headers, 'If-None-Match': etag})
+        assert cached.status_code == 304
+        assert 'Accept' in cached.vary
@@ -0,0 +1,112 @@
+"""Email outbox delivery against a local SMTP server: sending, retry backoff and dead-lettering"""
+
+import socket
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask_mail import Message
+
+pytest.importorskip('aiosmtpd')
+from aiosmtpd.controller import Controller  # noqa: E402
+
+import app as vault  # noqa: E402
+from models import db, OutboxEmail  # noqa: E402
+
+
+def _free_port():
+    """A local port nothing is listening on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class _Inbox:
+    """aiosmtpd handler that keeps every message it accepts"""
+
+    def __init__(self):
+        self.envelopes = []
+        self.peers = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        self.peers.append(session.peer)
+        return '250 Message accepted for delivery'
+
+
+@pytest.fixture
+def smtp_server():
+    inbox = _Inbox()
+    controller = Controller(inbox, hostname='127.0.0.1', port=_free_port())
+    controller.start()
+    yield controller.port, inbox
+    controller.stop()
+
+
+def _use_smtp(app, port, **config):
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                      MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_SUPPRESS_SEND=False,
+                      MAIL_DEFAULT_SENDER='vault@example.com', **config)
+    vault.mail.init_app(app)
+
+
+def _message(recipient):
+    return Message(subject='Shared with you', recipients=[recipient], body='Hello', html='<p>Hello</p>')
+
+
+def test_worker_sends_a_batch_over_one_connection(app, smtp_server):
+    port, inbox = smtp_server
+    _use_smtp(app, port, MAIL_OUTBOX_WORKERS=1, MAIL_OUTBOX_POLL_INTERVAL=0.05)
+
+    with app.app_context():
+        vault.outbox.enqueue_many([_message(f"user{i}@example.com") for i in range(3)])
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and len(inbox.envelopes) < 3:
+            time.sleep(0.05)
+        vault.outbox.stop(timeout=5)
+
+        rows = OutboxEmail.query.order_by(OutboxEmail.id).all()
+        assert [(row.status, row.attempts) for row in rows] == [('sent', 1)] * 3
+        assert all(row.sent_at is not None for row in rows)
+
+    assert sorted(envelope.rcpt_tos[0] for envelope in inbox.envelopes) == [
+        'user0@example.com', 'user1@example.com', 'user2@example.com']
+    assert all(envelope.mail_from == 'vault@example.com' for envelope in inbox.envelopes)
+    assert len(set(inbox.peers)) == 1  # one SMTP connection for the whole batch
+
+
+def test_refused_connection_backs_off_then_dead_letters(app, smtp_server):
+    _use_smtp(app, _free_port(), MAIL_OUTBOX_MAX_ATTEMPTS=3, MAIL_OUTBOX_RETRY_BASE=30)
+
+    with app.app_context():
+        vault.outbox.enqueue(_message('user@example.com'))
+
+        def attempt():
+            """Make the message due and run one delivery pass"""
+            OutboxEmail.query.update({'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+            db.session.commit()
+            return vault.outbox.drain()
+
+        for attempts, delay in ((1, 30), (2, 60)):
+            assert attempt() == 1
+            row = OutboxEmail.query.one()
+            assert (row.status, row.attempts) == ('pending', attempts)
+            assert 'refused' in row.last_error.lower()
+            wait = (row.next_attempt_at - datetime.utcnow()).total_seconds()
+            assert delay - 5 < wait <= delay
+            assert vault.outbox.drain() == 0  # not due again until the backoff has passed
+
+        assert attempt() == 1
+        row = OutboxEmail.query.one()
+        assert (row.status, row.attempts) == ('dead', 3)
+        assert attempt() == 0  # dead letters are never retried on their own
+
+        # Once the server is reachable, requeued dead letters are delivered
+        port, inbox = smtp_server
+        _use_smtp(app, port)
+        assert vault.outbox.requeue_dead() == 1
+        assert vault.outbox.drain() == 1
+        row = OutboxEmail.query.one()
+        assert (row.status, row.attempts) == ('sent', 1)
+    assert [envelope.rcpt_tos for envelope in inbox.envelopes] == [['user@example.com']]
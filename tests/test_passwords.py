@@ -0,0 +1,71 @@
+"""Password hashing: rehashing only on real parameter changes, and a bounded, time-limited hash pool"""
+
+import os
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from auth import authenticate
+from models import db, User
+from passwords import HashingBusy
+
+
+@pytest.mark.parametrize('method', ['pbkdf2:sha256:1000', 'scrypt'])
+def test_hash_made_with_configured_method_is_not_rehashed(app, method):
+    app.config['PASSWORD_HASH_METHOD'] = method
+    hasher = app.extensions['password_hasher']
+    hasher.init_app(app)
+
+    assert not hasher.needs_rehash(hasher.hash('secret123'))
+    # Werkzeug's defaults spelled out, as a hash made elsewhere would store them
+    assert not hasher.needs_rehash(generate_password_hash('secret123', method))
+
+
+def test_login_upgrades_outdated_hash_once(app):
+    hasher = app.extensions['password_hasher']
+    with app.app_context():
+        user = User(email='a@example.com', password_hash=generate_password_hash('secret123', 'pbkdf2:sha256:500'))
+        db.session.add(user)
+        db.session.commit()
+
+        assert authenticate('a@example.com', 'secret123') is not None
+        upgraded = db.session.get(User, user.id).password_hash
+        assert upgraded.startswith(hasher.method + '$')
+
+        assert authenticate('a@example.com', 'secret123') is not None
+        assert db.session.get(User, user.id).password_hash == upgraded
+
+
+@pytest.fixture
+def pooled_hasher(app):
+    """One pool worker, one pending slot and a short timeout"""
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_MAX_PENDING=1, PASSWORD_HASH_TIMEOUT=0.5)
+    hasher = app.extensions['password_hasher']
+    hasher.init_app(app)
+    assert hasher._run(abs, -1) == 1  # start the worker process outside the timed part
+    yield hasher
+    hasher.shutdown()
+
+
+def test_slow_hash_is_busy_and_keeps_its_slot_until_done(pooled_hasher):
+    started = time.monotonic()
+    with pytest.raises(HashingBusy):
+        pooled_hasher._run(time.sleep, 2)
+    # The job is still running in the pool, so its slot is still taken
+    with pytest.raises(HashingBusy):
+        pooled_hasher._run(abs, -1)
+
+    assert pooled_hasher._slots.acquire(timeout=10)
+    assert time.monotonic() - started >= 2
+    pooled_hasher._slots.release()
+    assert pooled_hasher._run(abs, -1) == 1
+
+
+def test_crashed_pool_is_busy_and_replaced(pooled_hasher):
+    broken = pooled_hasher._pool
+    with pytest.raises(HashingBusy):
+        pooled_hasher._run(os._exit, 1)
+    assert pooled_hasher._pool is None
+    assert pooled_hasher._run(abs, -1) == 1
+    assert pooled_hasher._pool is not broken
@@ -0,0 +1,64 @@
+"""The dashboard and My Shares run a fixed number of SQL statements, however many shares there are"""
+
+import pytest
+from sqlalchemy import event
+
+from conftest import login
+from models import db, User, Service, Share
+
+
+def _add_shares(owner_id, start, stop):
+    """Share one of owner's services with each of users start..stop-1, who each share one back"""
+    for i in range(start, stop):
+        other = User(email=f"user{i}@example.com", password_hash='x')
+        db.session.add(other)
+        db.session.flush()
+        mine = Service(name=f"Mine {i}", username='me', password_encrypted='x', owner_id=owner_id)
+        theirs = Service(name=f"Theirs {i}", username='them', password_encrypted='x', owner_id=other.id)
+        db.session.add_all([mine, theirs])
+        db.session.flush()
+        db.session.add_all([
+            Share(service_id=mine.id, shared_to=other.id, shared_by=owner_id),
+            Share(service_id=theirs.id, shared_to=owner_id, shared_by=other.id),
+        ])
+    db.session.commit()
+
+
+def _statements(app, client, path):
+    """(SQL statements run by one GET of path, response body)"""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert response.status_code == 200
+    return statements, response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('path', ['/dashboard', '/my-shares'])
+def test_statement_count_does_not_grow_with_shares(app, client, path):
+    with app.app_context():
+        owner = User(email='owner@example.com', password_hash='x')
+        db.session.add(owner)
+        db.session.commit()
+        owner_id = owner.id
+        _add_shares(owner_id, 0, 5)
+    login(client, owner_id)
+    client.get(path)  # first request warms per-process lookups (search backend, templates)
+
+    with_5, _ = _statements(app, client, path)
+    with app.app_context():
+        _add_shares(owner_id, 5, 50)
+    with_50, page = _statements(app, client, path)
+
+    assert 'user49@example.com' in page
+
+    assert len(with_50) == len(with_5), "\n".join(with_50)
+    assert len(with_5) <= 15
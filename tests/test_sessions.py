@@ -0,0 +1,47 @@
+"""Server-side sessions: revoking a user's sessions signs them out of every browser"""
+
+import pytest
+
+from models import db, User
+from sessions import DatabaseSessionInterface
+
+
+@pytest.fixture
+def database_sessions(app):
+    app.config['SESSION_BACKEND'] = 'database'
+    app.session_interface = DatabaseSessionInterface()
+    return app
+
+
+def _signed_in_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client
+
+
+def test_revoke_sessions_signs_the_user_out_everywhere(database_sessions):
+    app = database_sessions
+    with app.app_context():
+        users = [User(email=f"user{i}@example.com", password_hash='x') for i in range(2)]
+        db.session.add_all(users)
+        db.session.commit()
+        user_id, other_id = [user.id for user in users]
+    browsers = [_signed_in_client(app, user_id) for _ in range(2)]
+    bystander = _signed_in_client(app, other_id)
+    for client in (*browsers, bystander):
+        assert client.get('/dashboard').status_code == 200
+
+    result = app.test_cli_runner().invoke(args=['revoke-sessions', 'USER0@example.com'])
+    assert result.exit_code == 0, result.output
+    assert 'Revoked 2 session(s)' in result.output
+
+    for client in browsers:
+        assert client.get('/dashboard').status_code == 302
+    assert bystander.get('/dashboard').status_code == 200
+
+
+def test_revoke_sessions_needs_the_database_backend(app):
+    result = app.test_cli_runner().invoke(args=['revoke-sessions', 'user@example.com'])
+    assert result.exit_code != 0
+    assert 'SESSION_BACKEND=database' in result.output
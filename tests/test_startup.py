@@ -0,0 +1,43 @@
+"""Cold import of the app, which every gunicorn worker, CLI command and test run pays"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative `import app` time in a fresh interpreter; raise it with IMPORT_TIME_BUDGET_MS on slow runners
+IMPORT_TIME_BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', 1000))
+
+# Only some requests (or only the tests) need these; they must be imported on first use
+LAZY_MODULES = ('prometheus_client', 'aiosmtpd')
+
+
+def _python(tmp_path, *args):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path / 'vault.db'}")
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def _cumulative_ms(importtime_output, module):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module and len(name) - len(name.lstrip()) == 1:
+            return int(cumulative) / 1000
+    raise AssertionError(f"{module} not in -X importtime output")
+
+
+def test_import_app_within_budget(tmp_path):
+    out = _python(tmp_path, '-X', 'importtime', '-c', 'import app')
+    elapsed = _cumulative_ms(out.stderr, 'app')
+    assert elapsed < IMPORT_TIME_BUDGET_MS, f"import app took {elapsed:.0f} ms (budget {IMPORT_TIME_BUDGET_MS:.0f} ms)"
+
+
+def test_import_app_is_lazy(tmp_path):
+    out = _python(tmp_path, '-c', f"import sys, app; print(*[m for m in {LAZY_MODULES!r} if m in sys.modules])")
+    assert out.stdout.strip() == '', f"imported eagerly: {out.stdout.strip()}"
+    # Schema creation is an explicit `flask upgrade-db` step, not a side effect of importing
+    assert not (tmp_path / 'vault.db').exists()
@@ -0,0 +1,53 @@
+"""
+Per-user change counters.
+
+Each user has a counter that is bumped, in the same transaction, by every
+change to the services, shares or invites they can list. The API derives
+ETag / Last-Modified from it, so a client polling an unchanged vault gets
+304 Not Modified without the lists being queried at all.
+
+Routes that modify those tables must call bump() for every affected user
+before committing; changes.record() does so for service and share changes.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, UserVersion
+
+_UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def bump(*user_ids):
+    """Increment the counters of user_ids as part of the current transaction"""
+    user_ids = sorted({user_id for user_id in user_ids if user_id is not None})
+    if not user_ids:
+        return
+    now = datetime.utcnow()
+
+    upsert = _UPSERT_DIALECTS.get(db.session.get_bind().dialect.name)
+    if upsert is not None:
+        stmt = upsert(UserVersion).values([{'user_id': user_id, 'version': 1, 'updated_at': now}
+                                           for user_id in user_ids])
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={'version': UserVersion.version + 1, 'updated_at': now},
+        ))
+        return
+
+    db.session.execute(update(UserVersion)
+                       .where(UserVersion.user_id.in_(user_ids))
+                       .values(version=UserVersion.version + 1, updated_at=now))
+    existing = set(db.session.scalars(select(UserVersion.user_id).where(UserVersion.user_id.in_(user_ids))))
+    db.session.add_all(UserVersion(user_id=user_id, version=1, updated_at=now)
+                       for user_id in user_ids if user_id not in existing)
+
+
+def current(user_id):
+    """(version, updated_at) for user_id; (0, None) if nothing has changed yet"""
+    row = db.session.execute(
+        select(UserVersion.version, UserVersion.updated_at).where(UserVersion.user_id == user_id)
+    ).first()
+    return (row.version, row.updated_at) if row else (0, None)